@@ -3,6 +3,15 @@ from src.routes.example_routes import example_bp
 from src.routes.device_routes import device_bp
 from src.routes.brain_routes import brain_bp
 from src.services.brain_service import init_brain_agent_with_app
+from src.services.elasticsearch_client import init_es_client
+from src.services.device_index import bootstrap_device_index
+from src.services.device_cache import init_device_cache, get_device_cache
+from src.services.device_service import add_device_change_listener
+from src.services.brain_jobs import init_brain_jobs
+from src.services.health_sweep import init_health_sweep, get_health_sweep
+from src.services.conversation_store import init_conversation_store, get_conversation_store
+from src.brain_agent.llm_registry import init_llm_registry
+from src.brain_agent.testbed_manager import get_testbed_manager, testbed_manager_stats
 import logging
 
 def create_app():
@@ -14,6 +23,37 @@ def create_app():
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     app.logger.setLevel(logging.DEBUG) # Flask app specific logger level
 
+    # Shared Elasticsearch client (app-level singleton in app.extensions), used by DeviceService and agent tools
+    es_client = init_es_client(app)
+
+    # Create/migrate the device index and its typed mapping once at startup instead of on every request.
+    try:
+        bootstrap_device_index(
+            es_client,
+            app.config['ELASTICSEARCH_DEVICES_INDEX'],
+            migrate_legacy=app.config.get('ELASTICSEARCH_DEVICES_INDEX_AUTO_MIGRATE', True)
+        )
+    except Exception as e:
+        app.logger.critical(f"Failed to bootstrap Elasticsearch device index during app creation: {e}", exc_info=True)
+
+    # Per-process read-through cache in front of DeviceService single-device reads
+    init_device_cache(app)
+
+    # Bounded conversation history backend used by BrainService
+    try:
+        init_conversation_store(app)
+    except Exception as e:
+        app.logger.critical(f"Failed to initialize the conversation store during app creation: {e}", exc_info=True)
+
+    # Shared, pooled chat model clients per role (main agent, planner, inspector, ...)
+    init_llm_registry(app)
+
+    # Start loading the PyATS testbed in the background; nothing here waits for ES or the testbed parse.
+    with app.app_context():
+        testbed_manager = get_testbed_manager()
+    # Device CRUD through the API edits the live testbed in place instead of waiting for the next sync
+    add_device_change_listener(testbed_manager.apply_device_changes)
+
     # Initialize Brain Agent (app-level singleton)
     # This ensures the agent is ready, or logs critical errors if init fails.
     try:
@@ -23,6 +63,18 @@ def create_app():
         # Depending on policy, you might want the app to not start if the brain is critical.
         # For now, it will log, and the brain service will report unavailability.
 
+    # Background worker pool and job store for POST /api/brain/jobs
+    try:
+        init_brain_jobs(app)
+    except Exception as e:
+        app.logger.critical(f"Failed to initialize the brain job queue during app creation: {e}", exc_info=True)
+
+    # Periodic CPU/memory/interface sampling of every testbed device into the metrics indices
+    try:
+        init_health_sweep(app, es_client)
+    except Exception as e:
+        app.logger.critical(f"Failed to start the health sweep during app creation: {e}", exc_info=True)
+
     # Register blueprints
     app.register_blueprint(example_bp, url_prefix='/api/example')
     app.register_blueprint(device_bp, url_prefix='/api/devices')
@@ -36,7 +88,17 @@ def create_app():
         if get_brain_agent_instance() is None:
             brain_status = "DEGRADED (Brain Agent Not Initialized)"
             app.logger.warning("Health check: Brain Agent is not initialized.")
-        return jsonify({"status": "OK", "brain_service": brain_status})
+        device_cache = get_device_cache()
+        health_sweep = get_health_sweep()
+        conversation_store = get_conversation_store()
+        return jsonify({
+            "status": "OK",
+            "brain_service": brain_status,
+            "device_cache": device_cache.stats() if device_cache else None,
+            "conversation_store": conversation_store.stats() if conversation_store else None,
+            "pyats_testbed": testbed_manager_stats(),
+            "health_sweep": health_sweep.stats() if health_sweep else None
+        })
 
     return app
 
@@ -6,9 +6,111 @@ load_dotenv() # Load environment variables from .env file
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'you-will-never-guess'
     ELASTICSEARCH_HOST = os.environ.get('ELASTICSEARCH_HOST') or 'http://localhost:9200'
-    ELASTICSEARCH_DEVICES_INDEX = os.environ.get('ELASTICSEARCH_DEVICES_INDEX') or 'devices_index'
+    ELASTICSEARCH_DEVICES_INDEX = os.environ.get('ELASTICSEARCH_DEVICES_INDEX') or 'devices_index' # Alias over devices_index_v<N>
+    # Reindex a legacy, dynamically mapped devices index into the versioned mapping on startup
+    ELASTICSEARCH_DEVICES_INDEX_AUTO_MIGRATE = os.environ.get('ELASTICSEARCH_DEVICES_INDEX_AUTO_MIGRATE', 'true').lower() == 'true'
+    # Cursor pagination for GET /devices (point-in-time + search_after)
+    DEVICE_LIST_DEFAULT_LIMIT = int(os.environ.get('DEVICE_LIST_DEFAULT_LIMIT') or 100)
+    DEVICE_LIST_MAX_LIMIT = int(os.environ.get('DEVICE_LIST_MAX_LIMIT') or 1000)
+    DEVICE_LIST_PIT_KEEP_ALIVE = os.environ.get('DEVICE_LIST_PIT_KEEP_ALIVE') or '2m'
+    # Streaming NDJSON export (GET /devices/export) via sliced scroll
+    DEVICE_EXPORT_SLICES = int(os.environ.get('DEVICE_EXPORT_SLICES') or 4)
+    DEVICE_EXPORT_BATCH_SIZE = int(os.environ.get('DEVICE_EXPORT_BATCH_SIZE') or 1000)
+    DEVICE_EXPORT_SCROLL_KEEP_ALIVE = os.environ.get('DEVICE_EXPORT_SCROLL_KEEP_ALIVE') or '2m'
+    # Bulk ingest (POST /devices/_bulk); refresh is one of 'false', 'true', 'wait_for'
+    DEVICE_BULK_CHUNK_SIZE = int(os.environ.get('DEVICE_BULK_CHUNK_SIZE') or 500)
+    DEVICE_BULK_REFRESH = os.environ.get('DEVICE_BULK_REFRESH') or 'false'
+    # Read-through device cache; set DEVICE_CACHE_INVALIDATION_DB (a local SQLite file) to share invalidations across workers
+    DEVICE_CACHE_ENABLED = os.environ.get('DEVICE_CACHE_ENABLED', 'true').lower() == 'true'
+    DEVICE_CACHE_MAX_ENTRIES = int(os.environ.get('DEVICE_CACHE_MAX_ENTRIES') or 10000)
+    DEVICE_CACHE_TTL_SECONDS = float(os.environ.get('DEVICE_CACHE_TTL_SECONDS') or 30)
+    DEVICE_CACHE_INVALIDATION_DB = os.environ.get('DEVICE_CACHE_INVALIDATION_DB')
+    DEVICE_CACHE_INVALIDATION_POLL_SECONDS = float(os.environ.get('DEVICE_CACHE_INVALIDATION_POLL_SECONDS') or 1)
+    # Shared Elasticsearch client (one per process, see src/services/elasticsearch_client.py)
+    ELASTICSEARCH_CONNECTIONS_PER_NODE = int(os.environ.get('ELASTICSEARCH_CONNECTIONS_PER_NODE') or 10)
+    ELASTICSEARCH_REQUEST_TIMEOUT = float(os.environ.get('ELASTICSEARCH_REQUEST_TIMEOUT') or 10)
+    ELASTICSEARCH_MAX_RETRIES = int(os.environ.get('ELASTICSEARCH_MAX_RETRIES') or 3)
+    ELASTICSEARCH_RETRY_ON_TIMEOUT = os.environ.get('ELASTICSEARCH_RETRY_ON_TIMEOUT', 'true').lower() == 'true'
+    ELASTICSEARCH_SNIFF_ON_START = os.environ.get('ELASTICSEARCH_SNIFF_ON_START', 'false').lower() == 'true'
+    ELASTICSEARCH_SNIFF_ON_NODE_FAILURE = os.environ.get('ELASTICSEARCH_SNIFF_ON_NODE_FAILURE', 'false').lower() == 'true'
+    ELASTICSEARCH_MIN_DELAY_BETWEEN_SNIFFING = float(os.environ.get('ELASTICSEARCH_MIN_DELAY_BETWEEN_SNIFFING') or 60)
     OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
     PYATS_TESTBED_FILE = os.environ.get('PYATS_TESTBED_FILE') # For PyATS tools
+    # The testbed is loaded and refreshed by a background thread; tools never wait on ES except for the first load
+    PYATS_TESTBED_REFRESH_SECONDS = int(os.environ.get('PYATS_TESTBED_REFRESH_SECONDS') or 300)
+    PYATS_TESTBED_LOAD_TIMEOUT_SECONDS = int(os.environ.get('PYATS_TESTBED_LOAD_TIMEOUT_SECONDS') or 30)
+    PYATS_TESTBED_MISS_REFRESH_SECONDS = int(os.environ.get('PYATS_TESTBED_MISS_REFRESH_SECONDS') or 60) # Min. age before an unknown device forces a refresh
+    PYATS_TESTBED_SYNC_PAGE_SIZE = int(os.environ.get('PYATS_TESTBED_SYNC_PAGE_SIZE') or 1000) # Management IPs per page when syncing from the device index
+    # PyATS session pool: live device sessions are reused across tool calls instead of reconnecting each time
+    PYATS_SESSION_MAX_PER_DEVICE = int(os.environ.get('PYATS_SESSION_MAX_PER_DEVICE') or 2)
+    PYATS_SESSION_IDLE_TTL_SECONDS = int(os.environ.get('PYATS_SESSION_IDLE_TTL_SECONDS') or 300)
+    PYATS_SESSION_ACQUIRE_TIMEOUT_SECONDS = int(os.environ.get('PYATS_SESSION_ACQUIRE_TIMEOUT_SECONDS') or 60)
+    PYATS_SESSION_HEALTH_CHECK_AFTER_SECONDS = int(os.environ.get('PYATS_SESSION_HEALTH_CHECK_AFTER_SECONDS') or 30)
+    PYATS_SESSION_CONNECT_VIA = os.environ.get('PYATS_SESSION_CONNECT_VIA') # Testbed connection to use, e.g. 'cli'
+    # Diagnostic plan execution: steps on different devices run in parallel, same-device steps stay in order
+    PYATS_PLAN_MAX_WORKERS = int(os.environ.get('PYATS_PLAN_MAX_WORKERS') or 4)
+    PYATS_PLAN_STEP_TIMEOUT_SECONDS = int(os.environ.get('PYATS_PLAN_STEP_TIMEOUT_SECONDS') or 120)
+    # Asynchronous brain jobs (POST /brain/jobs); records live in a local SQLite file shared by all workers
+    BRAIN_JOB_WORKERS = int(os.environ.get('BRAIN_JOB_WORKERS') or 4)
+    BRAIN_JOB_MAX_ACTIVE_PER_TENANT = int(os.environ.get('BRAIN_JOB_MAX_ACTIVE_PER_TENANT') or 2)
+    BRAIN_JOB_DB_PATH = os.environ.get('BRAIN_JOB_DB_PATH') or 'instance/brain_jobs.sqlite3'
+    BRAIN_JOB_TTL_SECONDS = int(os.environ.get('BRAIN_JOB_TTL_SECONDS') or 86400)
+    # Conversation history for /brain queries: 'memory' (per worker) or 'sqlite' (shared by all workers on the host)
+    CONVERSATION_STORE_BACKEND = os.environ.get('CONVERSATION_STORE_BACKEND') or 'memory'
+    CONVERSATION_STORE_DB_PATH = os.environ.get('CONVERSATION_STORE_DB_PATH') or 'instance/conversations.sqlite3'
+    CONVERSATION_STORE_MAX_SESSIONS = int(os.environ.get('CONVERSATION_STORE_MAX_SESSIONS') or 1000)
+    CONVERSATION_STORE_TTL_SECONDS = int(os.environ.get('CONVERSATION_STORE_TTL_SECONDS') or 86400)
+    # Brain agent history compaction: beyond the budget (in tokens), older turns are replaced by a rolling summary
+    BRAIN_HISTORY_TOKEN_BUDGET = int(os.environ.get('BRAIN_HISTORY_TOKEN_BUDGET') or 6000)
+    BRAIN_HISTORY_RECENT_TOKENS = int(os.environ.get('BRAIN_HISTORY_RECENT_TOKENS') or 3000)
+    BRAIN_HISTORY_SUMMARY_CACHE_SIZE = int(os.environ.get('BRAIN_HISTORY_SUMMARY_CACHE_SIZE') or 256)
+    # Response cache for deterministic sub-LLM calls (diagnostic planning, config inspection); set LLM_CACHE_DB_PATH for a shared disk tier
+    LLM_CACHE_ENABLED = os.environ.get('LLM_CACHE_ENABLED', 'true').lower() == 'true'
+    LLM_CACHE_MAX_ENTRIES = int(os.environ.get('LLM_CACHE_MAX_ENTRIES') or 512)
+    LLM_CACHE_TTL_SECONDS = int(os.environ.get('LLM_CACHE_TTL_SECONDS') or 600)
+    LLM_CACHE_DB_PATH = os.environ.get('LLM_CACHE_DB_PATH')
+    # LLM client registry: per-role model and timeout (roles: MAIN_AGENT, PLANNER, INSPECTOR, CONFIG_GENERATOR, SUMMARIZER)
+    LLM_MAIN_AGENT_MODEL = os.environ.get('LLM_MAIN_AGENT_MODEL') or 'gpt-4-turbo-preview'
+    LLM_MAIN_AGENT_TIMEOUT_SECONDS = float(os.environ.get('LLM_MAIN_AGENT_TIMEOUT_SECONDS') or 60)
+    LLM_PLANNER_MODEL = os.environ.get('LLM_PLANNER_MODEL') or 'gpt-3.5-turbo'
+    LLM_PLANNER_TIMEOUT_SECONDS = float(os.environ.get('LLM_PLANNER_TIMEOUT_SECONDS') or 30)
+    LLM_INSPECTOR_MODEL = os.environ.get('LLM_INSPECTOR_MODEL') or 'gpt-3.5-turbo'
+    LLM_INSPECTOR_TIMEOUT_SECONDS = float(os.environ.get('LLM_INSPECTOR_TIMEOUT_SECONDS') or 30)
+    LLM_CONFIG_GENERATOR_MODEL = os.environ.get('LLM_CONFIG_GENERATOR_MODEL') or 'gpt-4-turbo-preview'
+    LLM_CONFIG_GENERATOR_TIMEOUT_SECONDS = float(os.environ.get('LLM_CONFIG_GENERATOR_TIMEOUT_SECONDS') or 60)
+    LLM_SUMMARIZER_MODEL = os.environ.get('LLM_SUMMARIZER_MODEL') or 'gpt-3.5-turbo'
+    LLM_SUMMARIZER_TIMEOUT_SECONDS = float(os.environ.get('LLM_SUMMARIZER_TIMEOUT_SECONDS') or 30)
+    LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES') or 2)
+    LLM_HTTP_MAX_CONNECTIONS = int(os.environ.get('LLM_HTTP_MAX_CONNECTIONS') or 20)
+    LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get('LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS') or 10)
+    # Running-config cache for config inspection; a cheap per-OS change probe decides whether to re-fetch (IOS and NX-OS
+    # have none and rely on the max age, so changes made outside apply_configuration_fix can show up that late)
+    RUNNING_CONFIG_CACHE_MAX_DEVICES = int(os.environ.get('RUNNING_CONFIG_CACHE_MAX_DEVICES') or 256)
+    RUNNING_CONFIG_CACHE_MAX_AGE_SECONDS = int(os.environ.get('RUNNING_CONFIG_CACHE_MAX_AGE_SECONDS') or 3600)
+    # Genie parse results per (device, command, OS); short-lived, so repeat checks within one diagnosis parse once
+    PYATS_PARSE_CACHE_TTL_SECONDS = int(os.environ.get('PYATS_PARSE_CACHE_TTL_SECONDS') or 30)
+    PYATS_PARSE_CACHE_MAX_ENTRIES = int(os.environ.get('PYATS_PARSE_CACHE_MAX_ENTRIES') or 512)
+    # Syslog receiver (python -m src.services.syslog_receiver) and the daily '<prefix>-YYYY.MM.DD' indices it writes
+    SYSLOG_BIND_HOST = os.environ.get('SYSLOG_BIND_HOST') or '0.0.0.0'
+    SYSLOG_UDP_PORT = int(os.environ.get('SYSLOG_UDP_PORT') or 5514) # 514 needs root; forward or map it
+    SYSLOG_TCP_PORT = int(os.environ.get('SYSLOG_TCP_PORT') or 5514)
+    SYSLOG_INDEX_PREFIX = os.environ.get('SYSLOG_INDEX_PREFIX') or 'syslog'
+    SYSLOG_BATCH_SIZE = int(os.environ.get('SYSLOG_BATCH_SIZE') or 500)
+    SYSLOG_FLUSH_INTERVAL_SECONDS = float(os.environ.get('SYSLOG_FLUSH_INTERVAL_SECONDS') or 1)
+    SYSLOG_QUEUE_SIZE = int(os.environ.get('SYSLOG_QUEUE_SIZE') or 20000)
+    # Background fleet health sweep into the daily '<prefix>-YYYY.MM.DD' metrics indices. Off by default. The workers on a
+    # host elect one sweeper through a lease in HEALTH_SWEEP_LEASE_DB_PATH; the others stay idle until its lease lapses
+    HEALTH_SWEEP_ENABLED = os.environ.get('HEALTH_SWEEP_ENABLED', 'false').lower() == 'true'
+    HEALTH_SWEEP_LEASE_DB_PATH = os.environ.get('HEALTH_SWEEP_LEASE_DB_PATH') or 'instance/health_sweep.sqlite3'
+    HEALTH_SWEEP_INTERVAL_SECONDS = int(os.environ.get('HEALTH_SWEEP_INTERVAL_SECONDS') or 300)
+    HEALTH_SWEEP_JITTER_SECONDS = int(os.environ.get('HEALTH_SWEEP_JITTER_SECONDS') or 30)
+    HEALTH_SWEEP_WORKERS = int(os.environ.get('HEALTH_SWEEP_WORKERS') or 8) # Devices polled concurrently
+    HEALTH_SWEEP_COLLECT_INTERFACES = os.environ.get('HEALTH_SWEEP_COLLECT_INTERFACES', 'true').lower() == 'true'
+    HEALTH_SWEEP_BATCH_SIZE = int(os.environ.get('HEALTH_SWEEP_BATCH_SIZE') or 500)
+    HEALTH_METRICS_INDEX_PREFIX = os.environ.get('HEALTH_METRICS_INDEX_PREFIX') or 'device-health'
+    # Metric anomaly detection: each recent bucket is compared with the baseline of the buckets before it
+    ANOMALY_BASELINE_MINUTES = int(os.environ.get('ANOMALY_BASELINE_MINUTES') or 180)
+    ANOMALY_Z_THRESHOLD = float(os.environ.get('ANOMALY_Z_THRESHOLD') or 3.0)
     # Add other global config settings here
 
 class DevelopmentConfig(Config):
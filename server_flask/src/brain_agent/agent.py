@@ -1,14 +1,16 @@
 from langgraph.graph import StateGraph, END
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, ToolMessage, SystemMessage
-from langchain_openai import ChatOpenAI
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, AIMessageChunk, ToolMessage, SystemMessage
+from langchain_core.runnables import RunnableLambda
 from langgraph.prebuilt import ToolExecutor, ToolInvocation
-from typing import TypedDict, Annotated, Sequence, List, Optional, Dict, Any
+from typing import TypedDict, Annotated, Sequence, List, Optional, Dict, Any, Iterator
 import operator
 import logging
+import time
 from flask import current_app
-from langchain.chat_models import init_chat_model
 
 from .tools import all_tools # Your defined tools
+from .history_compaction import HistoryCompactor, NO_STREAM_TAG
+from .llm_registry import get_llm, ROLE_MAIN_AGENT, ROLE_SUMMARIZER
 
 logger = logging.getLogger(__name__)
 
@@ -45,13 +47,18 @@ class BrainLangGraphAgent:
         if not current_app.config.get('OPENAI_API_KEY'):
             raise ValueError("OPENAI_API_KEY is not set in the configuration.")
         
-        self.llm = init_chat_model(
-            model="gpt-4-turbo-preview", # Or your preferred model
-            openai_api_key=current_app.config['OPENAI_API_KEY'],
-            temperature=0.1,
-            model_provider="openai"
-        )
+        # Shared, pooled client from the app's LLM registry (model/timeout via LLM_MAIN_AGENT_* settings)
+        self.llm = get_llm(ROLE_MAIN_AGENT)
         self.tool_executor = ToolExecutor(all_tools)
+        # Runs tool invocations concurrently (like ToolExecutor.batch) while timing each one.
+        self._timed_tool_runner = RunnableLambda(self._run_tool_timed)
+        # Folds older turns into a cached rolling summary once the history exceeds its token budget.
+        self.history_compactor = HistoryCompactor(
+            get_llm(ROLE_SUMMARIZER),
+            token_budget=current_app.config.get('BRAIN_HISTORY_TOKEN_BUDGET', 6000),
+            recent_tokens=current_app.config.get('BRAIN_HISTORY_RECENT_TOKENS', 3000),
+            cache_size=current_app.config.get('BRAIN_HISTORY_SUMMARY_CACHE_SIZE', 256),
+        )
         self.graph = self._build_graph()
         self.system_prompt_content = system_prompt or DEFAULT_SYSTEM_PROMPT
 
@@ -74,10 +81,16 @@ class BrainLangGraphAgent:
         # Filter out any existing SystemMessage from `messages` to avoid duplication if graph loops
         # and messages are passed through. This is a simple way; more complex history management might be needed.
         user_and_tool_messages = [msg for msg in messages if not isinstance(msg, SystemMessage)]
+        user_and_tool_messages = self.history_compactor.compact(user_and_tool_messages)
         
         response = self.llm.invoke([system_message] + user_and_tool_messages)
         return {"messages": [response]} # The new AIMessage is added to the list of messages
 
+    def _run_tool_timed(self, action: ToolInvocation) -> Dict[str, Any]:
+        started = time.monotonic()
+        output = self.tool_executor.invoke(action)
+        return {"output": output, "duration_ms": round((time.monotonic() - started) * 1000)}
+
     def _call_tool_executor(self, state: AgentState):
         messages = state['messages']
         last_message = messages[-1]
@@ -112,15 +125,16 @@ class BrainLangGraphAgent:
                 "tool_call_id": tool_call["id"]
             })
         
-        responses = self.tool_executor.batch(actions)
+        timed_responses = self._timed_tool_runner.batch(actions)
         
         tool_messages: List[ToolMessage] = []
 
-        for i, (action, response_content, tool_detail) in enumerate(zip(actions, responses, tool_call_details_for_summary)):
+        for i, (action, timed_response, tool_detail) in enumerate(zip(actions, timed_responses, tool_call_details_for_summary)):
+            response_content = timed_response["output"]
             tool_messages.append(
                 ToolMessage(content=str(response_content), name=action.tool, tool_call_id=tool_detail["tool_call_id"])
             )
-            tool_summary_entry = {**tool_detail, "tool_output": str(response_content)}
+            tool_summary_entry = {**tool_detail, "tool_output": str(response_content), "duration_ms": timed_response["duration_ms"]}
             updated_actions_summary.append(tool_summary_entry)
 
             # Update state based on specific tool calls
@@ -170,10 +184,7 @@ class BrainLangGraphAgent:
         workflow.add_edge("action", "agent")
         return workflow.compile()
 
-    def invoke(self, query: str, tenant_id: str, session_id: Optional[str] = None, conversation_history: Optional[List[BaseMessage]] = None):
-        # session_id can be used to load/store conversation history for follow-up questions.
-        # tenant_id might be used to scope tools or provide context if needed.
-        
+    def _build_inputs(self, query: str, conversation_history: Optional[List[BaseMessage]] = None) -> Dict[str, Any]:
         # Prepare initial messages: start with history (if any), then the new user query.
         # The system prompt will be added by _call_model node in the graph.
         initial_messages: List[BaseMessage] = []
@@ -181,7 +192,8 @@ class BrainLangGraphAgent:
             initial_messages.extend(conversation_history)
         initial_messages.append(HumanMessage(content=query))
 
-        inputs = {
+        # If you add tenant_id to AgentState and need it globally: inputs["tenant_id"] = tenant_id
+        return {
             "messages": initial_messages,
             "actions_taken_summary": [], # Initialize as an empty list for each new invocation run
             # Initialize new state fields
@@ -189,10 +201,60 @@ class BrainLangGraphAgent:
             "pending_config_commands": None,
             "is_awaiting_config_confirmation": False,
         }
-        # If you add tenant_id to AgentState and need it globally: inputs["tenant_id"] = tenant_id
 
+    def invoke(self, query: str, tenant_id: str, session_id: Optional[str] = None, conversation_history: Optional[List[BaseMessage]] = None):
+        # session_id can be used to load/store conversation history for follow-up questions.
+        # tenant_id might be used to scope tools or provide context if needed.
+        inputs = self._build_inputs(query, conversation_history)
         final_state = self.graph.invoke(inputs)
-        
+        return self._build_result(query, final_state)
+
+    def stream(self, query: str, tenant_id: str, session_id: Optional[str] = None,
+               conversation_history: Optional[List[BaseMessage]] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Runs the same graph as invoke() but yields progress events as they happen:
+        - {"event": "token", "data": {"content": ...}} for each LLM token of the agent's reply,
+        - {"event": "tool_start", "data": {tool_name, tool_input, tool_call_id}} when the agent calls a tool,
+        - {"event": "tool_end", "data": {tool_name, tool_call_id, duration_ms, tool_output}} when it returns,
+        - {"event": "final", "data": <same dict as invoke()>} once the turn is complete.
+        """
+        inputs = self._build_inputs(query, conversation_history)
+        final_state = inputs
+        reported_actions = 0
+
+        for mode, chunk in self.graph.stream(inputs, stream_mode=["messages", "updates", "values"]):
+            if mode == "messages":
+                message, metadata = chunk
+                # The history summarizer also runs in the agent node; only the agent's own reply is streamed
+                if (isinstance(message, AIMessageChunk) and message.content and metadata.get("langgraph_node") == "agent"
+                        and NO_STREAM_TAG not in (metadata.get("tags") or [])):
+                    yield {"event": "token", "data": {"content": message.content}}
+            elif mode == "updates":
+                for node_name, update in chunk.items():
+                    if node_name == "agent":
+                        for message in update.get("messages", []):
+                            for tool_call in getattr(message, "tool_calls", None) or []:
+                                yield {"event": "tool_start", "data": {
+                                    "tool_name": tool_call["name"],
+                                    "tool_input": tool_call["args"],
+                                    "tool_call_id": tool_call["id"],
+                                }}
+                    elif node_name == "action":
+                        actions_summary = update.get("actions_taken_summary", [])
+                        for entry in actions_summary[reported_actions:]:
+                            yield {"event": "tool_end", "data": {
+                                "tool_name": entry["tool_name"],
+                                "tool_call_id": entry["tool_call_id"],
+                                "duration_ms": entry.get("duration_ms"),
+                                "tool_output": entry["tool_output"],
+                            }}
+                        reported_actions = max(reported_actions, len(actions_summary))
+            elif mode == "values":
+                final_state = chunk
+
+        yield {"event": "final", "data": self._build_result(query, final_state)}
+
+    def _build_result(self, query: str, final_state: Dict[str, Any]) -> Dict[str, Any]:
         response_messages = final_state.get('messages', [])
         # The last AIMessage is typically the agent's response to the user for this turn.
         final_ai_message_content = "No AI response generated for this turn." 
@@ -215,7 +277,7 @@ class BrainLangGraphAgent:
         # Include the final confirmation state in the response for debugging/visibility
         final_confirmation_state = {
             "pending_config_device": final_state.get("pending_config_device"),
-            "pending_config_commands_count": len(final_state.get("pending_config_commands", [])), # just count for brevity
+            "pending_config_commands_count": len(final_state.get("pending_config_commands") or []), # just count for brevity
             "is_awaiting_config_confirmation": final_state.get("is_awaiting_config_confirmation")
         }
 
@@ -0,0 +1,144 @@
+import hashlib
+import logging
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from flask import current_app, has_app_context
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_DEVICES = 256
+DEFAULT_MAX_AGE_SECONDS = 3600
+
+# Command that dumps the full configuration, per PyATS device OS.
+RUNNING_CONFIG_COMMANDS = {
+    'junos': 'show configuration',
+}
+DEFAULT_RUNNING_CONFIG_COMMAND = 'show running-config'
+
+# Cheap commands whose output changes whenever the configuration does, per PyATS device OS.
+# Their output (a config id, commit id or last-change stamp) is the fingerprint compared before re-fetching.
+CHANGE_PROBE_COMMANDS = {
+    'iosxe': 'show configuration id',
+    'iosxr': 'show configuration commit list 1',
+    'junos': 'show system commit | match "^0 "',
+}
+
+# OSes whose only change stamp is a line of the running config itself: filtering it out with '| include' still has
+# the device render the whole config, so a probe would cost as much as the fetch. Their cached configs are trusted
+# until `max_age` or an explicit invalidation instead.
+MAX_AGE_ONLY_OSES = ('ios', 'nxos')
+
+# Probe output lines that change on their own (e.g. the CLI echoing the current time) and must not count as a change.
+_VOLATILE_LINE_RE = re.compile(r"^\s*(Load for|Time source is|!Time:)", re.IGNORECASE)
+
+
+class CachedConfig(NamedTuple):
+    fingerprint: Optional[str]
+    compressed: bytes
+    config_hash: str
+    size: int
+    fetched_at: float
+
+
+class RunningConfigCache:
+    """
+    Per-device cache of running configurations, stored zlib-compressed.
+
+    Before returning a cached config, the device's change probe (see CHANGE_PROBE_COMMANDS) is run; only if its
+    output differs from the one recorded at fetch time is the full config pulled again. Devices on
+    MAX_AGE_ONLY_OSES are served from the cache without a probe; other devices without one are always
+    re-fetched. Entries older than `max_age` seconds are re-fetched regardless, and the least recently
+    used devices are dropped beyond `max_devices`. apply_configuration_fix invalidates the device explicitly.
+    """
+
+    def __init__(self, max_devices: int = DEFAULT_MAX_DEVICES, max_age: float = DEFAULT_MAX_AGE_SECONDS):
+        self.max_devices = max_devices
+        self.max_age = max_age
+        self._entries: "OrderedDict[str, CachedConfig]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "changed": 0, "invalidations": 0, "probe_failures": 0}
+
+    def get_running_config(self, device: Any, conn: Any) -> Tuple[str, str, bool]:
+        """
+        Returns (config_text, config_hash, from_cache) for `device`, using the already leased connection `conn`.
+        `config_hash` is the sha256 of the config text and can be used to key derived data.
+        """
+        device_name = device.name
+        device_os = getattr(device, 'os', None)
+        fingerprint = self._probe(conn, device_name, device_os)
+
+        with self._lock:
+            entry = self._entries.get(device_name)
+            trusted = fingerprint is not None or device_os in MAX_AGE_ONLY_OSES
+            if entry is not None and trusted and entry.fingerprint == fingerprint \
+                    and time.monotonic() - entry.fetched_at < self.max_age:
+                self._entries.move_to_end(device_name)
+                self._counters["hits"] += 1
+                return zlib.decompress(entry.compressed).decode("utf-8"), entry.config_hash, True
+            self._counters["changed" if entry is not None else "misses"] += 1
+
+        command = RUNNING_CONFIG_COMMANDS.get(device_os, DEFAULT_RUNNING_CONFIG_COMMAND)
+        logger.info(f"Executing: {command} on {device_name}")
+        config_text = conn.execute(command)
+        config_hash = hashlib.sha256(config_text.encode("utf-8")).hexdigest()
+        compressed = zlib.compress(config_text.encode("utf-8"), 6)
+        with self._lock:
+            self._entries[device_name] = CachedConfig(fingerprint, compressed, config_hash, len(config_text), time.monotonic())
+            self._entries.move_to_end(device_name)
+            while len(self._entries) > self.max_devices:
+                self._entries.popitem(last=False)
+        return config_text, config_hash, False
+
+    def invalidate(self, device_name: str):
+        with self._lock:
+            if self._entries.pop(device_name, None) is not None:
+                self._counters["invalidations"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self._counters,
+                "devices": len(self._entries),
+                "config_bytes": sum(e.size for e in self._entries.values()),
+                "compressed_bytes": sum(len(e.compressed) for e in self._entries.values()),
+            }
+
+    def _probe(self, conn: Any, device_name: str, device_os: Optional[str]) -> Optional[str]:
+        command = CHANGE_PROBE_COMMANDS.get(device_os)
+        if not command:
+            return None
+        try:
+            output = conn.execute(command)
+        except Exception as e:
+            logger.info(f"Config change probe '{command}' failed on {device_name}; fetching the full config: {e}")
+            self._counters["probe_failures"] += 1
+            return None
+        stable = "\n".join(line.strip() for line in str(output).splitlines()
+                           if line.strip() and not _VOLATILE_LINE_RE.match(line))
+        if not stable or "invalid input" in stable.lower() or "syntax error" in stable.lower():
+            self._counters["probe_failures"] += 1
+            return None # The probe is not supported on this image; never trust an empty fingerprint
+        return hashlib.sha256(stable.encode("utf-8")).hexdigest()
+
+
+# --- Process-wide singleton ---
+_config_cache: Optional[RunningConfigCache] = None
+_config_cache_lock = threading.Lock()
+
+def get_running_config_cache() -> RunningConfigCache:
+    """Gets or lazily creates the process-wide running-config cache, configured from the Flask app if available."""
+    global _config_cache
+    if _config_cache is None:
+        with _config_cache_lock:
+            if _config_cache is None:
+                config = current_app.config if has_app_context() else {}
+                _config_cache = RunningConfigCache(
+                    max_devices=int(config.get('RUNNING_CONFIG_CACHE_MAX_DEVICES', DEFAULT_MAX_DEVICES)),
+                    max_age=float(config.get('RUNNING_CONFIG_CACHE_MAX_AGE_SECONDS', DEFAULT_MAX_AGE_SECONDS)),
+                )
+    return _config_cache
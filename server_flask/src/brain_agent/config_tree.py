@@ -0,0 +1,165 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set
+
+DEFAULT_TREE_CACHE_SIZE = 32
+DEFAULT_MAX_SECTION_LINES = 200
+
+_TOKEN_RE = re.compile(r"[a-z0-9][a-z0-9._:/-]*")
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+class ConfigNode:
+    """One configuration line and the lines indented beneath it."""
+
+    __slots__ = ("index", "text", "line_no", "indent", "parent", "children", "subtree_size")
+
+    def __init__(self, index: int, text: str, line_no: int, indent: int, parent: Optional["ConfigNode"]):
+        self.index = index
+        self.text = text
+        self.line_no = line_no
+        self.indent = indent
+        self.parent = parent
+        self.children: List["ConfigNode"] = []
+        self.subtree_size = 1 # This line plus all descendants
+
+    @property
+    def command(self) -> str:
+        return self.text.strip()
+
+    def render(self) -> List[str]:
+        lines = [self.text]
+        for child in self.children:
+            lines.extend(child.render())
+        return lines
+
+    def ancestors(self) -> Iterable["ConfigNode"]:
+        node = self.parent
+        while node is not None:
+            yield node
+            node = node.parent
+
+
+class ConfigTree:
+    """
+    Running configuration parsed once into an indentation-aware tree of parent/child blocks, with an inverted
+    index from lowercase tokens to the lines that contain them.
+
+    Works for IOS/IOS-XE/NX-OS/IOS-XR style configs ('!' comments, children indented under their parent) and for
+    Junos 'show configuration' output (braces are dropped; nesting comes from indentation as well).
+    """
+
+    def __init__(self, config_text: str):
+        self.nodes: List[ConfigNode] = []
+        self.sections: List[ConfigNode] = [] # Top-level blocks, in config order
+        self._postings: Dict[str, Set[int]] = {}
+        self._parse(config_text)
+        self._vocabulary = sorted(self._postings)
+
+    def _parse(self, config_text: str):
+        stack: List[ConfigNode] = []
+        for line_no, raw_line in enumerate(config_text.splitlines(), start=1):
+            stripped = raw_line.strip()
+            if not stripped or stripped.startswith("!") or stripped in ("}", "};") or stripped.startswith("#"):
+                continue
+            text = raw_line.rstrip()
+            if text.endswith(" {"):
+                text = text[:-2]
+            indent = len(raw_line) - len(raw_line.lstrip(" \t"))
+            while stack and stack[-1].indent >= indent:
+                stack.pop()
+            parent = stack[-1] if stack else None
+            node = ConfigNode(len(self.nodes), text, line_no, indent, parent)
+            self.nodes.append(node)
+            if parent is None:
+                self.sections.append(node)
+            else:
+                parent.children.append(node)
+                for ancestor in node.ancestors():
+                    ancestor.subtree_size += 1
+            stack.append(node)
+            for token in set(tokenize(text)):
+                self._postings.setdefault(token, set()).add(node.index)
+
+    # --- Lookups ---
+
+    def find(self, keyword: str) -> List[ConfigNode]:
+        """Returns the lines containing `keyword` (case-insensitive substring), in config order."""
+        needle = keyword.strip().lower()
+        if not needle:
+            return []
+        # Every token of the keyword occurs inside some token of a matching line, so intersecting the lines of
+        # those vocabulary words narrows the candidates without dropping any; the final check is the substring test.
+        candidates: Optional[Set[int]] = None
+        for token in tokenize(needle):
+            matches = self._token_matches(token)
+            candidates = matches if candidates is None else candidates & matches
+            if not candidates:
+                return []
+        indexes = sorted(candidates) if candidates is not None else range(len(self.nodes))
+        return [self.nodes[i] for i in indexes if needle in self.nodes[i].text.lower()]
+
+    def _token_matches(self, token: str) -> Set[int]:
+        """
+        Lines with a token containing `token` anywhere, so '100' finds 'vlan100' and '10.1.100.1' and
+        'ethernet0/1' finds 'gigabitethernet0/1'. Scans the vocabulary, which is far smaller than the config.
+        """
+        matches: Set[int] = set()
+        for word in self._vocabulary:
+            if token in word:
+                matches |= self._postings[word]
+        return matches
+
+    def section_for(self, node: ConfigNode, max_lines: int = DEFAULT_MAX_SECTION_LINES) -> ConfigNode:
+        """
+        The enclosing block worth showing for a matching line: its top-level section (e.g. the whole
+        'interface' or 'router ospf' block), or the outermost ancestor that still fits in `max_lines`.
+        """
+        section = node
+        for ancestor in node.ancestors():
+            if ancestor.subtree_size > max_lines:
+                break
+            section = ancestor
+        return section
+
+    def sections_for_keywords(self, keywords: Iterable[str], max_lines: int = DEFAULT_MAX_SECTION_LINES) -> List[ConfigNode]:
+        """Distinct enclosing sections for all lines matching any of `keywords`, in config order."""
+        found: Dict[int, ConfigNode] = {}
+        for keyword in keywords:
+            for node in self.find(keyword):
+                section = self.section_for(node, max_lines)
+                found.setdefault(section.index, section)
+        # Drop sections nested inside another selected section
+        return [s for i, s in sorted(found.items()) if not any(a.index in found for a in s.ancestors())]
+
+    def top_level(self, prefix: str) -> List[ConfigNode]:
+        """Top-level sections whose command starts with `prefix`, e.g. 'interface', 'router bgp', 'ip access-list'."""
+        prefix = prefix.strip().lower()
+        return [s for s in self.sections if s.command.lower().startswith(prefix)]
+
+
+# --- Trees cached per config hash ---
+_tree_cache: "OrderedDict[str, ConfigTree]" = OrderedDict()
+_tree_cache_lock = threading.Lock()
+
+def get_config_tree(config_text: str, config_hash: Optional[str] = None,
+                    cache_size: int = DEFAULT_TREE_CACHE_SIZE) -> ConfigTree:
+    """Returns the parsed tree for `config_text`, parsing it only the first time a given config hash is seen."""
+    key = config_hash or hashlib.sha256(config_text.encode("utf-8")).hexdigest()
+    with _tree_cache_lock:
+        tree = _tree_cache.get(key)
+        if tree is not None:
+            _tree_cache.move_to_end(key)
+            return tree
+    tree = ConfigTree(config_text)
+    with _tree_cache_lock:
+        _tree_cache[key] = tree
+        _tree_cache.move_to_end(key)
+        while len(_tree_cache) > cache_size:
+            _tree_cache.popitem(last=False)
+    return tree
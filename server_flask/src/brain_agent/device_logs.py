@@ -0,0 +1,172 @@
+import io
+import re
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, List, NamedTuple, Optional, Pattern, Tuple
+
+DEFAULT_MAX_CURSORS = 1024
+
+# Base log command per PyATS device OS
+LOG_COMMANDS = {
+    'nxos': 'show logging logfile',
+    'junos': 'show log messages',
+}
+DEFAULT_LOG_COMMAND = 'show logging'
+
+IOS_FAMILY = ('ios', 'iosxe', 'iosxr', 'asa')
+
+# OSes whose device-side cursor is a start time rather than a search for the cursor's line: the line rotating out
+# of the buffer does not matter, so an empty result means there are no new lines.
+TIME_BOUNDED_CURSOR_OSES = ('nxos',)
+
+# Filters made of these characters are sent to the device as literal patterns; anything else (regex syntax)
+# is only applied locally, because the device regex dialects differ from Python's and from each other.
+_LITERAL_FILTER_RE = re.compile(r"^[A-Za-z0-9 _.:/,@=-]+$")
+
+# Leading timestamp of a log line, per OS family. Used for the tail cursor.
+_TIMESTAMP_RES = {
+    'nxos': re.compile(r"^(\d{4}) ([A-Z][a-z]{2}) +(\d{1,2}) (\d{2}:\d{2}:\d{2})"),
+    'junos': re.compile(r"^([A-Z][a-z]{2} +\d{1,2} \d{2}:\d{2}:\d{2})"),
+}
+_IOS_TIMESTAMP_RE = re.compile(r"^(?:\d+: )?\*?\.?([A-Z][a-z]{2} +\d{1,2} \d{2}:\d{2}:\d{2})")
+
+
+class LogCursor(NamedTuple):
+    last_line: str
+    timestamp: Optional[str]
+    timestamp_parts: Optional[Tuple[str, ...]]
+
+
+def _case_insensitive_ios_pattern(literal: str) -> str:
+    # IOS '| include' is case-sensitive; '[Gg][Ii]...' keeps the match case-insensitive like the local filter.
+    return "".join(f"[{c.upper()}{c.lower()}]" if c.isalpha() else c for c in literal)
+
+def extract_timestamp(line: str, device_os: Optional[str]) -> Tuple[Optional[str], Optional[Tuple[str, ...]]]:
+    regex = _TIMESTAMP_RES.get(device_os, _IOS_TIMESTAMP_RE)
+    match = regex.match(line)
+    if not match:
+        return None, None
+    groups = match.groups()
+    return (" ".join(groups) if len(groups) > 1 else groups[0]), groups
+
+def build_log_command(device_os: Optional[str], log_filter: Optional[str] = None,
+                      cursor: Optional[LogCursor] = None) -> Tuple[str, bool]:
+    """
+    Builds the log command for `device_os`, pushing the filter (and, where the CLI allows it, the tail cursor)
+    down to the device. Returns (command, filter_pushed_down).
+    """
+    command = LOG_COMMANDS.get(device_os, DEFAULT_LOG_COMMAND)
+    literal = log_filter.strip() if log_filter and _LITERAL_FILTER_RE.match(log_filter.strip()) else None
+
+    if device_os == 'junos':
+        # Junos allows chained pipes; 'find' starts the output at the first line matching the cursor's timestamp.
+        if cursor and cursor.timestamp:
+            command += f' | find "{cursor.timestamp}"'
+        if literal:
+            command += f' | match "{literal}"' # Junos 'match' is case-insensitive
+        return command, bool(literal)
+
+    if device_os == 'nxos':
+        if cursor and cursor.timestamp_parts:
+            year, month, day, clock = cursor.timestamp_parts
+            command += f" start-time {year} {month} {int(day):02d} {clock}"
+        if literal:
+            command += f' | grep ignore-case "{literal}"'
+        return command, bool(literal)
+
+    if device_os in IOS_FAMILY or device_os is None:
+        # Only one output modifier is allowed; the filter usually shrinks the output more than the cursor does.
+        if literal:
+            command += f" | include {_case_insensitive_ios_pattern(literal)}"
+            return command, True
+        if cursor and cursor.timestamp:
+            command += f" | begin {cursor.timestamp}"
+        return command, False
+
+    return command, False
+
+
+def filter_log_output(raw_logs: str, pattern: Optional[Pattern], max_lines: int,
+                      cursor: Optional[LogCursor] = None) -> Tuple[List[str], Optional[str]]:
+    """
+    Streams over `raw_logs` once, keeping the last `max_lines` lines that match `pattern` and come after the
+    last occurrence of the cursor's last seen line. Returns (lines, last_matching_line).
+    """
+    last_line = None
+    if cursor is not None:
+        offset = _end_of_last_line(raw_logs, cursor.last_line)
+        if offset is not None:
+            raw_logs = raw_logs[offset:] # Everything up to here was returned by the previous call
+            last_line = cursor.last_line
+    kept: deque = deque(maxlen=max_lines)
+    for line in io.StringIO(raw_logs):
+        line = line.rstrip("\r\n")
+        if not line.strip():
+            continue
+        if pattern is not None and not pattern.search(line):
+            continue
+        kept.append(line)
+        last_line = line
+    return list(kept), last_line
+
+def _end_of_last_line(text: str, line: str) -> Optional[int]:
+    """Offset just past the last line of `text` that equals `line` (ignoring its line ending), or None."""
+    end = len(text)
+    while True:
+        start = text.rfind(line, 0, end)
+        if start < 0:
+            return None
+        stop = start + len(line)
+        if (start == 0 or text[start - 1] == "\n") and (stop == len(text) or text[stop] in "\r\n"):
+            return stop
+        end = stop - 1
+
+
+class LogCursorStore:
+    """Last log line returned per (device, filter), so repeated calls only return new entries. LRU-bounded."""
+
+    def __init__(self, max_cursors: int = DEFAULT_MAX_CURSORS):
+        self.max_cursors = max_cursors
+        self._cursors: "OrderedDict[Tuple[str, str], LogCursor]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, device_name: str, log_filter: Optional[str]) -> Optional[LogCursor]:
+        with self._lock:
+            return self._cursors.get((device_name, log_filter or ""))
+
+    def advance(self, device_name: str, log_filter: Optional[str], last_line: str, device_os: Optional[str]):
+        timestamp, parts = extract_timestamp(last_line, device_os)
+        key = (device_name, log_filter or "")
+        with self._lock:
+            self._cursors[key] = LogCursor(last_line, timestamp, parts)
+            self._cursors.move_to_end(key)
+            while len(self._cursors) > self.max_cursors:
+                self._cursors.popitem(last=False)
+
+    def reset(self, device_name: str):
+        with self._lock:
+            for key in [k for k in self._cursors if k[0] == device_name]:
+                del self._cursors[key]
+
+
+_pattern_cache: Dict[str, Pattern] = {}
+_pattern_cache_lock = threading.Lock()
+
+def compile_log_filter(log_filter: Optional[str]) -> Optional[Pattern]:
+    """Compiles a log filter once (case-insensitive); invalid regexes are matched literally."""
+    if not log_filter:
+        return None
+    with _pattern_cache_lock:
+        pattern = _pattern_cache.get(log_filter)
+        if pattern is None:
+            try:
+                pattern = re.compile(log_filter, re.IGNORECASE)
+            except re.error:
+                pattern = re.compile(re.escape(log_filter), re.IGNORECASE)
+            if len(_pattern_cache) >= 256:
+                _pattern_cache.clear()
+            _pattern_cache[log_filter] = pattern
+    return pattern
+
+
+log_cursors = LogCursorStore()
@@ -0,0 +1,318 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from flask import current_app, has_app_context
+
+try:
+    from genie.metaparser.util.exceptions import SchemaEmptyParserError
+    GENIE_AVAILABLE = True
+except ImportError:
+    GENIE_AVAILABLE = False
+    SchemaEmptyParserError = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 512
+DEFAULT_TTL_SECONDS = 30
+# Raw CLI text kept (and shown to the LLM) when a command has no Genie parser on the device's OS
+RAW_FALLBACK_CHARS = 1000
+MAX_TOP_PROCESSES = 5
+MAX_GENERIC_LEAVES = 40
+
+# Show commands per PyATS device OS, spelled the way the Genie parsers are registered.
+CPU_COMMANDS = {
+    'nxos': 'show processes cpu',
+    'iosxr': 'show processes cpu',
+    'junos': 'show chassis routing-engine',
+}
+DEFAULT_CPU_COMMAND = 'show processes cpu sorted'
+
+MEMORY_COMMANDS = {
+    'nxos': 'show system resources',
+    'iosxr': 'show memory summary',
+    'junos': 'show chassis routing-engine',
+}
+DEFAULT_MEMORY_COMMAND = 'show memory statistics'
+
+INTERFACE_COMMANDS = {
+    'nxos': 'show interface {interface}',
+    'junos': 'show interfaces {interface} extensive',
+}
+DEFAULT_INTERFACE_COMMAND = 'show interfaces {interface}'
+
+# Every interface in one command, for fleet-wide collection
+ALL_INTERFACES_COMMANDS = {
+    'nxos': 'show interface',
+    'junos': 'show interfaces extensive',
+}
+DEFAULT_ALL_INTERFACES_COMMAND = 'show interfaces'
+
+
+class ParseResult(NamedTuple):
+    parsed: Optional[Dict[str, Any]] # Genie structure, or None if the command has no parser / Genie is missing
+    raw: Optional[str] # Truncated CLI output, only kept when `parsed` is None
+    from_cache: bool
+
+
+class ParseCache:
+    """
+    Genie parse results keyed by (device name, command, device OS), kept for `ttl` seconds so the several
+    steps of one diagnosis that need the same show command run and parse it once. LRU-bounded.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl: float = DEFAULT_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple[str, str, str], Tuple[float, ParseResult]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "parse_failures": 0, "invalidations": 0}
+
+    def get(self, key: Tuple[str, str, str]) -> Optional[ParseResult]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                if entry is not None:
+                    del self._entries[key]
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return entry[1]._replace(from_cache=True)
+
+    def put(self, key: Tuple[str, str, str], result: ParseResult):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, device_name: str):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == device_name]:
+                del self._entries[key]
+                self._counters["invalidations"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._counters, "entries": len(self._entries)}
+
+    def parse(self, device: Any, conn: Any, command: str, cache: bool = True) -> ParseResult:
+        """
+        Runs `command` over the leased connection `conn` and parses it with Genie, unless a fresh result is cached.
+        `cache=False` always runs the command and leaves the cache alone (bulk collection would only evict entries).
+        """
+        key = (device.name, command, device.os or "")
+        cached = self.get(key) if cache else None
+        if cached is not None:
+            return cached
+        raw = conn.execute(command)
+        parsed = None
+        if GENIE_AVAILABLE:
+            try:
+                # output= parses the text we already have instead of running the command again
+                parsed = device.parse(command, output=raw)
+            except SchemaEmptyParserError:
+                parsed = {}
+            except Exception as e:
+                logger.info(f"No Genie parse for '{command}' on {device.name} ({device.os}): {e}")
+                self._counters["parse_failures"] += 1
+        result = ParseResult(parsed, None if parsed is not None else str(raw)[:RAW_FALLBACK_CHARS], False)
+        if cache:
+            self.put(key, result)
+        return result
+
+
+# --- Compact summaries for the LLM ---
+
+def _number(value: Any) -> Optional[float]:
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(str(value).rstrip('%').strip())
+    except (TypeError, ValueError):
+        return None
+
+def _first(mapping: Dict[str, Any], *keys: str) -> Any:
+    for key in keys:
+        if mapping.get(key) is not None:
+            return mapping[key]
+    return None
+
+def _as_list(value: Any) -> List[Any]:
+    return value if isinstance(value, list) else [value] if value else []
+
+def _pct(used: Optional[float], total: Optional[float]) -> Optional[float]:
+    return round(100.0 * used / total, 1) if used is not None and total else None
+
+def _drop_empty(summary: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in summary.items() if v not in (None, {}, [])}
+
+def compact_leaves(parsed: Any, max_leaves: int = MAX_GENERIC_LEAVES) -> Dict[str, Any]:
+    """Flattens a parsed structure to {'a.b.c': scalar}, first `max_leaves` leaves only. Fallback for unknown schemas."""
+    leaves: Dict[str, Any] = {}
+    stack: List[Tuple[str, Any]] = [("", parsed)]
+    while stack and len(leaves) < max_leaves:
+        path, value = stack.pop()
+        if isinstance(value, dict):
+            stack.extend((f"{path}.{k}" if path else str(k), v) for k, v in reversed(list(value.items())))
+        elif isinstance(value, list):
+            stack.extend((f"{path}[{i}]", v) for i, v in reversed(list(enumerate(value))))
+        else:
+            leaves[path] = value
+    return leaves
+
+def _junos_routing_engine(parsed: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    engines = _as_list(parsed.get('route-engine-information', {}).get('route-engine'))
+    return engines[0] if engines else None
+
+def summarize_cpu(parsed: Dict[str, Any]) -> Dict[str, Any]:
+    """CPU load (percent) and the busiest processes, from the CPU_COMMANDS parsers."""
+    engine = _junos_routing_engine(parsed)
+    if engine is not None:
+        idle = _number(engine.get('cpu-idle'))
+        return _drop_empty({"cpu_pct": round(100 - idle, 1) if idle is not None else None,
+                            "cpu_1m_load_avg": _number(engine.get('load-average-one'))})
+    if 'cpu_state' in parsed: # NX-OS 'show system resources'
+        idle = _number(parsed['cpu_state'].get('idle'))
+        return _drop_empty({"cpu_pct": round(100 - idle, 1) if idle is not None else None})
+
+    summary = {
+        "cpu_5s_pct": _number(_first(parsed, 'five_sec_cpu_total', 'five_sec_cpu')),
+        "cpu_1m_pct": _number(_first(parsed, 'one_min_cpu', 'one_minute')),
+        "cpu_5m_pct": _number(_first(parsed, 'five_min_cpu', 'five_minute')),
+    }
+    processes = _first(parsed, 'sort', 'index', 'location') or {}
+    rows = [p for p in processes.values() if isinstance(p, dict) and p.get('process')] if isinstance(processes, dict) else []
+    rows.sort(key=lambda p: _number(_first(p, 'five_sec_cpu', 'one_min_cpu', 'five_sec')) or 0, reverse=True)
+    summary["top_processes"] = [
+        {"process": p['process'], "cpu_5s_pct": _number(_first(p, 'five_sec_cpu', 'five_sec'))}
+        for p in rows[:MAX_TOP_PROCESSES]
+    ]
+    summary = _drop_empty(summary)
+    return summary or compact_leaves(parsed)
+
+def summarize_memory(parsed: Dict[str, Any]) -> Dict[str, Any]:
+    """Used/total memory (and percent) per pool, from the MEMORY_COMMANDS parsers."""
+    engine = _junos_routing_engine(parsed)
+    if engine is not None:
+        return _drop_empty({"memory_used_pct": _number(engine.get('memory-buffer-utilization')),
+                            "memory_dram": engine.get('memory-dram-size')})
+    if 'memory_usage' in parsed: # NX-OS 'show system resources'
+        usage = parsed['memory_usage']
+        used, total = _number(usage.get('used_kbytes')), _number(usage.get('total_kbytes'))
+        return _drop_empty({"memory_used_kb": used, "memory_total_kb": total, "memory_used_pct": _pct(used, total)})
+
+    pools = {}
+    for pool_name, pool in (parsed.get('name') or {}).items(): # IOS/IOS-XE 'show memory statistics'
+        if isinstance(pool, dict):
+            used, total = _number(pool.get('used')), _number(pool.get('total'))
+            pools[pool_name] = _drop_empty({"used": used, "total": total, "used_pct": _pct(used, total),
+                                            "largest_free": _number(pool.get('largest'))})
+    if pools:
+        return {"pools": pools}
+    return compact_leaves(parsed)
+
+def summarize_interface(parsed: Dict[str, Any], interface_name: str) -> Dict[str, Any]:
+    """Status, error counters and utilization of one interface, from the INTERFACE_COMMANDS parsers."""
+    if 'interface-information' in parsed: # Junos 'show interfaces <name> extensive'
+        physical = _as_list(parsed['interface-information'].get('physical-interface'))
+        return _summarize_junos_interface(physical[0], interface_name) if physical else {}
+
+    # IOS/IOS-XE/IOS-XR/NX-OS: {<interface>: {...}}; match the requested name case-insensitively, else the only entry
+    entries = {k: v for k, v in parsed.items() if isinstance(v, dict)}
+    name = next((k for k in entries if k.lower() == interface_name.lower()), None) or next(iter(entries), None)
+    if name is None:
+        return {}
+    return _summarize_interface_entry(name, entries[name])
+
+def summarize_interfaces(parsed: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """One interface summary per interface, from the ALL_INTERFACES_COMMANDS parsers."""
+    if 'interface-information' in parsed:
+        physical = _as_list(parsed['interface-information'].get('physical-interface'))
+        return [_summarize_junos_interface(intf, intf.get('name')) for intf in physical if isinstance(intf, dict)]
+    return [_summarize_interface_entry(name, intf) for name, intf in parsed.items() if isinstance(intf, dict)]
+
+def _summarize_junos_interface(intf: Dict[str, Any], interface_name: Optional[str]) -> Dict[str, Any]:
+    errors_in = intf.get('input-error-list', {})
+    errors_out = intf.get('output-error-list', {})
+    traffic = intf.get('traffic-statistics', {})
+    return _drop_empty({
+        "interface": intf.get('name', interface_name),
+        "oper_status": intf.get('oper-status'),
+        "admin_status": intf.get('admin-status', {}).get('#text') if isinstance(intf.get('admin-status'), dict) else intf.get('admin-status'),
+        "description": intf.get('description'),
+        "speed": intf.get('speed'),
+        "in_errors": _number(errors_in.get('input-errors')),
+        "in_drops": _number(errors_in.get('input-drops')),
+        "out_errors": _number(errors_out.get('output-errors')),
+        "out_drops": _number(errors_out.get('output-drops')),
+        "in_bps": _number(traffic.get('input-bps')),
+        "out_bps": _number(traffic.get('output-bps')),
+    })
+
+def _summarize_interface_entry(name: str, intf: Dict[str, Any]) -> Dict[str, Any]:
+    counters = intf.get('counters', {})
+    rate = counters.get('rate', {})
+    bandwidth_kbps = _number(intf.get('bandwidth'))
+    in_bps, out_bps = _number(rate.get('in_rate')), _number(rate.get('out_rate'))
+    return _drop_empty({
+        "interface": name,
+        "oper_status": intf.get('oper_status'),
+        "line_protocol": intf.get('line_protocol'),
+        "enabled": intf.get('enabled'),
+        "description": intf.get('description'),
+        "bandwidth_kbps": bandwidth_kbps,
+        "duplex": intf.get('duplex_mode'),
+        "mtu": intf.get('mtu'),
+        "in_errors": _number(counters.get('in_errors')),
+        "in_crc_errors": _number(counters.get('in_crc_errors')),
+        "in_discards": _number(_first(counters, 'in_discards', 'in_discard')),
+        "in_runts": _number(counters.get('in_runts')),
+        "in_giants": _number(counters.get('in_giants')),
+        "out_errors": _number(counters.get('out_errors')),
+        "out_discards": _number(_first(counters, 'out_discards', 'out_discard')),
+        "in_bps": in_bps,
+        "out_bps": out_bps,
+        "in_util_pct": _pct(in_bps, bandwidth_kbps * 1000 if bandwidth_kbps else None),
+        "out_util_pct": _pct(out_bps, bandwidth_kbps * 1000 if bandwidth_kbps else None),
+        "load_interval_s": rate.get('load_interval'),
+        "last_clear": counters.get('last_clear'),
+    })
+
+def format_summary(title: str, summary: Dict[str, Any]) -> str:
+    """One line for the LLM: the title and the summary as compact JSON."""
+    return f"{title}: {json.dumps(summary, separators=(',', ':'), default=str)}"
+
+def cpu_command(device_os: Optional[str]) -> str:
+    return CPU_COMMANDS.get(device_os, DEFAULT_CPU_COMMAND)
+
+def memory_command(device_os: Optional[str]) -> str:
+    return MEMORY_COMMANDS.get(device_os, DEFAULT_MEMORY_COMMAND)
+
+def interface_command(device_os: Optional[str], interface_name: str) -> str:
+    return INTERFACE_COMMANDS.get(device_os, DEFAULT_INTERFACE_COMMAND).format(interface=interface_name)
+
+def all_interfaces_command(device_os: Optional[str]) -> str:
+    return ALL_INTERFACES_COMMANDS.get(device_os, DEFAULT_ALL_INTERFACES_COMMAND)
+
+
+# --- Process-wide singleton ---
+_parse_cache: Optional[ParseCache] = None
+_parse_cache_lock = threading.Lock()
+
+def get_parse_cache() -> ParseCache:
+    """Gets or lazily creates the process-wide Genie parse cache, configured from the Flask app if available."""
+    global _parse_cache
+    if _parse_cache is None:
+        with _parse_cache_lock:
+            if _parse_cache is None:
+                config = current_app.config if has_app_context() else {}
+                _parse_cache = ParseCache(
+                    max_entries=int(config.get('PYATS_PARSE_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)),
+                    ttl=float(config.get('PYATS_PARSE_CACHE_TTL_SECONDS', DEFAULT_TTL_SECONDS)),
+                )
+    return _parse_cache
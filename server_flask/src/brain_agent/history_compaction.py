@@ -0,0 +1,195 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, List
+
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, ToolMessage
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base") # Tokenizer of the gpt-4 / gpt-3.5 family
+except Exception: # ImportError, or the encoding file could not be loaded
+    tiktoken = None
+    _ENCODING = None
+
+# Per-message overhead of the chat format (role and separators), per OpenAI's token counting guide.
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Longer messages (e.g. a pasted show tech) are clipped before they are handed to the summarizer.
+EXCERPT_MESSAGE_MAX_CHARS = 4000
+
+# Floor for a clipped message in an oversized current turn, and the marker left where its middle was cut out.
+CLIPPED_MESSAGE_MIN_TOKENS = 200
+CLIP_MARKER = "\n[... {chars} characters cut to fit the context budget ...]\n"
+
+# Tag on the summarizer's LLM run. It runs inside the agent graph node, so the token stream must not relay it.
+NO_STREAM_TAG = "nostream"
+
+SUMMARY_PREFIX = "Summary of the earlier conversation in this session:\n"
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a network operations conversation between a user and an assistant. "
+    "Update the existing summary with the new conversation excerpt. Keep device names, IP addresses, interface names, "
+    "symptoms, findings, commands proposed or applied and any open questions. Drop greetings and raw command output "
+    "that has already been interpreted. Reply with the updated summary only, in at most {max_words} words.\n\n"
+    "Existing summary:\n{summary}\n\n"
+    "New conversation excerpt:\n{excerpt}"
+)
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    """Counts tokens with tiktoken when it is installed; otherwise estimates about four characters per token."""
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+def _message_text(message: BaseMessage) -> str:
+    content = message.content if isinstance(message.content, str) else str(message.content)
+    tool_calls = getattr(message, 'tool_calls', None)
+    return content + (str(tool_calls) if tool_calls else "")
+
+def count_message_tokens(messages: List[BaseMessage]) -> int:
+    return sum(count_tokens(_message_text(m)) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+class HistoryCompactor:
+    """
+    Keeps the message history sent to the LLM within a token budget.
+
+    Messages are grouped into turns, each starting at a HumanMessage, so an AI tool call always stays
+    together with its tool results. While the history fits in `token_budget` it is left untouched. Beyond
+    that, the most recent turns are kept verbatim (at least the current one, and as many as fit in
+    `recent_tokens`) and all older turns are replaced by one summary message. A current turn that alone exceeds
+    `token_budget` (a pasted show tech, large tool outputs) has its largest user and tool messages clipped in the
+    middle until it fits in `recent_tokens`.
+
+    Summaries are cached by a chained hash of the turns they cover. When a later call has to fold more
+    turns into the summary, it starts from the longest cached prefix and only summarizes the new turns,
+    so each turn goes through the summarizer once per session.
+    """
+
+    def __init__(self, summarizer_llm: Any, token_budget: int = 6000, recent_tokens: int = 3000,
+                 summary_max_words: int = 250, cache_size: int = 256):
+        self.summarizer_llm = summarizer_llm
+        self.token_budget = token_budget
+        self.recent_tokens = min(recent_tokens, token_budget)
+        self.summary_max_words = summary_max_words
+        self.cache_size = cache_size
+        self._summaries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def compact(self, messages: List[BaseMessage]) -> List[BaseMessage]:
+        if self.token_budget <= 0 or count_message_tokens(messages) <= self.token_budget:
+            return messages
+
+        turns = self._split_turns(messages)
+        if count_message_tokens(turns[-1]) > self.token_budget:
+            turns[-1] = self._clip_turn(turns[-1], self.recent_tokens)
+        keep_from = len(turns) - 1 # The current turn is always kept
+        recent = count_message_tokens(turns[keep_from])
+        while keep_from > 0:
+            cost = count_message_tokens(turns[keep_from - 1])
+            if recent + cost > self.recent_tokens:
+                break
+            recent += cost
+            keep_from -= 1
+        if keep_from == 0:
+            return [m for turn in turns for m in turn] # Only the current turn (or turns that fit) - nothing to fold
+
+        recent_messages = [m for turn in turns[keep_from:] for m in turn]
+        try:
+            summary = self._summary_for(turns[:keep_from])
+        except Exception as e:
+            logger.warning(f"History summarization failed; dropping {keep_from} older turn(s) instead: {e}")
+            return recent_messages
+        logger.info(
+            f"Compacted history: {keep_from} older turn(s) summarized, {len(turns) - keep_from} recent turn(s) kept "
+            f"({count_message_tokens(messages)} -> ~{recent + count_tokens(summary)} tokens)."
+        )
+        return [SystemMessage(content=SUMMARY_PREFIX + summary)] + recent_messages
+
+    @staticmethod
+    def _clip_turn(turn: List[BaseMessage], budget: int) -> List[BaseMessage]:
+        """Clips the largest user and tool messages of `turn`, keeping their head and tail, until it fits in `budget`."""
+        excess = count_message_tokens(turn) - budget
+        clipped = list(turn)
+        candidates = sorted(
+            (i for i, m in enumerate(turn) if isinstance(m, (HumanMessage, ToolMessage)) and isinstance(m.content, str)),
+            key=lambda i: count_tokens(turn[i].content), reverse=True,
+        )
+        for i in candidates:
+            if excess <= 0:
+                break
+            text = turn[i].content
+            tokens = count_tokens(text)
+            marker_tokens = count_tokens(CLIP_MARKER.format(chars=len(text)))
+            keep_tokens = max(CLIPPED_MESSAGE_MIN_TOKENS, tokens - excess - marker_tokens)
+            if keep_tokens + marker_tokens >= tokens:
+                continue
+            keep_chars = len(text) * keep_tokens // tokens
+            head = keep_chars * 2 // 3
+            tail = keep_chars - head
+            new_text = text[:head] + CLIP_MARKER.format(chars=len(text) - keep_chars) + (text[-tail:] if tail else "")
+            clipped[i] = turn[i].model_copy(update={"content": new_text})
+            excess -= tokens - count_tokens(new_text)
+        if excess > 0:
+            logger.warning(f"Current turn still exceeds the history budget by ~{excess} tokens after clipping.")
+        else:
+            logger.info(f"Clipped oversized messages in the current turn to fit {budget} tokens.")
+        return clipped
+
+    @staticmethod
+    def _split_turns(messages: List[BaseMessage]) -> List[List[BaseMessage]]:
+        turns: List[List[BaseMessage]] = []
+        for message in messages:
+            if isinstance(message, HumanMessage) or not turns:
+                turns.append([])
+            turns[-1].append(message)
+        return turns
+
+    @staticmethod
+    def _prefix_keys(turns: List[List[BaseMessage]]) -> List[str]:
+        """keys[i] identifies the first i+1 turns; each key chains the previous one with the next turn's content."""
+        keys: List[str] = []
+        digest = b""
+        for turn in turns:
+            h = hashlib.sha256(digest)
+            for message in turn:
+                h.update(message.type.encode())
+                h.update(_message_text(message).encode("utf-8", "replace"))
+            digest = h.digest()
+            keys.append(h.hexdigest())
+        return keys
+
+    def _summary_for(self, turns: List[List[BaseMessage]]) -> str:
+        keys = self._prefix_keys(turns)
+        start, summary = 0, ""
+        with self._lock:
+            for i in range(len(keys) - 1, -1, -1):
+                if keys[i] in self._summaries:
+                    self._summaries.move_to_end(keys[i])
+                    start, summary = i + 1, self._summaries[keys[i]]
+                    break
+        if start == len(turns):
+            return summary
+
+        excerpt = "\n".join(
+            f"{message.type}: {_message_text(message)[:EXCERPT_MESSAGE_MAX_CHARS]}" for turn in turns[start:] for message in turn
+        )
+        prompt = SUMMARY_PROMPT.format(max_words=self.summary_max_words, summary=summary or "(none)", excerpt=excerpt)
+        response = self.summarizer_llm.invoke(prompt, config={"tags": [NO_STREAM_TAG]})
+        summary = (response.content if hasattr(response, 'content') else str(response)).strip()
+
+        with self._lock:
+            self._summaries[keys[-1]] = summary
+            self._summaries.move_to_end(keys[-1])
+            while len(self._summaries) > self.cache_size:
+                self._summaries.popitem(last=False)
+        return summary
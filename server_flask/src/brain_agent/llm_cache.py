@@ -0,0 +1,228 @@
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from flask import current_app, has_app_context
+
+logger = logging.getLogger(__name__)
+
+EXTENSION_KEY = 'llm_response_cache'
+
+_WHITESPACE_RE = re.compile(r"[ \t]+")
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Strips indentation and trailing blanks per line and collapses runs of spaces, so cosmetic differences share a key."""
+    lines = (_WHITESPACE_RE.sub(" ", line).strip() for line in prompt.strip().splitlines())
+    return "\n".join(line for line in lines if line)
+
+def cache_key(model: str, prompt: str) -> str:
+    return hashlib.sha256(f"{model}\0{normalize_prompt(prompt)}".encode("utf-8")).hexdigest()
+
+
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Optional[str] = None
+        self.error: Optional[BaseException] = None
+
+
+class LLMResponseCache:
+    """
+    Content-addressed cache of LLM completions keyed by model name plus normalized prompt.
+
+    The memory tier is an LRU bounded by `max_entries`; entries expire after `ttl` seconds. If `disk_path`
+    is set, completions are also written to a SQLite file (WAL mode) that other workers on the host and
+    later processes read on a memory miss. Concurrent requests for the same key are coalesced: one caller
+    (the leader) calls the model while the others wait for its result.
+
+    Only use this for deterministic (temperature 0) calls whose answer depends on the prompt alone.
+    """
+
+    def __init__(self, max_entries: int = 512, ttl: float = 600, disk_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_path = disk_path
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._in_flight: Dict[str, _InFlight] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._counters = {"hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0, "errors": 0}
+        if disk_path:
+            directory = os.path.dirname(disk_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = self._connection()
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_responses ("
+                " key TEXT PRIMARY KEY,"
+                " model TEXT NOT NULL,"
+                " response TEXT NOT NULL,"
+                " expires_at REAL NOT NULL)"
+            )
+
+    def get_or_compute(self, model: str, prompt: str, compute: Callable[[], str]) -> str:
+        """Returns the cached completion for (model, prompt), calling `compute` at most once across concurrent callers."""
+        key = cache_key(model, prompt)
+        with self._lock:
+            value = self._get_memory_locked(key)
+            if value is not None:
+                self._counters["hits"] += 1
+                return value
+            in_flight = self._in_flight.get(key)
+            leader = in_flight is None
+            if leader:
+                in_flight = self._in_flight[key] = _InFlight()
+            else:
+                self._counters["coalesced"] += 1
+
+        if not leader:
+            in_flight.done.wait()
+            if in_flight.error is not None:
+                raise in_flight.error
+            return in_flight.value
+
+        try:
+            value = self._get_disk(key)
+            if value is not None:
+                self._counters["disk_hits"] += 1
+            else:
+                self._counters["misses"] += 1
+                value = compute()
+                self._put_disk(key, model, value)
+            with self._lock:
+                self._put_memory_locked(key, value)
+            in_flight.value = value
+            return value
+        except BaseException as e:
+            self._counters["errors"] += 1
+            in_flight.error = e # Failures are not cached; waiting callers see the same error
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            in_flight.done.set()
+
+    def invalidate(self, model: str, prompt: str):
+        """Forgets the completion for (model, prompt), e.g. because the caller could not parse it."""
+        key = cache_key(model, prompt)
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.disk_path:
+            try:
+                self._connection().execute("DELETE FROM llm_responses WHERE key = ?", (key,))
+            except sqlite3.Error as e:
+                logger.warning(f"LLM response cache disk delete failed: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._counters, "entries": len(self._entries), "max_entries": self.max_entries,
+                    "disk_tier": bool(self.disk_path)}
+
+    # --- Memory tier ---
+
+    def _get_memory_locked(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def _put_memory_locked(self, key: str, value: str):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    # --- Disk tier ---
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.disk_path, timeout=5, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def _get_disk(self, key: str) -> Optional[str]:
+        if not self.disk_path:
+            return None
+        try:
+            row = self._connection().execute(
+                "SELECT response FROM llm_responses WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"LLM response cache disk read failed: {e}")
+            return None
+        return row[0] if row else None
+
+    def _put_disk(self, key: str, model: str, value: str):
+        if not self.disk_path:
+            return
+        now = time.time()
+        try:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_responses (key, model, response, expires_at) VALUES (?, ?, ?, ?)",
+                (key, model, value, now + self.ttl)
+            )
+            conn.execute("DELETE FROM llm_responses WHERE expires_at <= ?", (now,))
+        except sqlite3.Error as e:
+            logger.warning(f"LLM response cache disk write failed: {e}")
+
+
+_init_lock = threading.Lock()
+
+def get_llm_cache() -> Optional[LLMResponseCache]:
+    """Returns the current app's LLM response cache, creating it on first use. None if caching is disabled."""
+    if not has_app_context():
+        return None
+    app = current_app._get_current_object()
+    if not app.config.get('LLM_CACHE_ENABLED', True):
+        return None
+    cache = app.extensions.get(EXTENSION_KEY)
+    if cache is None:
+        with _init_lock:
+            cache = app.extensions.get(EXTENSION_KEY)
+            if cache is None:
+                cache = LLMResponseCache(
+                    max_entries=app.config.get('LLM_CACHE_MAX_ENTRIES', 512),
+                    ttl=app.config.get('LLM_CACHE_TTL_SECONDS', 600),
+                    disk_path=app.config.get('LLM_CACHE_DB_PATH'),
+                )
+                app.extensions[EXTENSION_KEY] = cache
+                logger.info(
+                    f"LLM response cache initialized (max {cache.max_entries} entries, TTL {cache.ttl}s, "
+                    f"disk tier {'at ' + cache.disk_path if cache.disk_path else 'off'})."
+                )
+    return cache
+
+def cached_completion(llm: Any, model: str, prompt: str) -> str:
+    """Invokes `llm` with `prompt` through the response cache (when enabled) and returns the completion text."""
+    def compute() -> str:
+        content = llm.invoke(prompt).content
+        return content if isinstance(content, str) else str(content)
+
+    cache = get_llm_cache()
+    if cache is None:
+        return compute()
+    return cache.get_or_compute(model, prompt, compute)
+
+def discard_completion(model: str, prompt: str):
+    """Drops a cached completion that turned out to be unusable, so the next identical request asks the model again."""
+    cache = get_llm_cache()
+    if cache is not None:
+        cache.invalidate(model, prompt)
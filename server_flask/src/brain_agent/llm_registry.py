@@ -0,0 +1,106 @@
+import logging
+import threading
+from typing import Any, Dict
+
+import httpx
+from flask import current_app
+from langchain_openai import ChatOpenAI
+
+logger = logging.getLogger(__name__)
+
+EXTENSION_KEY = 'llm_registry'
+
+ROLE_MAIN_AGENT = 'main_agent'
+ROLE_PLANNER = 'planner'
+ROLE_INSPECTOR = 'inspector'
+ROLE_CONFIG_GENERATOR = 'config_generator'
+ROLE_SUMMARIZER = 'summarizer'
+
+# Per-role defaults; each can be overridden with LLM_<ROLE>_MODEL / _TEMPERATURE / _TIMEOUT_SECONDS in config.
+ROLE_DEFAULTS: Dict[str, Dict[str, Any]] = {
+    ROLE_MAIN_AGENT: {"model": "gpt-4-turbo-preview", "temperature": 0.1, "timeout": 60},
+    ROLE_PLANNER: {"model": "gpt-3.5-turbo", "temperature": 0, "timeout": 30}, # Diagnostic plan selection
+    ROLE_INSPECTOR: {"model": "gpt-3.5-turbo", "temperature": 0, "timeout": 30}, # Config keyword / show command suggestions
+    ROLE_CONFIG_GENERATOR: {"model": "gpt-4-turbo-preview", "temperature": 0.1, "timeout": 60},
+    ROLE_SUMMARIZER: {"model": "gpt-3.5-turbo", "temperature": 0, "timeout": 30}, # History compaction
+}
+
+
+class LLMRegistry:
+    """
+    App-scoped registry of chat model clients, one per role, built on first use and shared across requests.
+
+    All clients share one pooled httpx.Client, so requests reuse kept-alive connections to the API instead
+    of each tool call paying for client construction and a fresh TLS handshake. Both the httpx client and
+    ChatOpenAI are safe to use from several threads at once.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self._clients: Dict[str, ChatOpenAI] = {}
+        self._lock = threading.Lock()
+        self._http_client = httpx.Client(limits=httpx.Limits(
+            max_connections=config.get('LLM_HTTP_MAX_CONNECTIONS', 20),
+            max_keepalive_connections=config.get('LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS', 10),
+        ))
+
+    def settings(self, role: str) -> Dict[str, Any]:
+        """Returns the effective model, temperature and timeout for `role`."""
+        if role not in ROLE_DEFAULTS:
+            raise ValueError(f"Unknown LLM role '{role}'. Known roles: {', '.join(ROLE_DEFAULTS)}")
+        defaults = ROLE_DEFAULTS[role]
+        prefix = f"LLM_{role.upper()}"
+        return {
+            "model": self.config.get(f"{prefix}_MODEL") or defaults["model"],
+            "temperature": float(self.config.get(f"{prefix}_TEMPERATURE", defaults["temperature"])),
+            "timeout": float(self.config.get(f"{prefix}_TIMEOUT_SECONDS", defaults["timeout"])),
+        }
+
+    def model_name(self, role: str) -> str:
+        return self.settings(role)["model"]
+
+    def get(self, role: str) -> ChatOpenAI:
+        client = self._clients.get(role)
+        if client is not None:
+            return client
+        with self._lock:
+            client = self._clients.get(role)
+            if client is None:
+                if not self.config.get('OPENAI_API_KEY'):
+                    raise ValueError("OPENAI_API_KEY is not set in the configuration.")
+                settings = self.settings(role)
+                client = ChatOpenAI(
+                    model=settings["model"],
+                    openai_api_key=self.config['OPENAI_API_KEY'],
+                    temperature=settings["temperature"],
+                    timeout=settings["timeout"],
+                    max_retries=self.config.get('LLM_MAX_RETRIES', 2),
+                    http_client=self._http_client,
+                )
+                self._clients[role] = client
+                logger.info(f"LLM client for role '{role}' created (model {settings['model']}, timeout {settings['timeout']}s).")
+        return client
+
+    def close(self):
+        self._http_client.close()
+
+
+def init_llm_registry(app) -> LLMRegistry:
+    """Creates the LLM client registry and stores it on app.extensions."""
+    registry = LLMRegistry(app.config)
+    app.extensions[EXTENSION_KEY] = registry
+    return registry
+
+def get_llm_registry() -> LLMRegistry:
+    """Returns the current app's LLM registry, creating it on first use if needed."""
+    registry = current_app.extensions.get(EXTENSION_KEY)
+    if registry is None:
+        registry = init_llm_registry(current_app._get_current_object())
+    return registry
+
+def get_llm(role: str) -> ChatOpenAI:
+    """Shortcut for get_llm_registry().get(role)."""
+    return get_llm_registry().get(role)
+
+def get_llm_model_name(role: str) -> str:
+    return get_llm_registry().model_name(role)
@@ -0,0 +1,136 @@
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from flask import current_app, has_app_context
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_STEP_TIMEOUT_SECONDS = 120
+
+
+class DiagnosticPlanExecutor:
+    """
+    Runs a diagnostic plan (a list of ``(command_id, parameters)`` steps from PYATS_CAPABILITIES_MAP) as a small DAG.
+
+    Steps are grouped into lanes by their ``device_name`` parameter. Lanes run concurrently on a bounded
+    worker pool while steps within a lane keep their plan order, so two checks against the same router
+    never race for its CLI. Steps with identical parameters are executed once and share their result.
+    Each step gets a timeout; once a step on a device times out, the remaining steps for that device are
+    skipped because its session is still busy with the hung command.
+    """
+
+    def __init__(self, capabilities_map: Dict[str, Dict[str, Any]],
+                 max_workers: int = DEFAULT_MAX_WORKERS,
+                 step_timeout: float = DEFAULT_STEP_TIMEOUT_SECONDS):
+        self.capabilities_map = capabilities_map
+        self.max_workers = max(1, max_workers)
+        self.step_timeout = step_timeout
+
+    @staticmethod
+    def _step_key(command_id: str, params: Dict[str, Any]) -> str:
+        return f"{command_id}:{json.dumps(params, sort_keys=True, default=str)}"
+
+    def run(self, steps: List[Tuple[str, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """
+        Executes `steps` and returns one result dict per input step, in the same order.
+        Each result has 'command_id', 'params', 'status' ('success', 'error', 'timeout' or 'skipped'),
+        'result' (the capability's return value, if any), 'error' and 'duration_ms'.
+        """
+        if not steps:
+            return []
+
+        # Merge duplicate steps; `step_slots` maps every input position to its unique step.
+        unique_steps: List[Tuple[str, Dict[str, Any]]] = []
+        slot_by_key: Dict[str, int] = {}
+        step_slots: List[int] = []
+        for command_id, params in steps:
+            key = self._step_key(command_id, params)
+            if key not in slot_by_key:
+                slot_by_key[key] = len(unique_steps)
+                unique_steps.append((command_id, params))
+            step_slots.append(slot_by_key[key])
+
+        # Group into per-device lanes, preserving plan order. Steps without a device get a lane of their own.
+        lanes: Dict[str, List[int]] = {}
+        for slot, (_, params) in enumerate(unique_steps):
+            lane_key = params.get("device_name") or f"__step_{slot}"
+            lanes.setdefault(lane_key, []).append(slot)
+
+        app = current_app._get_current_object() if has_app_context() else None
+        unique_results: List[Optional[Dict[str, Any]]] = [None] * len(unique_steps)
+        lane_workers = min(self.max_workers, len(lanes))
+        if len(unique_steps) != len(steps):
+            logger.info(f"Diagnostic plan: merged {len(steps) - len(unique_steps)} duplicate step(s).")
+        logger.info(f"Diagnostic plan: running {len(unique_steps)} step(s) across {len(lanes)} lane(s) with {lane_workers} worker(s).")
+
+        # Steps run on their own pool so that a lane can stop waiting on a hung step after its timeout.
+        # It is oversized so that a few hung steps still leave a worker for every lane.
+        step_pool = ThreadPoolExecutor(max_workers=lane_workers * 2, thread_name_prefix="diag-step")
+        try:
+            with ThreadPoolExecutor(max_workers=lane_workers, thread_name_prefix="diag-lane") as lane_pool:
+                lane_futures = [
+                    lane_pool.submit(self._run_lane, lane_key, slots, unique_steps, unique_results, step_pool, app)
+                    for lane_key, slots in lanes.items()
+                ]
+                for future in lane_futures:
+                    future.result()
+        finally:
+            step_pool.shutdown(wait=False, cancel_futures=True)
+
+        return [unique_results[slot] for slot in step_slots]
+
+    def _run_lane(self, lane_key: str, slots: List[int], unique_steps, unique_results, step_pool, app):
+        timed_out_step = None
+        for slot in slots:
+            command_id, params = unique_steps[slot]
+            if timed_out_step:
+                unique_results[slot] = self._result(command_id, params, "skipped",
+                                                    error=f"Skipped because '{timed_out_step}' timed out on the same device.")
+                continue
+
+            # The timeout starts when a worker picks the step up, not while it queues behind hung steps
+            started = threading.Event()
+            future = step_pool.submit(self._call_capability, command_id, params, app, started)
+            if not started.wait(self.step_timeout) and future.cancel():
+                logger.error(f"Diagnostic step {command_id} ({params}) waited {self.step_timeout}s for a worker.")
+                unique_results[slot] = self._result(command_id, params, "timeout",
+                                                    error=f"No worker free after {self.step_timeout}s; other steps are hung.")
+                continue
+            start = time.monotonic()
+            try:
+                result = future.result(timeout=self.step_timeout)
+                unique_results[slot] = self._result(command_id, params, "success", result=result, start=start)
+            except FutureTimeoutError:
+                logger.error(f"Diagnostic step {command_id} ({params}) timed out after {self.step_timeout}s.")
+                timed_out_step = command_id
+                unique_results[slot] = self._result(command_id, params, "timeout", start=start,
+                                                    error=f"Timed out after {self.step_timeout}s.")
+            except Exception as e:
+                logger.error(f"Error executing capability {command_id}: {e}", exc_info=True)
+                unique_results[slot] = self._result(command_id, params, "error", error=str(e), start=start)
+
+    def _call_capability(self, command_id: str, params: Dict[str, Any], app, started: threading.Event):
+        started.set()
+        func_to_call: Callable = self.capabilities_map[command_id]["function"]
+        logger.info(f"Executing diagnostic capability: {command_id} with params: {params}")
+        if app is None:
+            return func_to_call(**params)
+        with app.app_context(): # Helpers read current_app.config from worker threads
+            return func_to_call(**params)
+
+    @staticmethod
+    def _result(command_id: str, params: Dict[str, Any], status: str, result: Any = None,
+                error: Optional[str] = None, start: Optional[float] = None) -> Dict[str, Any]:
+        return {
+            "command_id": command_id,
+            "params": params,
+            "status": status,
+            "result": result,
+            "error": error,
+            "duration_ms": round((time.monotonic() - start) * 1000) if start is not None else 0,
+        }
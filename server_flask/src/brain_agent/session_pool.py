@@ -0,0 +1,262 @@
+import atexit
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from flask import current_app, has_app_context
+
+logger = logging.getLogger(__name__)
+
+# Defaults used when the pool is created outside of a Flask app context.
+DEFAULT_MAX_SESSIONS_PER_DEVICE = 2
+DEFAULT_IDLE_TTL_SECONDS = 300
+DEFAULT_ACQUIRE_TIMEOUT_SECONDS = 60
+DEFAULT_HEALTH_CHECK_AFTER_SECONDS = 30
+
+
+class SessionPoolTimeout(Exception):
+    """Raised when no session to a device could be leased within the acquire timeout."""
+
+
+class PooledSession:
+    """A live CLI connection to a testbed device, identified by its connection alias."""
+
+    def __init__(self, device: Any, alias: str, connection: Any, generation: int):
+        self.device = device
+        self.device_name = device.name
+        self.alias = alias
+        self.connection = connection
+        self.generation = generation
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+    @property
+    def idle_seconds(self) -> float:
+        return time.monotonic() - self.last_used
+
+
+class PyATSSessionPool:
+    """
+    Process-wide pool of PyATS device sessions keyed by testbed device name.
+
+    Sessions are opened under their own connection alias (``pool_<n>``) so that several
+    can exist per device, up to ``max_per_device``. A session idle for longer than
+    ``health_check_after`` seconds is probed before it is lent out, and sessions idle for
+    longer than ``idle_ttl`` seconds are disconnected by a background reaper.
+    """
+
+    def __init__(self,
+                 max_per_device: int = DEFAULT_MAX_SESSIONS_PER_DEVICE,
+                 idle_ttl: float = DEFAULT_IDLE_TTL_SECONDS,
+                 acquire_timeout: float = DEFAULT_ACQUIRE_TIMEOUT_SECONDS,
+                 health_check_after: float = DEFAULT_HEALTH_CHECK_AFTER_SECONDS,
+                 connect_via: Optional[str] = None):
+        self.max_per_device = max(1, max_per_device)
+        self.idle_ttl = idle_ttl
+        self.acquire_timeout = acquire_timeout
+        self.health_check_after = health_check_after
+        self.connect_via = connect_via
+
+        self._cond = threading.Condition()
+        self._idle: Dict[str, List[PooledSession]] = {}
+        self._open_counts: Dict[str, int] = {}
+        # Bumped by close_device(); sessions from an older generation are dropped on release.
+        self._generations: Dict[str, int] = {}
+        self._alias_counter = itertools.count(1)
+        self._closed = False
+        self._stats = {"created": 0, "reused": 0, "health_check_failures": 0, "evicted_idle": 0}
+
+        self._reaper = threading.Thread(target=self._reap_loop, name="pyats-session-reaper", daemon=True)
+        self._reaper.start()
+
+    # --- Leasing ---
+
+    @contextmanager
+    def session(self, device: Any):
+        """
+        Leases a connected session to `device` for the duration of the block and yields its connection.
+        The session goes back to the pool afterwards, or is discarded if the block raised.
+        """
+        pooled = self.acquire(device)
+        broken = True
+        try:
+            yield pooled.connection
+            broken = False
+        finally:
+            self.release(pooled, broken=broken)
+
+    def acquire(self, device: Any, timeout: Optional[float] = None) -> PooledSession:
+        device_name = device.name
+        deadline = time.monotonic() + (self.acquire_timeout if timeout is None else timeout)
+
+        while True:
+            candidate = None
+            with self._cond:
+                if self._closed:
+                    raise RuntimeError("PyATS session pool has been shut down.")
+                while True:
+                    idle = self._idle.get(device_name)
+                    if idle:
+                        candidate = idle.pop() # LIFO keeps the warmest session in use
+                        break
+                    if self._open_counts.get(device_name, 0) < self.max_per_device:
+                        self._open_counts[device_name] = self._open_counts.get(device_name, 0) + 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise SessionPoolTimeout(
+                            f"Timed out waiting for a free session to {device_name} "
+                            f"({self.max_per_device} already in use)."
+                        )
+                    self._cond.wait(remaining)
+                generation = self._generations.get(device_name, 0)
+
+            if candidate is None:
+                return self._open_session(device, generation)
+
+            if candidate.device is device and self._is_healthy(candidate):
+                candidate.last_used = time.monotonic()
+                self._stats["reused"] += 1
+                return candidate
+
+            # Stale (failed probe or the testbed device object was replaced): drop it and retry.
+            self._discard(candidate)
+
+    def release(self, pooled: PooledSession, broken: bool = False):
+        with self._cond:
+            stale = pooled.generation != self._generations.get(pooled.device_name, 0)
+            if not (broken or stale or self._closed) and self._is_connected(pooled):
+                pooled.last_used = time.monotonic()
+                self._idle.setdefault(pooled.device_name, []).append(pooled)
+                self._cond.notify_all()
+                return
+        self._discard(pooled)
+
+    # --- Invalidation / shutdown ---
+
+    def close_device(self, device_name: str):
+        """Disconnects idle sessions to `device_name`; leased ones are dropped when they are released."""
+        with self._cond:
+            self._generations[device_name] = self._generations.get(device_name, 0) + 1
+            sessions = self._idle.pop(device_name, [])
+        for pooled in sessions:
+            self._discard(pooled)
+
+    def close_all(self):
+        with self._cond:
+            self._closed = True
+            sessions = [s for idle in self._idle.values() for s in idle]
+            self._idle.clear()
+        for pooled in sessions:
+            self._discard(pooled)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                **self._stats,
+                "open_sessions": dict(self._open_counts),
+                "idle_sessions": {name: len(idle) for name, idle in self._idle.items() if idle},
+            }
+
+    # --- Internals ---
+
+    def _open_session(self, device: Any, generation: int) -> PooledSession:
+        alias = f"pool_{next(self._alias_counter)}"
+        connect_kwargs = {"alias": alias, "log_stdout": False, "learn_hostname": True}
+        if self.connect_via:
+            connect_kwargs["via"] = self.connect_via
+        try:
+            logger.info(f"Opening pooled session '{alias}' to {device.name}...")
+            device.connect(**connect_kwargs)
+            connection = device.connectionmgr.connections[alias]
+        except Exception:
+            self._forget(device.name)
+            raise
+        self._stats["created"] += 1
+        return PooledSession(device, alias, connection, generation)
+
+    def _discard(self, pooled: PooledSession):
+        try:
+            if self._is_connected(pooled):
+                logger.info(f"Disconnecting pooled session '{pooled.alias}' to {pooled.device_name}.")
+                pooled.device.disconnect(alias=pooled.alias)
+        except Exception as e:
+            logger.warning(f"Error disconnecting pooled session '{pooled.alias}' to {pooled.device_name}: {e}")
+        finally:
+            self._forget(pooled.device_name)
+
+    def _forget(self, device_name: str):
+        with self._cond:
+            remaining = self._open_counts.get(device_name, 1) - 1
+            if remaining > 0:
+                self._open_counts[device_name] = remaining
+            else:
+                self._open_counts.pop(device_name, None)
+            self._cond.notify_all()
+
+    @staticmethod
+    def _is_connected(pooled: PooledSession) -> bool:
+        try:
+            return bool(pooled.connection.connected)
+        except Exception:
+            return False
+
+    def _is_healthy(self, pooled: PooledSession) -> bool:
+        if not self._is_connected(pooled):
+            return False
+        if pooled.idle_seconds < self.health_check_after:
+            return True
+        try:
+            # An empty command just round-trips the prompt, which is enough to detect a dead VTY.
+            pooled.connection.execute("", timeout=10)
+            return True
+        except Exception as e:
+            logger.info(f"Pooled session '{pooled.alias}' to {pooled.device_name} failed its health check: {e}")
+            self._stats["health_check_failures"] += 1
+            return False
+
+    def _reap_loop(self):
+        interval = max(1.0, min(self.idle_ttl / 2, 30.0))
+        while True:
+            time.sleep(interval)
+            expired: List[PooledSession] = []
+            with self._cond:
+                if self._closed:
+                    return
+                for device_name, idle in self._idle.items():
+                    keep = [s for s in idle if s.idle_seconds <= self.idle_ttl]
+                    if len(keep) != len(idle):
+                        expired.extend(s for s in idle if s.idle_seconds > self.idle_ttl)
+                        self._idle[device_name] = keep
+            for pooled in expired:
+                self._stats["evicted_idle"] += 1
+                self._discard(pooled)
+
+
+# --- Process-wide singleton ---
+_session_pool: Optional[PyATSSessionPool] = None
+_session_pool_lock = threading.Lock()
+
+def get_session_pool() -> PyATSSessionPool:
+    """Gets or lazily creates the process-wide PyATS session pool, configured from the Flask app if available."""
+    global _session_pool
+    if _session_pool is None:
+        with _session_pool_lock:
+            if _session_pool is None:
+                config = current_app.config if has_app_context() else {}
+                _session_pool = PyATSSessionPool(
+                    max_per_device=int(config.get('PYATS_SESSION_MAX_PER_DEVICE', DEFAULT_MAX_SESSIONS_PER_DEVICE)),
+                    idle_ttl=float(config.get('PYATS_SESSION_IDLE_TTL_SECONDS', DEFAULT_IDLE_TTL_SECONDS)),
+                    acquire_timeout=float(config.get('PYATS_SESSION_ACQUIRE_TIMEOUT_SECONDS', DEFAULT_ACQUIRE_TIMEOUT_SECONDS)),
+                    health_check_after=float(config.get('PYATS_SESSION_HEALTH_CHECK_AFTER_SECONDS', DEFAULT_HEALTH_CHECK_AFTER_SECONDS)),
+                    connect_via=config.get('PYATS_SESSION_CONNECT_VIA'),
+                )
+                atexit.register(_session_pool.close_all)
+                logger.info(
+                    f"PyATS session pool initialized (max {_session_pool.max_per_device} per device, "
+                    f"idle TTL {_session_pool.idle_ttl}s)."
+                )
+    return _session_pool
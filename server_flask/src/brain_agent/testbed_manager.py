@@ -0,0 +1,348 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from elasticsearch import Elasticsearch
+from flask import current_app, has_app_context
+
+from .config_cache import get_running_config_cache
+from .device_logs import log_cursors
+from .genie_parsing import get_parse_cache
+from .session_pool import get_session_pool
+from .testbed_sync import TestbedSync, DEFAULT_PAGE_SIZE, ES_HOST_FOR_TESTBED_GEN, ES_DEVICE_INDEX_FOR_TESTBED_GEN
+
+try:
+    from pyats.topology import loader as pyats_loader, Testbed
+except ImportError:
+    pyats_loader = None
+    Testbed = None
+
+logger = logging.getLogger(__name__)
+
+# Defaults used when the manager is created outside of a Flask app context.
+DEFAULT_REFRESH_INTERVAL_SECONDS = 300
+DEFAULT_LOAD_TIMEOUT_SECONDS = 30
+DEFAULT_MISS_REFRESH_SECONDS = 60
+# Retry delay while no testbed has been loaded yet (ES down at startup, bad YAML, ...)
+INITIAL_RETRY_SECONDS = 15
+# First line of a testbed file we generated, so a restart keeps regenerating it instead of trusting it as hand-written
+GENERATED_FILE_MARKER = "# Auto-generated from the Elasticsearch device index; edits will be overwritten."
+
+class TestbedSnapshot(NamedTuple):
+    """
+    The published testbed and its bookkeeping. The tuple is replaced as a whole, so readers need no lock to get a
+    consistent generation and age. The testbed object it holds is not frozen: a generated testbed is edited in
+    place by syncs and pushed device changes, so look a device up once (testbed.devices.get) and keep using
+    that object rather than checking membership and indexing separately.
+    """
+    testbed: Any
+    generation: int
+    source: str # 'file' or 'elasticsearch'
+    loaded_at: float # time.monotonic() when this testbed object was built
+    verified_at: float # time.monotonic() when it was last confirmed current
+
+    @property
+    def age_seconds(self) -> float:
+        return time.monotonic() - self.verified_at
+
+
+class TestbedManager:
+    """
+    Owns the PyATS testbed and keeps it current from a background thread.
+
+    A testbed file that exists when the manager starts (and was not written by us, see GENERATED_FILE_MARKER)
+    is treated as hand-maintained and reloaded whenever its mtime changes. Otherwise the testbed is built from
+    the Elasticsearch device index and kept in step with it by an incremental TestbedSync on every refresh.
+    The sync edits the live testbed device by device, and the file is rewritten for reference after each sync
+    that changed something. Each successful load or changing sync swaps in a new TestbedSnapshot with the next
+    generation number; a failed refresh keeps serving the previous snapshot.
+
+    Nothing is loaded on the caller's thread: `get()` returns the current (possibly stale) testbed immediately,
+    blocking only until the very first load finishes, and `get(max_age=...)` asks for a refresh and waits for it
+    when the current snapshot is older than `max_age`.
+    """
+
+    def __init__(self, testbed_file: Optional[str],
+                 refresh_interval: float = DEFAULT_REFRESH_INTERVAL_SECONDS,
+                 load_timeout: float = DEFAULT_LOAD_TIMEOUT_SECONDS,
+                 miss_refresh_age: float = DEFAULT_MISS_REFRESH_SECONDS,
+                 sync_page_size: int = DEFAULT_PAGE_SIZE):
+        self.testbed_file = testbed_file
+        self.refresh_interval = refresh_interval
+        self.load_timeout = load_timeout
+        self.miss_refresh_age = miss_refresh_age
+        self.sync_page_size = sync_page_size
+        self._sync: Optional[TestbedSync] = None
+
+        self._snapshot: Optional[TestbedSnapshot] = None
+        self._cond = threading.Condition()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+        # Generated testbeds are rebuilt from Elasticsearch on every refresh; hand-maintained files are only re-read.
+        self._generated = testbed_file is None or not os.path.exists(testbed_file) or _is_generated_file(testbed_file)
+        self._file_mtime: Optional[float] = None
+        self._refreshing = False
+        self._finished_attempts = 0
+        self._last_attempt_at = 0.0 # monotonic start of the most recent finished refresh attempt, successful or not
+        self._last_error: Optional[str] = None
+        self._stats = {"refreshes": 0, "reloads": 0, "failures": 0, "pushed_changes": 0}
+
+    # --- Access ---
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None or self._stopped:
+                return
+            self._thread = threading.Thread(target=self._refresh_loop, name="pyats-testbed-refresher", daemon=True)
+            self._thread.start()
+
+    def snapshot(self) -> Optional[TestbedSnapshot]:
+        """The current snapshot without waiting; None until the first load has succeeded."""
+        return self._snapshot
+
+    def get(self, max_age: Optional[float] = None, timeout: Optional[float] = None) -> Optional[Any]:
+        """
+        Returns the testbed, or None if none could be loaded within `timeout` seconds.
+        With `max_age`, a snapshot verified longer ago than that triggers a refresh which this call waits for.
+        """
+        self.start()
+        timeout = self.load_timeout if timeout is None else timeout
+        snapshot = self._snapshot
+        if snapshot is not None and (max_age is None or snapshot.age_seconds <= max_age):
+            return snapshot.testbed
+
+        requested_at = time.monotonic()
+        deadline = requested_at + timeout
+        # Without any testbed, the outcome of whichever attempt finishes next is good enough (success or failure);
+        # a stale testbed needs an attempt that started after this request, or it may miss the change we want.
+        first_load = snapshot is None
+        with self._cond:
+            attempts_seen = self._finished_attempts
+            if not (first_load and self._refreshing):
+                self._wake.set()
+            while not self._stopped and (
+                    (first_load and self._finished_attempts == attempts_seen) or
+                    (not first_load and self._last_attempt_at < requested_at)):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning(f"Timed out after {timeout}s waiting for a testbed refresh; using the current testbed.")
+                    break
+                self._cond.wait(remaining)
+            snapshot = self._snapshot
+        return snapshot.testbed if snapshot is not None else None
+
+    def get_for_device(self, device_name: str) -> Optional[Any]:
+        """
+        Returns a testbed for a tool that needs `device_name`. If the current testbed does not know the device,
+        one refresh is forced (at most every `miss_refresh_age` seconds) in case it was added recently.
+        """
+        testbed = self.get()
+        if testbed is not None and device_name in testbed.devices:
+            return testbed
+        return self.get(max_age=self.miss_refresh_age)
+
+    def apply_device_changes(self, changes: List[Tuple[str, Optional[Dict[str, Any]]]]):
+        """
+        Pushes device writes from DeviceService, as (device_id, document or None if deleted), into the live
+        testbed, one device at a time. Only generated testbeds take pushed changes; a hand-maintained file stays
+        the source of truth for its testbed. Other workers pick the change up on their next sync.
+        """
+        sync, snapshot = self._sync, self._snapshot
+        if not self._generated or sync is None or snapshot is None:
+            return # Before the first sync has been published there is nothing to edit; that sync reads the index
+        result = sync.apply_devices(snapshot.testbed, changes)
+        if not result.has_changes:
+            return
+        with self._cond:
+            current = self._snapshot
+            self._snapshot = current._replace(generation=current.generation + 1)
+            self._stats["pushed_changes"] += 1
+        logger.info(
+            f"PyATS testbed generation {current.generation + 1}: pushed device changes "
+            f"(added {result.added}, changed {result.changed}, removed {result.removed})."
+        )
+
+    def request_refresh(self):
+        """Asks the background thread to refresh now without waiting for it."""
+        self.start()
+        self._wake.set()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._wake.set()
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        return {
+            **self._stats,
+            "loaded": snapshot is not None,
+            "generation": snapshot.generation if snapshot else 0,
+            "source": snapshot.source if snapshot else None,
+            "devices": len(snapshot.testbed.devices) if snapshot else 0,
+            "age_seconds": round(snapshot.age_seconds, 1) if snapshot else None,
+            "last_error": self._last_error,
+        }
+
+    # --- Refreshing ---
+
+    def _refresh_loop(self):
+        while not self._stopped:
+            self._wake.clear()
+            self._refreshing = True
+            try:
+                self.refresh()
+            finally:
+                self._refreshing = False
+            interval = self.refresh_interval if self._snapshot is not None else min(self.refresh_interval, INITIAL_RETRY_SECONDS)
+            self._wake.wait(interval)
+
+    def refresh(self):
+        """Reloads the testbed if its source changed and swaps it in. Runs on the refresher thread."""
+        self._stats["refreshes"] += 1
+        started = time.monotonic() # What the attempt reflects; waiters need an attempt that started after their request
+        try:
+            testbed, source = self._load()
+            error = None
+        except Exception as e:
+            logger.error(f"PyATS testbed refresh failed; keeping generation {self._snapshot.generation if self._snapshot else 0}: {e}", exc_info=True)
+            testbed, source, error = None, None, str(e)
+            self._stats["failures"] += 1
+
+        now = time.monotonic()
+        with self._cond:
+            current = self._snapshot
+            if testbed is not None:
+                self._snapshot = TestbedSnapshot(testbed, (current.generation if current else 0) + 1, source, now, started)
+                self._stats["reloads"] += 1
+                logger.info(f"PyATS testbed generation {self._snapshot.generation} loaded from {source} ({len(testbed.devices)} devices).")
+            elif error is None and current is not None:
+                self._snapshot = current._replace(verified_at=started) # Source unchanged: same testbed, fresh again
+            self._last_error = error
+            self._last_attempt_at = started
+            self._finished_attempts += 1
+            self._cond.notify_all()
+
+    def _load(self):
+        """Returns (testbed, source) if a new testbed was built, or (None, None) if the current one is still valid."""
+        if pyats_loader is None:
+            raise RuntimeError("PyATS is not installed.")
+        if not self.testbed_file:
+            raise RuntimeError("PYATS_TESTBED_FILE path not defined in environment or Flask config. Cannot load or auto-generate testbed.")
+
+        if self._generated:
+            return self._sync_from_elasticsearch()
+
+        mtime = os.path.getmtime(self.testbed_file)
+        if self._snapshot is not None and mtime == self._file_mtime:
+            return None, None
+        testbed = pyats_loader.load(self.testbed_file)
+        self._file_mtime = mtime
+        return testbed, 'file'
+
+    def _sync_from_elasticsearch(self):
+        if self._sync is None:
+            self._sync = TestbedSync(
+                Elasticsearch(ES_HOST_FOR_TESTBED_GEN, request_timeout=30),
+                index=ES_DEVICE_INDEX_FOR_TESTBED_GEN,
+                page_size=self.sync_page_size,
+                load_devices=pyats_loader.load,
+                on_device_replaced=self._forget_device,
+            )
+        current = self._snapshot
+        # The first sync fills a testbed nobody sees yet; later ones edit the published one in place.
+        testbed = current.testbed if current is not None else Testbed(name='generated')
+        try:
+            result = self._sync.sync(testbed)
+        except Exception:
+            if current is None:
+                self._sync = None # Its state describes the discarded testbed; start over next time
+            raise
+        if current is not None and not result.has_changes:
+            return None, None
+        logger.info(
+            f"Testbed sync from '{ES_DEVICE_INDEX_FOR_TESTBED_GEN}': {len(result.added)} added, {len(result.changed)} changed, "
+            f"{len(result.removed)} removed ({result.scanned} management IPs scanned)."
+        )
+        if not len(self._sync):
+            logger.warning(f"No valid devices found in index '{ES_DEVICE_INDEX_FOR_TESTBED_GEN}' for the generated testbed.")
+        self._write_testbed_file()
+        return testbed, 'elasticsearch'
+
+    def _forget_device(self, device_name: str):
+        """Drops per-device state tied to a testbed device that was replaced or removed."""
+        get_session_pool().close_device(device_name)
+        get_running_config_cache().invalidate(device_name)
+        get_parse_cache().invalidate(device_name)
+        log_cursors.reset(device_name)
+
+    def _write_testbed_file(self):
+        # Written via a temp file and rename so readers of the file never see half a testbed.
+        try:
+            directory = os.path.dirname(self.testbed_file)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.testbed_file}.tmp"
+            with open(tmp_path, 'w') as f:
+                self._sync.write_yaml(f, header=GENERATED_FILE_MARKER)
+            os.replace(tmp_path, self.testbed_file)
+        except Exception as e:
+            logger.error(f"Failed to write auto-generated testbed file to '{self.testbed_file}': {e}")
+
+
+def _is_generated_file(path: str) -> bool:
+    try:
+        with open(path) as f:
+            return f.readline().rstrip("\n") == GENERATED_FILE_MARKER
+    except OSError:
+        return False
+
+
+# --- Process-wide singleton ---
+_testbed_manager: Optional[TestbedManager] = None
+_testbed_manager_lock = threading.Lock()
+
+def get_testbed_manager() -> TestbedManager:
+    """Gets or lazily creates (and starts) the process-wide testbed manager, configured from the Flask app if available."""
+    global _testbed_manager
+    if _testbed_manager is None:
+        with _testbed_manager_lock:
+            if _testbed_manager is None:
+                config = current_app.config if has_app_context() else {}
+                # The environment variable takes priority over the Flask config, as before
+                testbed_file = os.environ.get("PYATS_TESTBED_FILE") or config.get("PYATS_TESTBED_FILE")
+                manager = TestbedManager(
+                    testbed_file,
+                    refresh_interval=float(config.get('PYATS_TESTBED_REFRESH_SECONDS', DEFAULT_REFRESH_INTERVAL_SECONDS)),
+                    load_timeout=float(config.get('PYATS_TESTBED_LOAD_TIMEOUT_SECONDS', DEFAULT_LOAD_TIMEOUT_SECONDS)),
+                    miss_refresh_age=float(config.get('PYATS_TESTBED_MISS_REFRESH_SECONDS', DEFAULT_MISS_REFRESH_SECONDS)),
+                    sync_page_size=int(config.get('PYATS_TESTBED_SYNC_PAGE_SIZE', DEFAULT_PAGE_SIZE)),
+                )
+                manager.start()
+                atexit.register(manager.stop)
+                logger.info(
+                    f"PyATS testbed manager started (file {testbed_file}, "
+                    f"{'generated from Elasticsearch' if manager._generated else 'hand-maintained'}, "
+                    f"refresh every {manager.refresh_interval}s)."
+                )
+                _testbed_manager = manager
+    return _testbed_manager
+
+def get_testbed(device_name: Optional[str] = None, max_age: Optional[float] = None) -> Optional[Any]:
+    """
+    The PyATS testbed for tools: stale-ok by default, or refreshed when older than `max_age` seconds.
+    Passing `device_name` forces a refresh when the current testbed does not contain that device.
+    """
+    manager = get_testbed_manager()
+    if device_name is not None and max_age is None:
+        return manager.get_for_device(device_name)
+    return manager.get(max_age=max_age)
+
+def testbed_manager_stats() -> Optional[Dict[str, Any]]:
+    """Stats of the testbed manager if it has been created; never creates it."""
+    return _testbed_manager.stats() if _testbed_manager is not None else None
@@ -0,0 +1,322 @@
+import logging
+import os
+import textwrap
+import threading
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+import yaml
+from elasticsearch import Elasticsearch
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 1000
+
+# --- Environment Variables for Auto-Generated Testbed (if main testbed file not found) ---
+PYATS_GEN_DEFAULT_USERNAME = os.environ.get("PYATS_GEN_DEFAULT_USERNAME", "admin")
+PYATS_GEN_DEFAULT_PASSWORD = os.environ.get("PYATS_GEN_DEFAULT_PASSWORD", "cisco") # Example, use secure defaults
+PYATS_GEN_DEFAULT_PROTOCOL = os.environ.get("PYATS_GEN_DEFAULT_PROTOCOL", "ssh")
+PYATS_GEN_ENABLE_PASSWORD = os.environ.get("PYATS_GEN_ENABLE_PASSWORD") # Optional
+ES_HOST_FOR_TESTBED_GEN = os.environ.get('ES_HOST_FOR_TESTBED_GEN', 'http://localhost:9200')
+ES_DEVICE_INDEX_FOR_TESTBED_GEN = os.environ.get('ES_DEVICE_INDEX_FOR_TESTBED_GEN', 'devices_index')
+# Define which device types from Elasticsearch should be included in the auto-generated testbed
+ES_DEVICE_TYPES_FOR_TESTBED = ["router", "switch", "firewall"] # Customize as needed
+
+
+class SyncedDevice(NamedTuple):
+    """What the sync remembers per management IP: enough to rebuild the testbed entry and detect changes."""
+    name: Optional[str] # None if the representative document is unusable (missing name, platform or type)
+    os: Optional[str]
+    type: Optional[str]
+    updated_at: Optional[float] # max(updatedAt) over the IP's documents, epoch millis
+    doc_count: int
+    pushed_epoch: Optional[int] = None # Sync epoch in which apply_device() set this entry
+
+
+class SyncResult(NamedTuple):
+    added: List[str]
+    changed: List[str]
+    removed: List[str]
+    scanned: int # Management IPs seen in the device index
+
+    @property
+    def has_changes(self) -> bool:
+        return bool(self.added or self.changed or self.removed)
+
+
+def build_device_entry(device_os: str, device_type: str, device_ip: str) -> Dict[str, Any]:
+    """The testbed YAML entry for one device from the index."""
+    pyats_device_entry = {
+        'os': device_os,
+        'type': device_type,
+        'connections': {
+            'cli': {
+                'protocol': PYATS_GEN_DEFAULT_PROTOCOL,
+                'ip': device_ip
+            }
+        },
+        'credentials': {
+            'default': {
+                'username': PYATS_GEN_DEFAULT_USERNAME,
+                'password': PYATS_GEN_DEFAULT_PASSWORD
+            }
+        }
+    }
+    if PYATS_GEN_ENABLE_PASSWORD:
+        pyats_device_entry['credentials']['enable'] = {'password': PYATS_GEN_ENABLE_PASSWORD}
+    return pyats_device_entry
+
+
+class TestbedSync:
+    """
+    Keeps a PyATS testbed in step with the device index, one device per unique management IP.
+
+    Each sync walks every IP with a composite aggregation, `page_size` buckets at a time, fetching only the
+    IP, its document count and max(updatedAt). Those per-IP watermarks are compared with what the previous
+    sync saw. Full documents are fetched only for IPs that are new or whose watermark moved, and IPs that
+    no longer appear are removed. Changes are applied to the testbed one page at a time, so memory stays at
+    one page of documents plus a small SyncedDevice tuple per device, even for very large inventories.
+
+    Changes pushed between syncs (`apply_device`, from DeviceService writes) edit the same testbed and state.
+
+    `load_devices` turns a {'devices': {...}} dict into a testbed (pyats loader.load). Its devices are moved
+    into the live testbed. `on_device_replaced(name)` is called for every device that was updated or
+    removed, so per-device state such as pooled sessions can be dropped. Devices whose name, OS, type and IP
+    did not change keep their device object, and with it their sessions. Both run outside the lock: loading
+    before it is taken, callbacks after it is released, so a slow disconnect never stalls a pushed change.
+    """
+
+    def __init__(self, es: Elasticsearch, index: str = ES_DEVICE_INDEX_FOR_TESTBED_GEN,
+                 device_types: List[str] = ES_DEVICE_TYPES_FOR_TESTBED, page_size: int = DEFAULT_PAGE_SIZE,
+                 load_devices: Optional[Callable[[Dict[str, Any]], Any]] = None,
+                 on_device_replaced: Optional[Callable[[str], None]] = None):
+        self.es = es
+        self.index = index
+        self.device_types = device_types
+        self.page_size = page_size
+        self.load_devices = load_devices
+        self.on_device_replaced = on_device_replaced
+        self._state: Dict[str, SyncedDevice] = {} # management IP -> last synced watermark and entry fields
+        self._owners: Dict[str, str] = {} # device name -> IP whose document currently defines it
+        self._ids: Dict[str, str] = {} # device document id -> its IP, for changes pushed by DeviceService
+        self._epoch = 0 # Incremented by every sync
+        # Syncs take it per page and pushed changes per device, never across Elasticsearch requests
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._owners)
+
+    # --- Reading the index ---
+
+    def iter_watermark_pages(self) -> Iterator[List[Tuple[str, Optional[float], int]]]:
+        """Yields pages of (ip, max_updated_at_millis, doc_count) for every management IP, in IP order."""
+        after_key = None
+        while True:
+            composite: Dict[str, Any] = {
+                "size": self.page_size,
+                "sources": [{"ip": {"terms": {"field": "ipAddress"}}}],
+            }
+            if after_key:
+                composite["after"] = after_key
+            res = self.es.search(
+                index=self.index,
+                size=0,
+                query={"terms": {"type": self.device_types}},
+                aggs={"by_ip": {"composite": composite, "aggs": {"last_updated": {"max": {"field": "updatedAt"}}}}},
+            )
+            agg = res.get('aggregations', {}).get('by_ip', {})
+            buckets = agg.get('buckets', [])
+            if not buckets:
+                return
+            yield [(b['key']['ip'], b['last_updated'].get('value'), b['doc_count']) for b in buckets]
+            after_key = agg.get('after_key')
+            if not after_key or len(buckets) < self.page_size:
+                return
+
+    def fetch_latest_documents(self, ips: List[str]) -> Dict[str, Dict[str, Any]]:
+        """The most recently updated document per IP, for a page of IPs."""
+        res = self.es.search(
+            index=self.index,
+            size=0,
+            query={"bool": {"filter": [{"terms": {"type": self.device_types}}, {"terms": {"ipAddress": ips}}]}},
+            aggs={"by_ip": {
+                "terms": {"field": "ipAddress", "size": len(ips)},
+                "aggs": {"latest": {"top_hits": {
+                    "size": 1,
+                    "sort": [{"updatedAt": {"order": "desc", "missing": "_last"}}],
+                    "_source": ["name", "platform", "type"],
+                }}},
+            }},
+        )
+        documents = {}
+        for bucket in res.get('aggregations', {}).get('by_ip', {}).get('buckets', []):
+            hits = bucket['latest']['hits']['hits']
+            if hits:
+                documents[bucket['key']] = {**hits[0]['_source'], '_id': hits[0]['_id']}
+        return documents
+
+    # --- Applying changes ---
+
+    def sync(self, testbed: Any) -> SyncResult:
+        """Brings `testbed` in line with the index in place and returns what changed."""
+        added: List[str] = []
+        changed: List[str] = []
+        removed: List[str] = []
+        seen: Set[str] = set()
+        with self._lock:
+            self._epoch += 1
+        for page in self.iter_watermark_pages():
+            stale = []
+            with self._lock:
+                for ip, updated_at, doc_count in page:
+                    seen.add(ip)
+                    previous = self._state.get(ip)
+                    if previous is None or previous.updated_at != updated_at or previous.doc_count != doc_count:
+                        stale.append((ip, updated_at, doc_count))
+            if stale:
+                documents = self.fetch_latest_documents([ip for ip, _, _ in stale])
+                items = [(ip, updated_at, doc_count, documents.get(ip) or {}) for ip, updated_at, doc_count in stale]
+                devices = self._load_devices(items)
+                replaced: List[str] = []
+                with self._lock:
+                    self._apply_documents(testbed, items, devices, added, changed, removed, replaced)
+                self._notify_replaced(replaced)
+
+        replaced = []
+        with self._lock:
+            # Devices pushed in while this sync was scanning may not have been visible to it yet
+            gone = [ip for ip, synced in self._state.items() if ip not in seen and synced.pushed_epoch != self._epoch]
+            for ip in gone:
+                self._forget_ip(testbed, ip, removed, replaced)
+            if len(self._ids) > 2 * len(self._state) + self.page_size:
+                self._ids = {device_id: ip for device_id, ip in self._ids.items() if ip in self._state}
+        self._notify_replaced(replaced)
+        return SyncResult(added, changed, removed, len(seen))
+
+    def apply_devices(self, testbed: Any, changes: List[Tuple[str, Optional[Dict[str, Any]]]]) -> SyncResult:
+        """
+        Applies device documents that were just written, as (device_id, document) pairs with None for a
+        deleted device, without waiting for the next sync. Their watermarks are left unset, so the next sync
+        re-reads those IPs once to confirm them.
+        """
+        added: List[str] = []
+        changed: List[str] = []
+        removed: List[str] = []
+        replaced: List[str] = []
+        kept = {device_id: doc for device_id, doc in changes
+                if doc is not None and doc.get('type') in self.device_types and doc.get('ipAddress')}
+        items = [(doc['ipAddress'], None, 0, {**doc, '_id': device_id}) for device_id, doc in kept.items()]
+        devices = self._load_devices(items)
+        with self._lock:
+            for device_id, doc in changes:
+                old_ip = self._ids.pop(device_id, None)
+                if old_ip is not None and (device_id not in kept or kept[device_id]['ipAddress'] != old_ip):
+                    # The device left its old IP. Other documents on that IP, if any, come back with the next sync.
+                    self._forget_ip(testbed, old_ip, removed, replaced)
+            if items:
+                self._apply_documents(testbed, items, devices, added, changed, removed, replaced, pushed_epoch=self._epoch)
+        self._notify_replaced(replaced)
+        return SyncResult(added, changed, removed, 0)
+
+    def _load_devices(self, items: List[Tuple[str, Optional[float], int, Dict[str, Any]]]) -> Dict[Tuple[str, str], Any]:
+        """Testbed device objects for the usable documents of `items`, by (name, ip). Called without the lock."""
+        entries: Dict[str, Dict[str, Any]] = {}
+        ips: Dict[str, str] = {}
+        for ip, _, _, doc in items:
+            name, device_os, device_type = doc.get('name'), doc.get('platform'), doc.get('type')
+            if all([name, device_os, device_type]):
+                entries[name] = build_device_entry(device_os, device_type, ip)
+                ips[name] = ip
+        if not entries:
+            return {}
+        loaded = self.load_devices({'devices': entries})
+        devices = {}
+        for device in list(loaded.devices.values()):
+            loaded.remove_device(device)
+            devices[(device.name, ips[device.name])] = device
+        return devices
+
+    def _apply_documents(self, testbed: Any, items: List[Tuple[str, Optional[float], int, Dict[str, Any]]],
+                         devices: Dict[Tuple[str, str], Any], added: List[str], changed: List[str], removed: List[str],
+                         replaced: List[str], pushed_epoch: Optional[int] = None):
+        """
+        Applies (ip, updated_at, doc_count, latest_document) entries, taking new device objects from `devices`
+        (see _load_devices). Callers hold the lock.
+        """
+        updates: Dict[str, Tuple[str, str, str]] = {} # name -> (ip, os, type) of the document that defines it
+        new_state: Dict[str, SyncedDevice] = {}
+        for ip, updated_at, doc_count, doc in items:
+            name, device_os, device_type = doc.get('name'), doc.get('platform'), doc.get('type')
+            if doc.get('_id'):
+                self._ids[doc['_id']] = ip
+            previous = self._state.get(ip)
+            if previous and previous.name and previous.name != name and self._owners.get(previous.name) == ip:
+                # Renamed (or no longer usable): the old name goes away
+                self._remove_device(testbed, previous.name, replaced)
+                removed.append(previous.name)
+            if not all([name, device_os, device_type]):
+                logger.warning(f"Skipping device (IP: {ip}) due to missing critical info (name, platform, type): {doc}")
+                new_state[ip] = SyncedDevice(None, None, None, updated_at, doc_count, pushed_epoch)
+                continue
+            new_state[ip] = SyncedDevice(name, device_os, device_type, updated_at, doc_count, pushed_epoch)
+            if (previous and (previous.name, previous.os, previous.type) == (name, device_os, device_type)
+                    and self._owners.get(name) == ip and name in testbed.devices):
+                continue # Only fields the testbed does not use changed (status, site, ...): keep the device object
+            owner = self._owners.get(name)
+            if owner is not None and owner != ip and owner in self._state:
+                logger.warning(f"Duplicate device name '{name}' encountered during testbed sync for IP {ip} (also {owner}). Overwriting. Ensure names are unique or adjust testbed keying.")
+            updates[name] = (ip, device_os, device_type)
+
+        for name, (ip, device_os, device_type) in updates.items():
+            device = devices.get((name, ip))
+            if device is None:
+                # Another document of the batch with the same name was loaded in its place (duplicate names)
+                device = self.load_devices({'devices': {name: build_device_entry(device_os, device_type, ip)}}).devices[name]
+            exists = name in testbed.devices
+            if exists:
+                self._remove_device(testbed, name, replaced)
+            testbed.add_device(device)
+            (changed if exists else added).append(name)
+        for ip, synced in new_state.items():
+            self._state[ip] = synced
+            if synced.name:
+                self._owners[synced.name] = ip
+
+    def _forget_ip(self, testbed: Any, ip: str, removed: List[str], replaced: List[str]):
+        name = self._state.pop(ip).name if ip in self._state else None
+        if name and self._owners.get(name) == ip:
+            self._remove_device(testbed, name, replaced)
+            removed.append(name)
+
+    def _remove_device(self, testbed: Any, name: str, replaced: List[str]):
+        """Takes the device out of the testbed and records it for on_device_replaced, once the lock is released."""
+        device = testbed.devices.get(name)
+        if device is not None:
+            testbed.remove_device(device)
+        self._owners.pop(name, None)
+        replaced.append(name)
+
+    def _notify_replaced(self, names: List[str]):
+        if not self.on_device_replaced:
+            return
+        for name in dict.fromkeys(names):
+            try:
+                self.on_device_replaced(name)
+            except Exception as e:
+                logger.error(f"Dropping per-device state of replaced testbed device {name} failed: {e}", exc_info=True)
+
+    # --- Reference file ---
+
+    def write_yaml(self, stream, header: Optional[str] = None):
+        """Streams the synced testbed as YAML, one device at a time."""
+        with self._lock:
+            devices = [(name, ip, self._state[ip]) for name, ip in self._owners.items()]
+        if header:
+            stream.write(header + "\n")
+        if not devices:
+            stream.write("devices: {}\n")
+            return
+        stream.write("devices:\n")
+        for name, ip, synced in devices:
+            entry = yaml.dump({name: build_device_entry(synced.os, synced.type, ip)},
+                              sort_keys=False, default_flow_style=False, Dumper=yaml.SafeDumper)
+            stream.write(textwrap.indent(entry, "  "))
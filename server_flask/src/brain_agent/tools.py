@@ -1,16 +1,29 @@
 from langchain_core.tools import tool
-from langchain_openai import ChatOpenAI # For the diagnostic tool's LLM
 from flask import current_app
 import logging
-import os
 import re # For MAC/IP address validation
 import json # For parsing LLM response
-import yaml # For writing YAML for auto-generated testbed
-from typing import List, Dict, Any, Callable
-from elasticsearch import Elasticsearch, exceptions as es_exceptions # For Elasticsearch
+from typing import List, Dict, Any
+from elasticsearch import exceptions as es_exceptions # For Elasticsearch
 from pyats.easypy import run # For running pyATS jobs/scripts
 from pyats.topology import loader # For loading testbed
 
+from .session_pool import get_session_pool
+from .plan_executor import DiagnosticPlanExecutor
+from .llm_cache import cached_completion, discard_completion
+from .config_cache import get_running_config_cache
+from .config_tree import get_config_tree
+from .testbed_manager import get_testbed
+from .genie_parsing import (get_parse_cache, cpu_command, memory_command, interface_command, all_interfaces_command,
+                            summarize_cpu, summarize_memory, summarize_interface, summarize_interfaces, format_summary)
+from .device_logs import build_log_command, filter_log_output, compile_log_filter, log_cursors, TIME_BOUNDED_CURSOR_OSES
+from .llm_registry import get_llm, get_llm_model_name, ROLE_PLANNER, ROLE_INSPECTOR, ROLE_CONFIG_GENERATOR
+from ..services.elasticsearch_client import get_es_client as get_shared_es_client
+from ..services.log_index import search_syslog
+from ..services.metrics_index import latest_device_health, top_device_health, DEVICE_METRICS, INTERFACE_METRICS
+from ..services.metrics_analysis import find_anomalies, health_metrics_source, device_names_at_site, SNMP_SOURCE, METHODS
+from ..services.syslog_parser import SEVERITY_LABELS
+
 # For a real PyATS integration, you'd need a testbed file.
 # PYATS_TESTBED_FILE = os.environ.get("PYATS_TESTBED_FILE", "testbed.yaml") 
 # testbed = None
@@ -37,155 +50,7 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
-# --- Environment Variables for Auto-Generated Testbed (if main testbed file not found) ---
-PYATS_GEN_DEFAULT_USERNAME = os.environ.get("PYATS_GEN_DEFAULT_USERNAME", "admin")
-PYATS_GEN_DEFAULT_PASSWORD = os.environ.get("PYATS_GEN_DEFAULT_PASSWORD", "cisco") # Example, use secure defaults
-PYATS_GEN_DEFAULT_PROTOCOL = os.environ.get("PYATS_GEN_DEFAULT_PROTOCOL", "ssh")
-PYATS_GEN_ENABLE_PASSWORD = os.environ.get("PYATS_GEN_ENABLE_PASSWORD") # Optional
-ES_HOST_FOR_TESTBED_GEN = os.environ.get('ES_HOST_FOR_TESTBED_GEN', 'http://localhost:9200')
-ES_DEVICE_INDEX_FOR_TESTBED_GEN = os.environ.get('ES_DEVICE_INDEX_FOR_TESTBED_GEN', 'devices_index')
-# Define which device types from Elasticsearch should be included in the auto-generated testbed
-ES_DEVICE_TYPES_FOR_TESTBED = ["router", "switch", "firewall"] # Customize as needed
-
-# --- PyATS Testbed Loading (with auto-generation fallback) ---
-testbed = None
-if PYATS_AVAILABLE:
-    pyats_testbed_file_path = None
-    # Prioritize environment variable for testbed path
-    env_path = os.environ.get("PYATS_TESTBED_FILE")
-    if env_path:
-        pyats_testbed_file_path = env_path
-    elif current_app: # Fallback to Flask app config if current_app is available
-        pyats_testbed_file_path = current_app.config.get("PYATS_TESTBED_FILE")
-
-    if not pyats_testbed_file_path:
-        logger.warning("PYATS_TESTBED_FILE path not defined in environment or Flask config. Cannot load or auto-generate testbed.")
-    else:
-        if not os.path.exists(pyats_testbed_file_path):
-            logger.info(f"PyATS testbed file '{pyats_testbed_file_path}' not found. Attempting to auto-generate from Elasticsearch.")
-            try:
-                es_client_gen = Elasticsearch(ES_HOST_FOR_TESTBED_GEN, request_timeout=10)
-                if not es_client_gen.ping():
-                    raise es_exceptions.ConnectionError(f"Failed to connect to ES at {ES_HOST_FOR_TESTBED_GEN} for testbed generation.")
-                logger.info(f"Connected to ES at {ES_HOST_FOR_TESTBED_GEN} for testbed generation.")
-
-                # Define the field name for IP address in your ES index
-                # This should be a keyword field or an IP field for accurate aggregation.
-                # If it's a text field, use .keyword (e.g., "ipAddress.keyword")
-                ip_address_field_for_aggregation = "ipAddress.keyword" 
-                # If your ipAddress field is already mapped as type 'ip', you might just use "ipAddress"
-                # Adjust if your field name is different, e.g., "managementIp.keyword"
-
-                query_body = {
-                    "size": 0,  # We don't need the hits from the main query, only aggregations
-                    "query": {
-                        "terms": {
-                            "type.keyword": ES_DEVICE_TYPES_FOR_TESTBED
-                        }
-                    },
-                    "aggs": {
-                        "unique_ips": {
-                            "terms": {
-                                "field": ip_address_field_for_aggregation,
-                                "size": 1000  # Max unique IPs to consider for testbed
-                            },
-                            "aggs": {
-                                "representative_doc": {
-                                    "top_hits": {
-                                        "size": 1 # Get only one document per unique IP
-                                        # If you have a timestamp, you can sort to get the most recent:
-                                        # "sort": [{"@timestamp": {"order": "desc"}}]
-                                    }
-                                }
-                            }
-                        }
-                    }
-                }
-                logger.debug(f"Elasticsearch query for testbed generation: {json.dumps(query_body)}")
-                res = es_client_gen.search(index=ES_DEVICE_INDEX_FOR_TESTBED_GEN, body=query_body)
-                
-                # Process aggregation results
-                pyats_testbed_dict = {'devices': {}}
-                buckets = res.get('aggregations', {}).get('unique_ips', {}).get('buckets', [])
-
-                if buckets:
-                    for bucket in buckets:
-                        # The representative document is in the top_hits of the sub-aggregation
-                        if bucket['representative_doc']['hits']['hits']:
-                            device_data = bucket['representative_doc']['hits']['hits'][0]['_source']
-                            device_name = device_data.get('name')
-                            device_os = device_data.get('platform') 
-                            device_type_from_es = device_data.get('type')
-                            # The IP address is the key of the bucket in this aggregation
-                            device_ip = bucket.get('key') 
-
-                            if not all([device_name, device_os, device_type_from_es, device_ip]):
-                                logger.warning(f"Skipping device (IP: {device_ip}) due to missing critical info (name, platform, type): {device_data}")
-                                continue
-                            
-                            pyats_device_entry = {
-                                'os': device_os,
-                                'type': device_type_from_es,
-                                'connections': {
-                                    'cli': {
-                                        'protocol': PYATS_GEN_DEFAULT_PROTOCOL,
-                                        'ip': device_ip
-                                    }
-                                },
-                                'credentials': {
-                                    'default': {
-                                        'username': PYATS_GEN_DEFAULT_USERNAME,
-                                        'password': PYATS_GEN_DEFAULT_PASSWORD
-                                    }
-                                }
-                            }
-                            if PYATS_GEN_ENABLE_PASSWORD:
-                                pyats_device_entry['credentials']['enable'] = {'password': PYATS_GEN_ENABLE_PASSWORD}
-                            
-                            # Use device_name as the key in the testbed. Ensure device_name is unique.
-                            # If multiple devices could share a name but have different IPs (unlikely for management IPs),
-                            # you might need a different strategy for the testbed device key.
-                            if device_name in pyats_testbed_dict['devices']:
-                                logger.warning(f"Duplicate device name '{device_name}' encountered during testbed generation for IP {device_ip}. Overwriting. Ensure names are unique or adjust testbed keying.")
-                            pyats_testbed_dict['devices'][device_name] = pyats_device_entry
-                    
-                    if pyats_testbed_dict['devices']:
-                        try:
-                            # Ensure parent directory exists
-                            os.makedirs(os.path.dirname(pyats_testbed_file_path), exist_ok=True)
-                            with open(pyats_testbed_file_path, 'w') as f:
-                                yaml.dump(pyats_testbed_dict, f, sort_keys=False, default_flow_style=False, Dumper=yaml.SafeDumper)
-                            logger.info(f"Successfully auto-generated PyATS testbed file at '{pyats_testbed_file_path}'.")
-                        except IOError as e:
-                            logger.error(f"Failed to write auto-generated testbed file to '{pyats_testbed_file_path}': {e}")
-                        except yaml.YAMLError as e:
-                            logger.error(f"Failed to dump testbed data to YAML for '{pyats_testbed_file_path}': {e}")
-                    else:
-                        logger.warning(f"No valid devices processed from Elasticsearch aggregations to generate testbed.")
-                else:
-                    logger.warning(f"No device IP buckets returned from Elasticsearch aggregation on index '{ES_DEVICE_INDEX_FOR_TESTBED_GEN}' for testbed generation.")
-
-            except es_exceptions.ConnectionError as e_conn:
-                 logger.error(f"Elasticsearch connection error during testbed auto-generation: {e_conn}")
-            except es_exceptions.NotFoundError as e_nf:
-                logger.error(f"Elasticsearch index '{ES_DEVICE_INDEX_FOR_TESTBED_GEN}' not found during testbed auto-generation: {e_nf}")
-            except es_exceptions.ElasticsearchException as e_es:
-                logger.error(f"Elasticsearch query error during testbed auto-generation: {e_es}", exc_info=True)
-            except Exception as e_gen:
-                logger.error(f"Unexpected error during PyATS testbed auto-generation: {e_gen}", exc_info=True)
-
-        # Attempt to load the testbed file (either pre-existing or newly generated)
-        if os.path.exists(pyats_testbed_file_path):
-            try:
-                testbed = pyats_loader.load(pyats_testbed_file_path)
-                logger.info(f"Successfully loaded PyATS testbed from '{pyats_testbed_file_path}'.")
-            except Exception as e:
-                logger.error(f"Failed to load PyATS testbed from '{pyats_testbed_file_path}': {e}", exc_info=True)
-                testbed = None # Ensure testbed is None if loading failed
-        else:
-            logger.warning(f"PyATS testbed file '{pyats_testbed_file_path}' not found, even after auto-generation attempt. PyATS tools will be limited.")
-            
-elif not PYATS_AVAILABLE:
+if not PYATS_AVAILABLE:
     logger.info("PyATS not available, PyATS tools will be simulated.")
 
 # --- Regex for IP and MAC ---
@@ -195,193 +60,178 @@ MAC_ADDRESS_REGEX = r"^([0-9A-Fa-f]{2}[:-]){5}([0-9A-Fa-f]{2})$"
 IP_ADDRESS_REGEX = r"^((25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.){3}(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)$"
 
 # --- Helper to get Elasticsearch client ---
-# In a larger application, you might have a shared ES client utility
+# Tools share the app-scoped client (and its connection pool) with DeviceService.
 def get_es_client():
-    es_host = current_app.config.get('ELASTICSEARCH_HOST', 'http://localhost:9200')
-    return Elasticsearch(es_host)
+    return get_shared_es_client()
 
 # --- PyATS Helper Functions (Implement with actual PyATS logic) ---
 
-def _pyats_check_device_cpu_memory(device_name: str) -> Dict[str, Any]:
+def _pyats_check_device_cpu_memory(device_name: str, use_cache: bool = True) -> Dict[str, Any]:
     logger.info(f"PyATS Helper: Checking CPU/Memory for {device_name}")
-    if not PYATS_AVAILABLE or not testbed or device_name not in testbed.devices:
+    testbed = get_testbed(device_name) if PYATS_AVAILABLE else None
+    device = testbed.devices.get(device_name) if testbed else None
+    if device is None:
         return {"status": "error", "output": f"PyATS unavailable or device {device_name} not in testbed."}
-    
-    device = testbed.devices[device_name]
-    output_summary = []
-    error_occurred = False
+    parse_cache = get_parse_cache()
 
     try:
-        logger.info(f"Connecting to {device_name} for CPU/Memory check...")
-        device.connect(log_stdout=False, learn_hostname=True) # learn_hostname can be useful
-
-        # Example for Cisco IOS/IOS-XE - adapt for other OS types using device.os
-        # For CPU:
-        # 'show processes cpu sorted' can be very long. 'show processes cpu history' is often better for a snapshot.
-        cpu_command = "show processes cpu history" 
-        if device.os == 'nxos':
-            cpu_command = "show processes cpu" # NX-OS has a different layout
-        
-        logger.info(f"Executing: {cpu_command} on {device_name}")
-        cpu_output_raw = device.execute(cpu_command)
-        # Simple parsing for illustration - robust parsing needed for production
-        # For Genie: cpu_data = device.parse(cpu_command) then extract from structured data.
-        output_summary.append(f"CPU Info from {device_name}:\\n{cpu_output_raw[:500]}...") # Truncate for summary
-
-        # For Memory:
-        mem_command = "show memory statistics"
-        if device.os == 'nxos':
-            mem_command = "show system resources" # Or "show memory summary"
-        
-        logger.info(f"Executing: {mem_command} on {device_name}")
-        mem_output_raw = device.execute(mem_command)
-        output_summary.append(f"Memory Info from {device_name}:\\n{mem_output_raw[:500]}...") # Truncate
+        logger.info(f"Leasing session to {device_name} for CPU/Memory check...")
+        with get_session_pool().session(device) as conn:
+            cpu_cmd, mem_cmd = cpu_command(device.os), memory_command(device.os)
+            logger.info(f"Executing/Parsing: {cpu_cmd} on {device_name}")
+            cpu_result = parse_cache.parse(device, conn, cpu_cmd, cache=use_cache)
+            logger.info(f"Executing/Parsing: {mem_cmd} on {device_name}")
+            # Junos reports CPU and memory in the same output, so there is nothing more to run
+            mem_result = cpu_result if mem_cmd == cpu_cmd else parse_cache.parse(device, conn, mem_cmd, cache=use_cache)
+
+        data = {}
+        output_summary = []
+        if cpu_result.parsed is not None:
+            data["cpu"] = summarize_cpu(cpu_result.parsed)
+            output_summary.append(format_summary(f"CPU on {device_name}", data["cpu"]))
+        else:
+            output_summary.append(f"CPU Info from {device_name} ('{cpu_cmd}', unparsed):\n{cpu_result.raw}...")
+        if mem_result.parsed is not None:
+            data["memory"] = summarize_memory(mem_result.parsed)
+            output_summary.append(format_summary(f"Memory on {device_name}", data["memory"]))
+        else:
+            output_summary.append(f"Memory Info from {device_name} ('{mem_cmd}', unparsed):\n{mem_result.raw}...")
 
-        return {"status": "success", "output": "\\n".join(output_summary)}
+        return {"status": "success", "output": "\n".join(output_summary), "data": data}
 
     except Exception as e:
         logger.error(f"PyATS Error checking CPU/Memory on {device_name}: {e}", exc_info=True)
-        error_occurred = True
         return {"status": "error", "output": f"Failed to check CPU/Memory on {device_name}: {str(e)}"}
-    finally:
-        if device.is_connected:
-            logger.info(f"Disconnecting from {device_name} after CPU/Memory check.")
-            device.disconnect()
 
 def _pyats_check_interface_errors_utilization(device_name: str, interface_name: str) -> Dict[str, Any]:
     logger.info(f"PyATS Helper: Checking interface errors/utilization for {device_name} interface {interface_name}")
-    if not PYATS_AVAILABLE or not testbed or device_name not in testbed.devices:
+    testbed = get_testbed(device_name) if PYATS_AVAILABLE else None
+    device = testbed.devices.get(device_name) if testbed else None
+    if device is None:
         return {"status": "error", "output": f"PyATS unavailable or device {device_name} not in testbed."}
-
-    device = testbed.devices[device_name]
     try:
-        logger.info(f"Connecting to {device_name} for interface status on {interface_name}...")
-        device.connect(log_stdout=False, learn_hostname=True)
-
-        # Using device.parse() with Genie is highly recommended for structured data
-        # Ensure parsers for 'show interface <interface_name>' are available for your device.os
-        interface_command = f"show interface {interface_name}"
-        logger.info(f"Executing/Parsing: {interface_command} on {device_name}")
-        
-        # Example: parsed_interface_data = device.parse(interface_command)
-        # Then extract specific counters:
-        # if parsed_interface_data:
-        #     oper_status = parsed_interface_data.get('oper_status', 'N/A')
-        #     input_errors = parsed_interface_data.get('counters', {}).get('in_errors', 'N/A')
-        #     output_errors = parsed_interface_data.get('counters', {}).get('out_errors', 'N/A')
-        #     # ... and so on for other relevant fields (CRC, runts, giants, utilization tx/rx)
-        #     summary = (f"Interface: {interface_name} on {device_name}\\n"
-        #                f"  Operational Status: {oper_status}\\n"
-        #                f"  Input Errors: {input_errors}\\n"
-        #                f"  Output Errors: {output_errors}\\n"
-        #                # Add more details as needed
-        #               )
-        #     return {"status": "success", "output": summary, "data": parsed_interface_data}
-        # else:
-        #     return {"status": "error", "output": f"Could not parse interface data for {interface_name} on {device_name}."}
-
-        # Fallback to raw execute if parse is not set up or fails (less ideal)
-        raw_output = device.execute(interface_command)
-        return {"status": "success", "output": f"Raw output for 'show interface {interface_name}' on {device_name}:\\n{raw_output[:1000]}..."} # Truncate
+        logger.info(f"Leasing session to {device_name} for interface status on {interface_name}...")
+        with get_session_pool().session(device) as conn:
+            interface_cmd = interface_command(device.os, interface_name)
+            logger.info(f"Executing/Parsing: {interface_cmd} on {device_name}")
+            result = get_parse_cache().parse(device, conn, interface_cmd)
+
+        if result.parsed is None:
+            # No Genie parser for this OS/command: fall back to (truncated) raw text
+            return {"status": "success", "output": f"Raw output for '{interface_cmd}' on {device_name}:\n{result.raw}..."}
+        summary = summarize_interface(result.parsed, interface_name)
+        if not summary:
+            return {"status": "error", "output": f"Could not parse interface data for {interface_name} on {device_name}."}
+        return {"status": "success", "output": format_summary(f"Interface {interface_name} on {device_name}", summary), "data": summary}
 
     except Exception as e:
         logger.error(f"PyATS Error checking interface {interface_name} on {device_name}: {e}", exc_info=True)
         return {"status": "error", "output": f"Failed to check interface {interface_name} on {device_name}: {str(e)}"}
-    finally:
-        if device.is_connected:
-            logger.info(f"Disconnecting from {device_name} after interface check.")
-            device.disconnect()
+
+def _pyats_collect_interface_counters(device_name: str, use_cache: bool = True) -> Dict[str, Any]:
+    """Status, error counters and rates of every interface on the device, from one show command."""
+    logger.info(f"PyATS Helper: Collecting interface counters for {device_name}")
+    testbed = get_testbed(device_name) if PYATS_AVAILABLE else None
+    device = testbed.devices.get(device_name) if testbed else None
+    if device is None:
+        return {"status": "error", "output": f"PyATS unavailable or device {device_name} not in testbed."}
+    try:
+        with get_session_pool().session(device) as conn:
+            interfaces_cmd = all_interfaces_command(device.os)
+            logger.info(f"Executing/Parsing: {interfaces_cmd} on {device_name}")
+            result = get_parse_cache().parse(device, conn, interfaces_cmd, cache=use_cache)
+
+        if result.parsed is None:
+            return {"status": "error", "output": f"No parser for '{interfaces_cmd}' on {device_name} ({device.os}); raw output:\n{result.raw}..."}
+        interfaces = summarize_interfaces(result.parsed)
+        return {"status": "success", "output": format_summary(f"Interfaces on {device_name}", {"interfaces": interfaces}),
+                "data": {"interfaces": interfaces}}
+
+    except Exception as e:
+        logger.error(f"PyATS Error collecting interface counters on {device_name}: {e}", exc_info=True)
+        return {"status": "error", "output": f"Failed to collect interface counters on {device_name}: {str(e)}"}
 
 def _pyats_ping_test(device_name: str, destination_ip: str) -> Dict[str, Any]:
     logger.info(f"PyATS Helper: Performing ping from {device_name} to {destination_ip}")
-    if not PYATS_AVAILABLE or not testbed or device_name not in testbed.devices:
+    testbed = get_testbed(device_name) if PYATS_AVAILABLE else None
+    device = testbed.devices.get(device_name) if testbed else None
+    if device is None:
         return {"status": "error", "output": f"PyATS unavailable or device {device_name} not in testbed."}
-    
-    device = testbed.devices[device_name]
     try:
-        logger.info(f"Connecting to {device_name} for ping test to {destination_ip}...")
-        device.connect(log_stdout=False, learn_hostname=True)
+        logger.info(f"Leasing session to {device_name} for ping test to {destination_ip}...")
+        with get_session_pool().session(device) as conn:
         
-        # The device.ping() method is quite versatile.
-        # It often returns a string summary, but for some OS/connection types, it can return structured data.
-        # Check PyATS documentation for your specific setup.
-        logger.info(f"Executing ping from {device_name} to {destination_ip}")
-        ping_output = device.ping(destination_ip) # Add parameters like count, timeout if needed
+            # The ping() service is quite versatile.
+            # It often returns a string summary, but for some OS/connection types, it can return structured data.
+            # Check PyATS documentation for your specific setup.
+            logger.info(f"Executing ping from {device_name} to {destination_ip}")
+            ping_output = conn.ping(destination_ip) # Add parameters like count, timeout if needed
         
-        # Process ping_output: If it's a string, it's likely a summary.
-        # If it's a dict, it might contain 'success_rate_percent', 'packets_sent', 'packets_received'.
-        if isinstance(ping_output, str):
-            # Basic check for success in common string outputs
-            if "!!!" in ping_output or "Success rate is 100" in ping_output or " 0% packet loss" in ping_output.lower():
-                status = "success"
-            elif "Success rate is 0" in ping_output or "100% packet loss" in ping_output.lower():
-                status = "error" # Or "warning" if some packets get through
+            # Process ping_output: If it's a string, it's likely a summary.
+            # If it's a dict, it might contain 'success_rate_percent', 'packets_sent', 'packets_received'.
+            if isinstance(ping_output, str):
+                # Basic check for success in common string outputs
+                if "!!!" in ping_output or "Success rate is 100" in ping_output or " 0% packet loss" in ping_output.lower():
+                    status = "success"
+                elif "Success rate is 0" in ping_output or "100% packet loss" in ping_output.lower():
+                    status = "error" # Or "warning" if some packets get through
+                else:
+                    status = "info" #indeterminate from string
+                return {"status": status, "output": f"Ping from {device_name} to {destination_ip}:\\n{ping_output}"}
+            elif isinstance(ping_output, dict): # Ideal case if structured data is returned
+                success_rate = ping_output.get('statistics', {}).get('success_rate_percent', 'N/A')
+                return {"status": "success" if success_rate == 100.0 else "error", 
+                        "output": f"Ping from {device_name} to {destination_ip}: Success Rate {success_rate}%", 
+                        "data": ping_output}
             else:
-                status = "info" #indeterminate from string
-            return {"status": status, "output": f"Ping from {device_name} to {destination_ip}:\\n{ping_output}"}
-        elif isinstance(ping_output, dict): # Ideal case if structured data is returned
-            success_rate = ping_output.get('statistics', {}).get('success_rate_percent', 'N/A')
-            return {"status": "success" if success_rate == 100.0 else "error", 
-                    "output": f"Ping from {device_name} to {destination_ip}: Success Rate {success_rate}%", 
-                    "data": ping_output}
-        else:
-            return {"status": "info", "output": f"Ping from {device_name} to {destination_ip} executed. Output type: {type(ping_output)}, Raw: {str(ping_output)[:500]}"}
+                return {"status": "info", "output": f"Ping from {device_name} to {destination_ip} executed. Output type: {type(ping_output)}, Raw: {str(ping_output)[:500]}"}
 
     except Exception as e:
         logger.error(f"PyATS Error during ping from {device_name} to {destination_ip}: {e}", exc_info=True)
         return {"status": "error", "output": f"Failed to perform ping from {device_name} to {destination_ip}: {str(e)}"}
-    finally:
-        if device.is_connected:
-            logger.info(f"Disconnecting from {device_name} after ping test.")
-            device.disconnect()
 
 def _pyats_traceroute_test(device_name: str, destination_ip: str) -> Dict[str, Any]:
     logger.info(f"PyATS Helper: Performing traceroute from {device_name} to {destination_ip}")
+    testbed = get_testbed(device_name) if PYATS_AVAILABLE else None
     if not PYATS_AVAILABLE or not testbed or device_name not in testbed.devices:
         return {"status": "error", "output": f"PyATS unavailable or device {device_name} not in testbed."}
     # Example: result = device.traceroute(destination_ip)
     return {"status": "success", "output": f"Simulated traceroute from {device_name} to {destination_ip}: Path: {device_name} -> hop1 -> hop2 -> {destination_ip}."}
 
-def _pyats_get_device_logs(device_name: str, log_filter: str = None, max_lines: int = 100) -> Dict[str, Any]:
-    logger.info(f"PyATS Helper: Getting logs for {device_name}. Filter: '{log_filter}', Max lines: {max_lines}")
-    if not PYATS_AVAILABLE or not testbed or device_name not in testbed.devices:
+def _pyats_get_device_logs(device_name: str, log_filter: str = None, max_lines: int = 100, since_last: bool = False) -> Dict[str, Any]:
+    logger.info(f"PyATS Helper: Getting logs for {device_name}. Filter: '{log_filter}', Max lines: {max_lines}, Since last: {since_last}")
+    testbed = get_testbed(device_name) if PYATS_AVAILABLE else None
+    device = testbed.devices.get(device_name) if testbed else None
+    if device is None:
         return {"status": "error", "output": f"PyATS unavailable or device {device_name} not in testbed."}
-    
-    device = testbed.devices[device_name]
+    device_os = getattr(device, 'os', None)
+    cursor = log_cursors.get(device_name, log_filter) if since_last else None
     try:
-        logger.info(f"Connecting to {device_name} to get logs...")
-        device.connect(log_stdout=False, learn_hostname=True)
-        
-        log_command = "show logging" # Default
-        # OS-specific command adjustments
-        if hasattr(device, 'os'):
-            if device.os == 'nxos':
-                log_command = "show logging logfile" 
-            elif device.os == 'junos':
-                log_command = "show log messages"
-            # Add other OS types as needed: elif device.os == 'asa': log_command = "show logging"
-        
-        # Applying filter and line limits. This is highly OS and command dependent.
-        # For simplicity, we'll fetch logs and then filter/truncate in Python if needed,
-        # though server-side filtering via CLI is more efficient.
-        # Example: if log_filter: log_command += f" | include {log_filter}" (IOS specific)
-        
-        logger.info(f"Executing: {log_command} on {device_name}")
-        raw_logs = device.execute(log_command)
+        logger.info(f"Leasing session to {device_name} to get logs...")
+        with get_session_pool().session(device) as conn:
+            # The filter (and the tail cursor, where the CLI supports it) is applied on the device,
+            # so only matching lines cross the SSH session ('| include', '| match', '| grep').
+            log_command, filter_pushed_down = build_log_command(device_os, log_filter, cursor)
+            logger.info(f"Executing: {log_command} on {device_name}")
+            raw_logs = conn.execute(log_command)
+            if (cursor is not None and device_os not in TIME_BOUNDED_CURSOR_OSES
+                    and log_command != build_log_command(device_os, log_filter)[0] and not raw_logs.strip()):
+                # The cursor's line has rotated out of the buffer, so the device-side start point matched nothing.
+                log_command = build_log_command(device_os, log_filter)[0]
+                logger.info(f"Log cursor for {device_name} is no longer in the buffer; executing: {log_command}")
+                raw_logs = conn.execute(log_command)
         
-        log_lines = raw_logs.splitlines()
+        # Single streaming pass: the compiled pattern double-checks device-side filtering (and covers regex filters
+        # that are not pushed down), the cursor drops already-returned lines and only the last max_lines are kept.
+        final_log_lines, last_line = filter_log_output(raw_logs, compile_log_filter(log_filter), max_lines, cursor)
+        if last_line is not None:
+            log_cursors.advance(device_name, log_filter, last_line, device_os)
+        logger.debug(f"Log fetch from {device_name}: {len(raw_logs)} chars transferred (filter on device: {filter_pushed_down}).")
         
-        if log_filter:
-            log_lines = [line for line in log_lines if re.search(log_filter, line, re.IGNORECASE)]
-            
-        # Get the last N lines
-        if len(log_lines) > max_lines:
-            final_log_lines = log_lines[-max_lines:]
-        else:
-            final_log_lines = log_lines
-            
         output_str = "\\n".join(final_log_lines)
-        if not output_str and log_filter:
+        if not output_str and cursor is not None:
+            output_str = f"No new log entries on {device_name}{f' matching filter {log_filter!r}' if log_filter else ''} since the last check."
+        elif not output_str and log_filter:
              output_str = f"No log entries found on {device_name} matching filter '{log_filter}' (checked last {max_lines} of available logs if unfiltered)."
         elif not output_str:
             output_str = f"No log entries found or returned from {device_name}."
@@ -391,10 +241,9 @@ def _pyats_get_device_logs(device_name: str, log_filter: str = None, max_lines:
     except Exception as e:
         logger.error(f"PyATS Error getting logs from {device_name}: {e}", exc_info=True)
         return {"status": "error", "output": f"Failed to get logs from {device_name}: {str(e)}"}
-    finally:
-        if device.is_connected:
-            logger.info(f"Disconnecting from {device_name} after getting logs.")
-            device.disconnect()
+
+# Upper bound on config sections quoted back for the suggested keywords (a vague keyword can match every interface)
+MAX_CONFIG_SNIPPET_SECTIONS = 20
 
 @tool
 def _pyats_inspect_config_and_dynamic_show(device_name: str, problem_context: str) -> Dict[str, Any]:
@@ -411,10 +260,10 @@ def _pyats_inspect_config_and_dynamic_show(device_name: str, problem_context: st
         and outputs from dynamically selected show commands.
     """
     logger.info(f"PyATS Helper: Inspecting config and dynamic shows for {device_name}. Context: '{problem_context}'")
-    if not PYATS_AVAILABLE or not testbed or device_name not in testbed.devices:
+    testbed = get_testbed(device_name) if PYATS_AVAILABLE else None
+    device = testbed.devices.get(device_name) if testbed else None
+    if device is None:
         return {"status": "error", "output": f"PyATS unavailable or device {device_name} not in testbed."}
-
-    device = testbed.devices[device_name]
     device_os = getattr(device, 'os', 'unknown')
     device_type = getattr(device, 'type', 'unknown') # e.g., router, switch
     
@@ -424,29 +273,23 @@ def _pyats_inspect_config_and_dynamic_show(device_name: str, problem_context: st
     final_summary_parts = []
 
     try:
-        logger.info(f"Connecting to {device_name} for config inspection...")
-        device.connect(log_stdout=False, learn_hostname=True)
-
-        # 1. Get full running configuration
-        run_config_command = "show running-config"
-        if device_os == 'junos':
-            run_config_command = "show configuration"
-        # Add other OS variants if needed
-        
-        logger.info(f"Executing: {run_config_command} on {device_name}")
-        full_running_config = device.execute(run_config_command)
-        final_summary_parts.append(f"Retrieved running configuration for {device_name} (length: {len(full_running_config)} chars).")
+        # 1. Get full running configuration ('show running-config', or 'show configuration' on Junos).
+        # The cache runs a cheap change probe first (IOS and NX-OS: max age only) and only pulls the full config when it changed.
+        # The session is only leased around device commands, not while the sub-LLM is thinking.
+        with get_session_pool().session(device) as conn:
+            full_running_config, config_hash, config_from_cache = get_running_config_cache().get_running_config(device, conn)
+        final_summary_parts.append(
+            f"Retrieved running configuration for {device_name} (length: {len(full_running_config)} chars"
+            f"{', unchanged since last fetch' if config_from_cache else ''})."
+        )
 
         # 2. Use LLM to suggest relevant config sections and dynamic show commands
         if not current_app.config.get('OPENAI_API_KEY'):
             logger.error("OPENAI_API_KEY not configured for sub-LLM in _pyats_inspect_config_and_dynamic_show")
             final_summary_parts.append("Skipping LLM-based dynamic show command selection: OpenAI API key not configured.")
         else:
-            sub_llm = ChatOpenAI(
-                model="gpt-3.5-turbo", 
-                openai_api_key=current_app.config['OPENAI_API_KEY'],
-                temperature=0
-            )
+            sub_llm = get_llm(ROLE_INSPECTOR)
+            sub_llm_model = get_llm_model_name(ROLE_INSPECTOR)
             
             # Limit the length of running config passed to the LLM if it's very large
             # to avoid exceeding token limits for the sub-LLM prompt.
@@ -488,7 +331,8 @@ def _pyats_inspect_config_and_dynamic_show(device_name: str, problem_context: st
             """
             try:
                 logger.info("Invoking sub-LLM for diagnostic command/keyword suggestions...")
-                llm_response_content = sub_llm.invoke(prompt_for_sub_llm).content
+                # Identical context + config (e.g. several engineers chasing one outage) is served from the response cache
+                llm_response_content = cached_completion(sub_llm, sub_llm_model, prompt_for_sub_llm)
                 logger.debug(f"Sub-LLM response: {llm_response_content}")
                 
                 # Clean up potential markdown and ensure it's valid JSON
@@ -503,34 +347,18 @@ def _pyats_inspect_config_and_dynamic_show(device_name: str, problem_context: st
 
                 # 3. Extract relevant config snippets using keywords
                 if config_keywords and full_running_config:
+                    # The parsed tree (cached per config hash) maps each keyword to its enclosing sections via a token index
+                    config_tree = get_config_tree(full_running_config, config_hash)
+                    matched_sections = config_tree.sections_for_keywords(config_keywords)
                     temp_snippets = []
-                    # Search for whole sections related to keywords for better context
-                    for keyword in config_keywords:
-                        section_found = False
-                        current_section = []
-                        in_section = False
-                        for line in full_running_config.splitlines():
-                            if keyword.lower() in line.lower() and not line.strip().startswith('!'): # Start of a potential section
-                                if current_section: # new keyword found, save previous section if any
-                                    temp_snippets.extend(current_section)
-                                    temp_snippets.append("----------")
-                                    current_section = []
-                                current_section.append(line)
-                                in_section = True
-                                section_found = True
-                            elif in_section and (line.startswith(' ') or line.strip() == keyword.strip()): # part of current section
-                                current_section.append(line)
-                            elif in_section and not line.startswith(' '): # end of section
-                                temp_snippets.extend(current_section)
-                                temp_snippets.append("----------")
-                                current_section = []
-                                in_section = False
-                        if current_section: # Append any last section
-                             temp_snippets.extend(current_section)
-                             temp_snippets.append("----------")
+                    for section in matched_sections[:MAX_CONFIG_SNIPPET_SECTIONS]:
+                        if temp_snippets:
+                            temp_snippets.append("----------")
+                        temp_snippets.extend(section.render())
+                    if len(matched_sections) > MAX_CONFIG_SNIPPET_SECTIONS:
+                        temp_snippets.append(f"... ({len(matched_sections) - MAX_CONFIG_SNIPPET_SECTIONS} more matching sections omitted)")
                     
                     if temp_snippets:
-                        if temp_snippets[-1] == "----------": temp_snippets.pop() # Remove trailing separator
                         relevant_config_snippets_text = "Relevant configuration snippets based on keywords (" + ', '.join(config_keywords) + "):\n" + "\n".join(temp_snippets)
                         final_summary_parts.append(relevant_config_snippets_text)
                     else:
@@ -541,24 +369,26 @@ def _pyats_inspect_config_and_dynamic_show(device_name: str, problem_context: st
                 # 4. Execute dynamic show commands
                 if diagnostic_show_commands:
                     final_summary_parts.append("Executing LLM-suggested diagnostic show commands:")
-                    for cmd in diagnostic_show_commands:
-                        # Security check: ensure it's a 'show' command (basic check)
-                        if cmd.strip().lower().startswith("show "):
-                            logger.info(f"Executing dynamic command: {cmd} on {device_name}")
-                            try:
-                                output = device.execute(cmd)
-                                dynamic_show_outputs[cmd] = output
-                                final_summary_parts.append(f"Output of '{cmd}':\n{output[:1000]}...") # Truncate
-                            except Exception as e_cmd:
-                                logger.error(f"Error executing dynamic command '{cmd}' on {device_name}: {e_cmd}")
-                                final_summary_parts.append(f"Error executing '{cmd}': {str(e_cmd)}")
-                        else:
-                            logger.warning(f"Sub-LLM suggested a non-show command: '{cmd}'. Skipping.")
-                            final_summary_parts.append(f"Skipped non-show command: '{cmd}'")
+                    with get_session_pool().session(device) as conn:
+                        for cmd in diagnostic_show_commands:
+                            # Security check: ensure it's a 'show' command (basic check)
+                            if cmd.strip().lower().startswith("show "):
+                                logger.info(f"Executing dynamic command: {cmd} on {device_name}")
+                                try:
+                                    output = conn.execute(cmd)
+                                    dynamic_show_outputs[cmd] = output
+                                    final_summary_parts.append(f"Output of '{cmd}':\n{output[:1000]}...") # Truncate
+                                except Exception as e_cmd:
+                                    logger.error(f"Error executing dynamic command '{cmd}' on {device_name}: {e_cmd}")
+                                    final_summary_parts.append(f"Error executing '{cmd}': {str(e_cmd)}")
+                            else:
+                                logger.warning(f"Sub-LLM suggested a non-show command: '{cmd}'. Skipping.")
+                                final_summary_parts.append(f"Skipped non-show command: '{cmd}'")
                 else:
                     final_summary_parts.append("No specific additional diagnostic show commands suggested by LLM.")
 
             except json.JSONDecodeError as e_json:
+                discard_completion(sub_llm_model, prompt_for_sub_llm)
                 logger.error(f"Sub-LLM output was not valid JSON: {e_json}. Raw: {llm_response_content}")
                 final_summary_parts.append(f"Error processing suggestions from diagnostic AI: Invalid JSON. ({llm_response_content[:200]}...)")
             except Exception as e_sub_llm:
@@ -570,10 +400,6 @@ def _pyats_inspect_config_and_dynamic_show(device_name: str, problem_context: st
     except Exception as e:
         logger.error(f"PyATS Error during config inspection on {device_name}: {e}", exc_info=True)
         return {"status": "error", "output": f"Failed to inspect config on {device_name}: {str(e)}"}
-    finally:
-        if device.is_connected:
-            logger.info(f"Disconnecting from {device_name} after config inspection.")
-            device.disconnect()
 
 # --- Map of PyATS Diagnostic Capabilities ---
 PYATS_CAPABILITIES_MAP: Dict[str, Dict[str, Any]] = {
@@ -612,7 +438,8 @@ PYATS_CAPABILITIES_MAP: Dict[str, Dict[str, Any]] = {
         "params": [
             {"name": "device_name", "type": "string", "description": "The hostname of the device from which to retrieve logs."},
             {"name": "log_filter", "type": "string", "optional": True, "description": "Keywords to filter logs by (e.g., an interface name, IP address, or error message)."},
-            {"name": "max_lines", "type": "integer", "optional": True, "default": 100, "description": "Maximum number of recent log lines to retrieve."}
+            {"name": "max_lines", "type": "integer", "optional": True, "default": 100, "description": "Maximum number of recent log lines to retrieve."},
+            {"name": "since_last", "type": "boolean", "optional": True, "default": False, "description": "Only return entries logged since the previous log check on this device (with the same filter)."}
         ]
     },
     "inspect_config_and_run_dynamic_diagnostics": { # New Capability
@@ -637,17 +464,16 @@ def diagnose_network_issue_with_pyats(problem_description: str, target_devices:
     """
     logger.info(f"Tool: diagnose_network_issue_with_pyats called. Problem: '{problem_description}', Devices: {target_devices}")
 
+    testbed = get_testbed() if PYATS_AVAILABLE else None
     if not PYATS_AVAILABLE or not testbed:
         return "PyATS is not available or the testbed is not loaded. Cannot perform diagnostics."
 
     if not current_app.config.get('OPENAI_API_KEY'):
          return "Error: OPENAI_API_KEY is not configured for the diagnostic tool's LLM."
 
-    diag_llm = ChatOpenAI(
-        model="gpt-3.5-turbo", # Cheaper/faster model for internal decision making
-        openai_api_key=current_app.config['OPENAI_API_KEY'],
-        temperature=0
-    )
+    # Cheaper/faster model for internal decision making (see LLM_PLANNER_MODEL)
+    diag_llm = get_llm(ROLE_PLANNER)
+    diag_llm_model = get_llm_model_name(ROLE_PLANNER)
 
     capabilities_description = "\n".join([
         f"- {name}: {info['description']} Parameters: {json.dumps(info['params'])}"
@@ -683,14 +509,11 @@ If no suitable commands can be determined, return an empty array [].
 """
 
     results_summary = []
+    content_str = None
     try:
-        llm_response = diag_llm.invoke(prompt)
-        logger.debug(f"LLM response for command selection: {llm_response.content}")
-        
-        # Ensure content is a string before attempting to load JSON
-        content_str = llm_response.content
-        if not isinstance(content_str, str):
-            content_str = str(content_str) # Convert if it's some other message object attribute
+        # Served from the response cache when the same problem/capabilities prompt was planned recently
+        content_str = cached_completion(diag_llm, diag_llm_model, prompt)
+        logger.debug(f"LLM response for command selection: {content_str}")
         
         # Strip potential markdown code block delimiters
         if content_str.startswith("```json"): content_str = content_str[7:]
@@ -708,13 +531,15 @@ If no suitable commands can be determined, return an empty array [].
         if not selected_commands:
              results_summary.append("- No specific actions determined by AI. Further information might be needed.")
 
+        # Validate the plan first; each entry is either a finished summary line or a step for the executor.
+        plan_entries = []
+        plan_steps = []
         for cmd_obj in selected_commands:
             command_id = cmd_obj.get("command_id")
             params = cmd_obj.get("parameters", {})
 
             if command_id in PYATS_CAPABILITIES_MAP:
                 capability = PYATS_CAPABILITIES_MAP[command_id]
-                func_to_call: Callable = capability["function"]
                 
                 # Validate device_name if present in params and testbed
                 device_name_param = None
@@ -725,22 +550,39 @@ If no suitable commands can be determined, return an empty array [].
                 
                 if device_name_param and device_name_param not in testbed.devices:
                     logger.warning(f"LLM selected command '{command_id}' for device '{device_name_param}' which is not in the testbed. Skipping.")
-                    results_summary.append(f"- Skipped: {command_id} on {device_name_param} (Device not in testbed). Action: {capability['description']}")
+                    plan_entries.append(f"- Skipped: {command_id} on {device_name_param} (Device not in testbed). Action: {capability['description']}")
                     continue
 
-                logger.info(f"Executing diagnostic capability: {command_id} with params: {params}")
-                try:
-                    result = func_to_call(**params)
-                    results_summary.append(f"- Action: {capability['description']} (Params: {params}). Result: {result.get('output', 'No output')}")
-                except Exception as e:
-                    logger.error(f"Error executing capability {command_id}: {e}", exc_info=True)
-                    results_summary.append(f"- Action: {capability['description']} (Params: {params}). Error: {str(e)}")
+                plan_entries.append(len(plan_steps))
+                plan_steps.append((command_id, params))
             else:
                 logger.warning(f"LLM selected unknown command_id: {command_id}")
-                results_summary.append(f"- Unknown action selected by AI: {command_id}")
+                plan_entries.append(f"- Unknown action selected by AI: {command_id}")
+
+        # Steps on different devices run concurrently; results come back in plan order.
+        executor = DiagnosticPlanExecutor(
+            PYATS_CAPABILITIES_MAP,
+            max_workers=current_app.config.get('PYATS_PLAN_MAX_WORKERS', 4),
+            step_timeout=current_app.config.get('PYATS_PLAN_STEP_TIMEOUT_SECONDS', 120)
+        )
+        step_results = executor.run(plan_steps)
+
+        for entry in plan_entries:
+            if isinstance(entry, str):
+                results_summary.append(entry)
+                continue
+            step_result = step_results[entry]
+            description = PYATS_CAPABILITIES_MAP[step_result["command_id"]]["description"]
+            if step_result["status"] == "success":
+                result = step_result["result"]
+                output = result.get('output', 'No output') if isinstance(result, dict) else result
+                results_summary.append(f"- Action: {description} (Params: {step_result['params']}). Result: {output}")
+            else:
+                results_summary.append(f"- Action: {description} (Params: {step_result['params']}). Error: {step_result['error']}")
 
     except json.JSONDecodeError as e:
-        logger.error(f"Failed to parse LLM JSON response for diagnostic commands: {e}. Response was: {llm_response.content if 'llm_response' in locals() else 'N/A'}")
+        discard_completion(diag_llm_model, prompt)
+        logger.error(f"Failed to parse LLM JSON response for diagnostic commands: {e}. Response was: {content_str if content_str is not None else 'N/A'}")
         return f"Error: AI response for command selection was not valid JSON. Details: {e}"
     except Exception as e:
         logger.error(f"Error in diagnose_network_issue_with_pyats: {e}", exc_info=True)
@@ -758,10 +600,10 @@ def get_device_connectivity(device_name: str, destination_ip: str) -> str:
     This would typically use a PyATS library or execute a ping command on the device.
     """
     logger.info(f"Tool: get_device_connectivity called for {device_name} to {destination_ip}")
-    if not PYATS_AVAILABLE or not testbed or device_name not in testbed.devices:
+    testbed = get_testbed(device_name) if PYATS_AVAILABLE else None
+    device = testbed.devices.get(device_name) if testbed else None
+    if device is None:
         return f"PyATS unavailable, testbed not loaded, or device {device_name} not found in testbed."
-    
-    device = testbed.devices[device_name]
     try:
         # device.connect(log_stdout=False) 
         # result = device.ping(destination_ip) # This is a direct PyATS device method
@@ -783,10 +625,10 @@ def get_device_interface_status(device_name: str, interface_name: str) -> str:
     Example: 'What is the status of GigabitEthernet0/1 on switch2?'
     """
     logger.info(f"Tool: get_device_interface_status called for {device_name}, interface {interface_name}")
-    if not PYATS_AVAILABLE or not testbed or device_name not in testbed.devices:
+    testbed = get_testbed(device_name) if PYATS_AVAILABLE else None
+    device = testbed.devices.get(device_name) if testbed else None
+    if device is None:
         return f"PyATS unavailable, testbed not loaded, or device {device_name} not found in testbed."
-
-    device = testbed.devices[device_name]
     try:
         # device.connect(log_stdout=False)
         # Using Genie Ops for structured data is preferred if available and learned.
@@ -901,6 +743,174 @@ def where_is_device_plugged_in(target_device_mac_or_ip: str) -> str:
     # 2. Then, use that MAC address to search the MAC table source for the switch/port.
     # The current implementation performs a direct search based on IP against 'ip_field_in_es'.
 
+@tool
+def search_device_logs(query: str = None, device_names: List[str] = None, max_severity: int = None,
+                       since_minutes: int = 60, max_results: int = 50) -> str:
+    """
+    Searches syslog messages collected centrally from network devices, without logging into any device.
+    Prefer this over device log commands for questions about recent or past log events (it also covers history
+    older than the device's log buffer).
+    Args:
+        query: Words to look for in the message, e.g. 'GigabitEthernet0/1 down', 'BGP neighbor' or a mnemonic like 'LINK-3-UPDOWN'.
+        device_names: Hostnames or IP addresses of the devices to search; all devices if omitted.
+        max_severity: Only messages at least this severe (0=emergency, 1=alert, 2=critical, 3=error, 4=warning, 5=notice, 6=info, 7=debug).
+        since_minutes: How far back to search (default 60 minutes).
+        max_results: Maximum number of messages to return, newest first (default 50).
+    """
+    logger.info(f"Tool: search_device_logs called. Query: '{query}', Devices: {device_names}, Max severity: {max_severity}, Since: {since_minutes}m")
+    prefix = current_app.config.get('SYSLOG_INDEX_PREFIX', 'syslog')
+    try:
+        result = search_syslog(get_es_client(), prefix, query=query, hosts=device_names, max_severity=max_severity,
+                               since_minutes=since_minutes, size=min(max_results, 500))
+    except es_exceptions.ConnectionError:
+        return "Could not connect to Elasticsearch. Please check the connection."
+    except Exception as e:
+        logger.error(f"Error searching syslog index: {e}", exc_info=True)
+        return f"An error occurred while searching device logs: {str(e)}"
+
+    if not result["hits"]:
+        return f"No syslog messages found in the last {since_minutes} minutes matching the given criteria."
+    lines = [
+        f"{doc.get('@timestamp')} {doc.get('host')} [{doc.get('severity_label', SEVERITY_LABELS[doc.get('severity', 6)])}] {doc.get('message', '')}".rstrip()
+        for doc in result["hits"]
+    ]
+    header = f"Found {result['total']} matching syslog message(s) in the last {since_minutes} minutes"
+    if result["total"] > len(lines):
+        header += f"; showing the newest {len(lines)}"
+    return header + ":\n" + "\n".join(lines)
+
+@tool
+def get_device_health(device_names: List[str], include_interfaces: bool = False, max_age_minutes: int = 60) -> str:
+    """
+    Latest CPU, memory (and optionally per-interface) health of devices from the background health sweep, without
+    logging into them. Answers questions like "is router X overloaded?" in milliseconds; use the live PyATS checks
+    only when the sample is too old or the question needs data the sweep does not collect.
+    Args:
+        device_names: Names of the devices to look up.
+        include_interfaces: Also return status, rates, utilization and error counters of each interface from the same sample.
+        max_age_minutes: Ignore samples older than this (default 60 minutes).
+    """
+    logger.info(f"Tool: get_device_health called. Devices: {device_names}, Interfaces: {include_interfaces}, Max age: {max_age_minutes}m")
+    if not device_names:
+        return "Please provide at least one device name."
+    prefix = current_app.config.get('HEALTH_METRICS_INDEX_PREFIX', 'device-health')
+    try:
+        latest = latest_device_health(get_es_client(), prefix, device_names, max_age_minutes=max_age_minutes,
+                                      include_interfaces=include_interfaces)
+    except es_exceptions.ConnectionError:
+        return "Could not connect to Elasticsearch. Please check the connection."
+    except Exception as e:
+        logger.error(f"Error reading device health samples: {e}", exc_info=True)
+        return f"An error occurred while reading device health: {str(e)}"
+
+    lines = []
+    for name in device_names:
+        doc = latest.get(name)
+        if doc is None:
+            lines.append(f"{name}: no health sample in the last {max_age_minutes} minutes (not in the testbed, or the sweep is disabled or behind).")
+            continue
+        lines.append(format_summary(name, {k: v for k, v in doc.items() if k not in ("device", "kind", "sweep_id", "tenant_id", "interfaces")}))
+        for intf in doc.get("interfaces", []):
+            # Timestamp, site, OS and status are the device's; only the interface's own values are repeated
+            lines.append("  " + format_summary(intf["interface"], {k: v for k, v in intf.items() if k not in doc and k != "interface"}))
+    return "Latest health samples (error counters are cumulative since the last clear):\n" + "\n".join(lines)
+
+@tool
+def find_busiest_devices(metric: str = "cpu_pct", site_id: str = None, since_minutes: int = 15, top_n: int = 10) -> str:
+    """
+    Ranks devices by a health metric from the background health sweep, e.g. the most CPU-loaded routers or the
+    most utilized links fleet-wide or at one site, without logging into any device.
+    Args:
+        metric: One of 'cpu_pct', 'memory_used_pct' (per device) or 'in_util_pct', 'out_util_pct', 'in_bps', 'out_bps' (busiest interface per device).
+        site_id: Only devices of this site; all sites if omitted.
+        since_minutes: Samples from this many minutes back are considered (default 15); each device is ranked by its worst sample.
+        top_n: Number of devices to return (default 10).
+    """
+    logger.info(f"Tool: find_busiest_devices called. Metric: {metric}, Site: {site_id}, Since: {since_minutes}m, Top: {top_n}")
+    if metric not in DEVICE_METRICS + INTERFACE_METRICS:
+        return f"Unknown metric '{metric}'. Use one of: {', '.join(DEVICE_METRICS + INTERFACE_METRICS)}."
+    prefix = current_app.config.get('HEALTH_METRICS_INDEX_PREFIX', 'device-health')
+    try:
+        samples = top_device_health(get_es_client(), prefix, metric, site_id=site_id, since_minutes=since_minutes,
+                                    size=min(top_n, 100))
+    except es_exceptions.ConnectionError:
+        return "Could not connect to Elasticsearch. Please check the connection."
+    except Exception as e:
+        logger.error(f"Error ranking device health samples: {e}", exc_info=True)
+        return f"An error occurred while ranking devices: {str(e)}"
+
+    if not samples:
+        return f"No health samples with '{metric}' in the last {since_minutes} minutes{f' for site {site_id}' if site_id else ''}."
+    lines = [
+        f"{i}. {doc['device']}{' ' + doc['interface'] if doc.get('interface') else ''}: {metric}={doc[metric]}"
+        f" (site {doc.get('site_id', 'unknown')}, at {doc['@timestamp']})"
+        for i, doc in enumerate(samples, 1)
+    ]
+    return f"Devices by {metric}, highest first, over the last {since_minutes} minutes:\n" + "\n".join(lines)
+
+@tool
+def find_metric_anomalies(site_id: str = None, device_names: List[str] = None, metrics: List[str] = None,
+                          since_minutes: int = 60, source: str = "health", method: str = "zscore", max_results: int = 20) -> str:
+    """
+    Finds devices and interfaces whose CPU, memory, utilization, traffic or error/discard rates over the recent window
+    deviate strongly from their own baseline, across the whole fleet or one site at once, without logging into any
+    device. Use for questions like "what's anomalous on site X in the last hour?".
+    Args:
+        site_id: Only devices of this site; the whole fleet if omitted.
+        device_names: Only these devices.
+        metrics: Metrics to check; all of the source's by default. Health sweep: cpu_pct, memory_used_pct, in_util_pct,
+                 out_util_pct, in_errors, in_crc_errors, in_discards, out_errors, out_discards. SNMP: cpu_pct, in_bps,
+                 out_bps, in_errors, out_errors, in_discards, out_discards. Error/discard counters are checked as rates.
+        since_minutes: The recent window to check (default 60 minutes).
+        source: 'health' (samples from the background health sweep) or 'snmp' (the otel_snmp_data_index).
+        method: 'zscore' (mean/std of the preceding baseline window) or 'ewma' (exponentially weighted baseline).
+        max_results: Maximum number of anomalies to return, most extreme first (default 20).
+    """
+    logger.info(f"Tool: find_metric_anomalies called. Site: {site_id}, Devices: {device_names}, Metrics: {metrics}, "
+                f"Since: {since_minutes}m, Source: {source}, Method: {method}")
+    if source not in ("health", "snmp"):
+        return f"Unknown source '{source}'. Use 'health' or 'snmp'."
+    if method not in METHODS:
+        return f"Unknown method '{method}'. Use one of: {', '.join(METHODS)}."
+    config = current_app.config
+    es_client = get_es_client()
+    try:
+        if source == "snmp":
+            series_source = SNMP_SOURCE
+            if site_id:
+                # SNMP documents carry no site; look the site's devices up in the device index instead
+                site_devices = device_names_at_site(es_client, config['ELASTICSEARCH_DEVICES_INDEX'], site_id)
+                device_names = [d for d in site_devices if d in device_names] if device_names else site_devices
+                if not device_names:
+                    return f"No devices found for site {site_id}."
+        else:
+            series_source = health_metrics_source(config.get('HEALTH_METRICS_INDEX_PREFIX', 'device-health'),
+                                                  bucket_seconds=config.get('HEALTH_SWEEP_INTERVAL_SECONDS', 300))
+        result = find_anomalies(es_client, series_source, metrics=metrics, since_minutes=since_minutes,
+                                baseline_minutes=config.get('ANOMALY_BASELINE_MINUTES', 180), method=method,
+                                threshold=config.get('ANOMALY_Z_THRESHOLD', 3.0), site_id=site_id,
+                                device_names=device_names, limit=min(max_results, 200))
+    except ValueError as e:
+        return str(e)
+    except es_exceptions.ConnectionError:
+        return "Could not connect to Elasticsearch. Please check the connection."
+    except Exception as e:
+        logger.error(f"Error running anomaly detection: {e}", exc_info=True)
+        return f"An error occurred while looking for anomalies: {str(e)}"
+
+    scope = f"site {site_id}" if site_id else "the fleet"
+    if not result["series"]:
+        return f"No {source} metrics found for {scope} in the analysis window."
+    if not result["anomalies"]:
+        return f"No anomalies in the last {since_minutes} minutes across {result['series']} series for {scope}."
+    lines = []
+    for a in result["anomalies"]:
+        target = f"{a['device']} {a['interface']}" if a["interface"] else a["device"]
+        site = f" [site {a['site']}]" if a["site"] and not site_id else ""
+        lines.append(f"{target}{site}: {a['metric']}={a['value']} vs baseline {a['baseline']} +/- {a['baseline_std']} (z={a['z']}) at {a['at']}")
+    return (f"{len(result['anomalies'])} anomal{'y' if len(result['anomalies']) == 1 else 'ies'} in the last {since_minutes} minutes "
+            f"across {result['series']} series for {scope} (rates are per second):\n" + "\n".join(lines))
+
 # --- Other Tools ---
 
 @tool
@@ -954,18 +964,18 @@ def generate_configuration_fix(problem_description: str, diagnosis_summary: str,
         # Return JSON error structure
         return json.dumps({"error": "OPENAI_API_KEY is not configured for the configuration generation LLM.", "suggested_actions": []})
 
-    config_llm = ChatOpenAI(
-        model="gpt-4-turbo-preview", 
-        openai_api_key=current_app.config['OPENAI_API_KEY'],
-        temperature=0.1 
-    )
+    config_llm = get_llm(ROLE_CONFIG_GENERATOR)
 
     resolved_device_os_map = device_os_map or {}
+    testbed = get_testbed() if PYATS_AVAILABLE else None
     if PYATS_AVAILABLE and testbed:
         for device_name in target_devices:
-            if device_name not in resolved_device_os_map and device_name in testbed.devices:
-                resolved_device_os_map[device_name] = testbed.devices[device_name].os
-            elif device_name not in resolved_device_os_map:
+            if device_name in resolved_device_os_map:
+                continue
+            device = testbed.devices.get(device_name)
+            if device is not None:
+                resolved_device_os_map[device_name] = device.os
+            else:
                 logger.warning(f"OS type for device {device_name} not provided and not found in testbed. Config generation may be generic or fail.")
                 resolved_device_os_map[device_name] = "unknown"
     
@@ -1060,47 +1070,49 @@ def apply_configuration_fix(device_name: str, configuration_commands: List[str],
         logger.warning(f"apply_configuration_fix called for {device_name} but confirm_apply is False. No configuration will be applied.")
         return f"CONFIRMATION REQUIRED: Configuration for {device_name} was NOT applied because confirm_apply was False. Commands that would have been applied: \\n" + "\\n".join(configuration_commands)
 
+    testbed = get_testbed(device_name) if PYATS_AVAILABLE else None
     if not PYATS_AVAILABLE or not testbed:
         return "Error: PyATS is not available or the testbed is not loaded. Cannot apply configuration."
     
-    if device_name not in testbed.devices:
+    device = testbed.devices.get(device_name)
+    if device is None:
         return f"Error: Device '{device_name}' not found in the PyATS testbed."
 
     if not configuration_commands:
         return f"Error: No configuration commands provided for device '{device_name}'."
 
-    device = testbed.devices[device_name]
     try:
-        logger.info(f"Attempting to connect to device: {device_name} for configuration application.")
-        device.connect(log_stdout=False, learn_hostname=True) 
+        logger.info(f"Leasing session to {device_name} for configuration application.")
+        with get_session_pool().session(device) as conn:
         
-        logger.info(f"Applying configuration to {device_name}:\\n" + "\\n".join(configuration_commands))
-        # PyATS device.configure() takes a list of commands or a multi-line string.
-        # The result of device.configure() can vary. For some OS, it's the diff or full output. 
-        # For others, it might be None or raise an exception on failure.
-        # Robust error handling here should check for specific PyATS exceptions if known.
-        config_output = device.configure(configuration_commands) 
+            logger.info(f"Applying configuration to {device_name}:\\n" + "\\n".join(configuration_commands))
+            # The configure() service takes a list of commands or a multi-line string.
+            # The result of configure() can vary. For some OS, it's the diff or full output. 
+            # For others, it might be None or raise an exception on failure.
+            # Robust error handling here should check for specific PyATS exceptions if known.
+            try:
+                config_output = conn.configure(configuration_commands)
+            finally:
+                # Even a rejected batch may have applied some lines, so the cached running-config is stale either way.
+                get_running_config_cache().invalidate(device_name)
+                get_parse_cache().invalidate(device_name)
         
-        # Check output - this is highly dependent on the device OS and PyATS version
-        # Some OS types might include "% Invalid input detected" or similar in output on error.
-        # Some PyATS drivers might raise an exception on command failure, caught by the general Exception.
-        # If config_output is a string, you might need to parse it for error indicators.
+            # Check output - this is highly dependent on the device OS and PyATS version
+            # Some OS types might include "% Invalid input detected" or similar in output on error.
+            # Some PyATS drivers might raise an exception on command failure, caught by the general Exception.
+            # If config_output is a string, you might need to parse it for error indicators.
         
-        # A simple check, often insufficient:
-        if isinstance(config_output, str) and ("% invalid input" in config_output.lower() or "error:" in config_output.lower()):
-            logger.error(f"Configuration application on {device_name} may have failed. Output: {config_output}")
-            return f"Configuration application on {device_name} potentially failed. Device output:\\n{config_output}"
+            # A simple check, often insufficient:
+            if isinstance(config_output, str) and ("% invalid input" in config_output.lower() or "error:" in config_output.lower()):
+                logger.error(f"Configuration application on {device_name} may have failed. Output: {config_output}")
+                return f"Configuration application on {device_name} potentially failed. Device output:\\n{config_output}"
         
-        logger.info(f"Successfully applied configuration to {device_name}. Device output (if any): {config_output}")
-        return f"Successfully applied configuration to {device_name}. Output:\\n{str(config_output)}"
+            logger.info(f"Successfully applied configuration to {device_name}. Device output (if any): {config_output}")
+            return f"Successfully applied configuration to {device_name}. Output:\\n{str(config_output)}"
         
     except Exception as e: # This could be pyats.connections.exceptions.ConnectionError, SubCommandFailure, etc.
         logger.error(f"Error applying configuration to {device_name}: {e}", exc_info=True)
         return f"Error applying configuration to {device_name}: {str(e)}"
-    finally:
-        if device.is_connected:
-            logger.info(f"Disconnecting from {device_name} after configuration attempt.")
-            device.disconnect()
 
 # --- Tools for managing HITL configuration confirmation state ---
 
@@ -1145,6 +1157,10 @@ all_tools = [
     get_device_connectivity,
     get_device_interface_status,
     where_is_device_plugged_in,
+    search_device_logs,
+    get_device_health,
+    find_busiest_devices,
+    find_metric_anomalies,
     perform_packet_capture,
     diagnose_network_issue_with_pyats, 
     generate_configuration_fix,        
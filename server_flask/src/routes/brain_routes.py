@@ -1,7 +1,10 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
+import json
 import logging
+import time
 
 from ..services.brain_service import BrainService # Import BrainService
+from ..services.brain_jobs import get_brain_job_manager, JobAdmissionError
 
 brain_bp = Blueprint('brain_bp', __name__)
 logger = logging.getLogger(__name__)
@@ -40,4 +43,65 @@ def query_brain():
 
     response = brain_service.handle_query(user_query, tenant_id, session_id)
         
-    return jsonify(response), 200 
\ No newline at end of file
+    return jsonify(response), 200 
+
+def _format_sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@brain_bp.route('/query/stream', methods=['POST'])
+def query_brain_stream():
+    """Same request body as /query, but streams progress as server-sent events."""
+    data = request.get_json()
+    if not data or 'query' not in data:
+        return jsonify({"error": "Missing query in request body"}), 400
+
+    user_query = data['query']
+    tenant_id = get_current_tenant_id()
+    session_id = data.get('session_id')
+    brain_service = get_brain_service()
+
+    logger.info(f"Received streaming brain query for tenant {tenant_id} (session: {session_id}): {user_query}")
+
+    def generate():
+        started = time.monotonic()
+        # Sent immediately so clients (and proxies) see the first byte before the first LLM call returns.
+        yield _format_sse("start", {"query": user_query, "session_id": session_id})
+        for event in brain_service.stream_query(user_query, tenant_id, session_id):
+            if event["event"] == "final":
+                event["data"]["elapsed_ms"] = round((time.monotonic() - started) * 1000)
+            yield _format_sse(event["event"], event["data"])
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"} # Disable proxy buffering (e.g. nginx)
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
+
+@brain_bp.route('/jobs', methods=['POST'])
+def create_brain_job():
+    """Queues a brain query (same body as /query) and returns its job id immediately; poll GET /jobs/<id>."""
+    data = request.get_json()
+    if not data or 'query' not in data:
+        return jsonify({"error": "Missing query in request body"}), 400
+
+    job_manager = get_brain_job_manager()
+    if job_manager is None:
+        return jsonify({"error": "The brain job queue is unavailable."}), 503
+
+    tenant_id = get_current_tenant_id()
+    try:
+        job = job_manager.submit(data['query'], tenant_id, data.get('session_id'))
+    except JobAdmissionError as e:
+        return jsonify({"error": str(e)}), 429
+
+    response = jsonify({"id": job["id"], "status": job["status"]})
+    response.headers['Location'] = f"{request.base_url.rstrip('/')}/{job['id']}"
+    return response, 202
+
+@brain_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_brain_job(job_id):
+    job_manager = get_brain_job_manager()
+    if job_manager is None:
+        return jsonify({"error": "The brain job queue is unavailable."}), 503
+
+    job = job_manager.get(job_id, get_current_tenant_id())
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job), 200
@@ -1,9 +1,10 @@
-from flask import Blueprint, jsonify, request, current_app
+from flask import Blueprint, jsonify, request, current_app, Response, stream_with_context
 from pydantic import ValidationError
+import json
 import logging # Import the logging module
 
-from ..services.device_service import DeviceService
-from ..models.device_model import DeviceCreate, DeviceUpdate
+from ..services.device_service import DeviceService, InvalidPaginationError, InvalidETagError, DeviceVersionConflictError
+from ..models.device_model import Device, DeviceCreate, DeviceUpdate
 
 # Get a logger instance
 logger = logging.getLogger(__name__)
@@ -15,14 +16,11 @@ device_bp = Blueprint('device_bp', __name__)
 _DEVICES_STORE = {} # Using a simple dictionary for now: { "device_id_1": {...}, "device_id_2": {...} }
 _next_device_id = 1
 
-# In a real app, the DeviceService would be initialized once, possibly when the app is created,
-# and made available through Flask's application context (e.g., using g or app.extensions).
-# For simplicity here, we'll instantiate it per request or as needed. 
-# A better approach for production would be to manage its lifecycle with the app.
+# DeviceService is a thin per-request wrapper; the Elasticsearch client it uses is created once
+# in create_app() and shared through app.extensions.
 
 def get_device_service():
-    """Helper to get DeviceService instance. Manages instance per request via flask.g if preferred."""
-    # This is a simple way; for more complex apps, consider Flask extensions or dependency injection patterns.
+    """Helper to get DeviceService instance."""
     return DeviceService()
 
 # TODO: Implement proper authentication and tenant_id extraction
@@ -36,6 +34,34 @@ def get_devices_route():
     service = get_device_service()
     tenant_id = get_current_tenant_id()
     site_id = request.args.get('siteId') # For filtering by siteId
+
+    # Paginated listing when any paging parameter is present; plain array otherwise (backwards compatible).
+    if any(param in request.args for param in ('limit', 'cursor', 'sort')):
+        max_limit = current_app.config.get('DEVICE_LIST_MAX_LIMIT', 1000)
+        try:
+            limit = int(request.args.get('limit', current_app.config.get('DEVICE_LIST_DEFAULT_LIMIT', 100)))
+        except ValueError:
+            return jsonify({"error": "limit must be an integer"}), 400
+        if not 1 <= limit <= max_limit:
+            return jsonify({"error": f"limit must be between 1 and {max_limit}"}), 400
+        try:
+            page = service.get_devices_page(
+                tenant_id=tenant_id,
+                site_id=site_id,
+                limit=limit,
+                cursor=request.args.get('cursor'),
+                sort=request.args.get('sort'),
+                include_total=request.args.get('total', 'false').lower() == 'true'
+            )
+        except InvalidPaginationError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            logger.error(f"Error fetching device page: {e}")
+            return jsonify({"error": "Failed to fetch devices"}), 500
+        response = {"items": [device.dict() for device in page["items"]], "next_cursor": page["next_cursor"]}
+        if page["total"] is not None:
+            response["total"] = page["total"]
+        return jsonify(response), 200
     
     try:
         devices = service.get_all_devices(tenant_id=tenant_id, site_id=site_id)
@@ -45,14 +71,45 @@ def get_devices_route():
         logger.error(f"Error fetching devices: {e}")
         return jsonify({"error": "Failed to fetch devices"}), 500
 
+@device_bp.route('/export', methods=['GET'])
+def export_devices_route():
+    """Streams the tenant's devices as NDJSON. Optional `fields` (comma-separated) projects _source."""
+    service = get_device_service()
+    tenant_id = get_current_tenant_id()
+    site_id = request.args.get('siteId')
+
+    fields = None
+    if request.args.get('fields'):
+        fields = [field.strip() for field in request.args['fields'].split(',') if field.strip()]
+        unknown = [field for field in fields if field not in Device.__fields__ or field == 'id']
+        if unknown:
+            return jsonify({"error": f"Unknown export fields: {', '.join(unknown)}"}), 400
+
+    devices = service.export_devices(tenant_id=tenant_id, site_id=site_id, fields=fields)
+
+    def generate():
+        exported = 0
+        try:
+            for device in devices:
+                exported += 1
+                yield json.dumps(device, default=str) + "\n"
+        except Exception as e:
+            # Headers are already sent; end the stream with an error record so consumers can tell it is truncated.
+            logger.error(f"Error exporting devices after {exported} records: {e}")
+            yield json.dumps({"error": "Device export failed", "exported": exported}) + "\n"
+        finally:
+            devices.close()
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 @device_bp.route('/<string:device_id>', methods=['GET'])
 def get_device_by_id_route(device_id):
     service = get_device_service()
     tenant_id = get_current_tenant_id()
     try:
-        device = service.get_device_by_id(device_id=device_id, tenant_id=tenant_id)
-        if device:
-            return jsonify(device.dict()), 200
+        record = service.get_device_record(device_id=device_id, tenant_id=tenant_id)
+        if record:
+            return jsonify(record.device.dict()), 200, {"ETag": record.etag}
         else:
             return jsonify({"error": "Device not found or not authorized"}), 404
     except Exception as e:
@@ -84,6 +141,41 @@ def add_device_route():
         logger.error(f"Error creating device: {e}")
         return jsonify({"error": "Failed to create device"}), 500
 
+def _iter_ndjson_items(stream):
+    """Decodes an NDJSON request body line by line; undecodable lines become ValueError items."""
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield ValueError(f"Invalid JSON on line {line_number}: {e}")
+
+@device_bp.route('/_bulk', methods=['POST'])
+def bulk_add_devices_route():
+    """Creates devices from a JSON array or an NDJSON body; returns a result per item."""
+    service = get_device_service()
+    tenant_id = get_current_tenant_id()
+
+    if request.mimetype in ('application/x-ndjson', 'application/ndjson'):
+        items = _iter_ndjson_items(request.stream)
+    else:
+        items = request.get_json(silent=True)
+        if not isinstance(items, list):
+            return jsonify({"error": "Expected a JSON array of devices or an application/x-ndjson body"}), 400
+
+    refresh = request.args.get('refresh')
+    if refresh is not None and refresh not in ('true', 'false', 'wait_for'):
+        return jsonify({"error": "refresh must be one of true, false, wait_for"}), 400
+
+    try:
+        result = service.bulk_create_devices(items, tenant_id=tenant_id, refresh=refresh)
+    except Exception as e:
+        logger.error(f"Error bulk creating devices: {e}")
+        return jsonify({"error": "Failed to bulk create devices"}), 500
+    return jsonify(result), (207 if result["errors"] else 201)
+
 @device_bp.route('/<string:device_id>', methods=['PUT'])
 def update_device_route(device_id):
     service = get_device_service()
@@ -100,12 +192,22 @@ def update_device_route(device_id):
     if not update_data.dict(exclude_unset=True): # Check if any fields were actually provided for update
         return jsonify({"error": "No update fields provided"}), 400
 
+    # Optional optimistic concurrency: If-Match carries the ETag from a previous GET/PUT ('*' matches any version).
+    if_match = request.headers.get('If-Match')
+    if if_match == '*':
+        if_match = None
+
     try:
-        updated_device = service.update_device(device_id=device_id, device_update_data=update_data, tenant_id=tenant_id)
-        if updated_device:
-            return jsonify(updated_device.dict()), 200
+        updated = service.update_device_record(device_id=device_id, device_update_data=update_data,
+                                               tenant_id=tenant_id, if_match=if_match)
+        if updated:
+            return jsonify(updated.device.dict()), 200, {"ETag": updated.etag}
         else:
             return jsonify({"error": "Device not found or failed to update"}), 404 # Or 500 if update failed for other reasons
+    except InvalidETagError as e:
+        return jsonify({"error": str(e)}), 400
+    except DeviceVersionConflictError as e:
+        return jsonify({"error": str(e)}), 412
     except Exception as e:
         logger.error(f"Error updating device {device_id}: {e}")
         return jsonify({"error": "Failed to update device"}), 500
@@ -114,12 +216,19 @@ def update_device_route(device_id):
 def delete_device_route(device_id):
     service = get_device_service()
     tenant_id = get_current_tenant_id()
+    if_match = request.headers.get('If-Match')
+    if if_match == '*':
+        if_match = None
     try:
-        success = service.delete_device(device_id=device_id, tenant_id=tenant_id)
+        success = service.delete_device(device_id=device_id, tenant_id=tenant_id, if_match=if_match)
         if success:
             return '', 204
         else:
             return jsonify({"error": "Device not found or failed to delete"}), 404
+    except InvalidETagError as e:
+        return jsonify({"error": str(e)}), 400
+    except DeviceVersionConflictError as e:
+        return jsonify({"error": str(e)}), 412
     except Exception as e:
         logger.error(f"Error deleting device {device_id}: {e}")
         return jsonify({"error": "Failed to delete device"}), 500 
\ No newline at end of file
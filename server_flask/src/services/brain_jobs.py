@@ -0,0 +1,272 @@
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+EXTENSION_KEY = 'brain_jobs'
+
+JOB_STATUS_QUEUED = 'queued'
+JOB_STATUS_RUNNING = 'running'
+JOB_STATUS_SUCCEEDED = 'succeeded'
+JOB_STATUS_FAILED = 'failed'
+ACTIVE_JOB_STATUSES = (JOB_STATUS_QUEUED, JOB_STATUS_RUNNING)
+
+
+class JobAdmissionError(Exception):
+    """Raised when a tenant already has the maximum number of queued or running brain jobs."""
+
+
+class BrainJobStore:
+    """
+    Brain job records in a local SQLite file (WAL mode), shared by all workers on the host.
+    Records expire `ttl` seconds after they were last updated and are purged lazily.
+    """
+
+    # Workers heartbeat their queued and running jobs (BrainJobManager.HEARTBEAT_SECONDS), so active jobs that
+    # have not been updated for this long belong to a worker that died; they no longer count against the
+    # tenant's limit and are reported as failed.
+    STALE_AFTER_SECONDS = 900
+
+    def __init__(self, path: str, ttl: float = 86400):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS brain_jobs ("
+            " id TEXT PRIMARY KEY,"
+            " tenant_id TEXT NOT NULL,"
+            " session_id TEXT,"
+            " query TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " actions_taken TEXT NOT NULL DEFAULT '[]',"
+            " result TEXT,"
+            " error TEXT,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS brain_jobs_tenant_status ON brain_jobs (tenant_id, status)")
+        conn.execute("CREATE INDEX IF NOT EXISTS brain_jobs_updated_at ON brain_jobs (updated_at)")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def create(self, tenant_id: str, query: str, session_id: Optional[str], max_active: int) -> Dict[str, Any]:
+        """
+        Inserts a queued job, unless the tenant already has `max_active` active jobs. The count and the
+        insert run in one write transaction so concurrent submissions from other workers cannot overshoot.
+        """
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            active = conn.execute(
+                f"SELECT COUNT(*) FROM brain_jobs WHERE tenant_id = ? AND status IN ({','.join('?' * len(ACTIVE_JOB_STATUSES))})"
+                " AND updated_at > ?",
+                (tenant_id, *ACTIVE_JOB_STATUSES, now - self.STALE_AFTER_SECONDS)
+            ).fetchone()[0]
+            if active >= max_active:
+                conn.execute("ROLLBACK")
+                raise JobAdmissionError(f"Tenant {tenant_id} already has {active} active brain job(s) (limit {max_active}).")
+            conn.execute(
+                "INSERT INTO brain_jobs (id, tenant_id, session_id, query, status, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, tenant_id, session_id, query, JOB_STATUS_QUEUED, now, now)
+            )
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        self._purge_expired()
+        return self.get(job_id, tenant_id)
+
+    def update(self, job_id: str, status: Optional[str] = None, actions_taken: Optional[List[Dict[str, Any]]] = None,
+               result: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        assignments = ["updated_at = ?"]
+        values: List[Any] = [time.time()]
+        if status is not None:
+            assignments.append("status = ?")
+            values.append(status)
+        if actions_taken is not None:
+            assignments.append("actions_taken = ?")
+            values.append(json.dumps(actions_taken, default=str))
+        if result is not None:
+            assignments.append("result = ?")
+            values.append(json.dumps(result, default=str))
+        if error is not None:
+            assignments.append("error = ?")
+            values.append(error)
+        values.append(job_id)
+        self._connection().execute(f"UPDATE brain_jobs SET {', '.join(assignments)} WHERE id = ?", values)
+
+    def touch(self, job_ids: List[str]):
+        """Marks the given jobs as alive without changing them; finished jobs are left alone."""
+        conn = self._connection()
+        now = time.time()
+        for i in range(0, len(job_ids), 500): # stay under SQLite's bound parameter limit
+            chunk = job_ids[i:i + 500]
+            conn.execute(
+                f"UPDATE brain_jobs SET updated_at = ? WHERE id IN ({','.join('?' * len(chunk))})"
+                f" AND status IN ({','.join('?' * len(ACTIVE_JOB_STATUSES))})",
+                (now, *chunk, *ACTIVE_JOB_STATUSES)
+            )
+
+    def get(self, job_id: str, tenant_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connection().execute(
+            "SELECT id, tenant_id, session_id, query, status, actions_taken, result, error, created_at, updated_at"
+            " FROM brain_jobs WHERE id = ? AND tenant_id = ? AND updated_at > ?",
+            (job_id, tenant_id, time.time() - self.ttl)
+        ).fetchone()
+        if row is None:
+            return None
+        job = {
+            "id": row[0],
+            "tenantId": row[1],
+            "session_id": row[2],
+            "query": row[3],
+            "status": row[4],
+            "actions_taken": json.loads(row[5]),
+            "result": json.loads(row[6]) if row[6] else None,
+            "error": row[7],
+            "createdAt": row[8],
+            "updatedAt": row[9],
+        }
+        if job["status"] in ACTIVE_JOB_STATUSES and job["updatedAt"] < time.time() - self.STALE_AFTER_SECONDS:
+            job["status"] = JOB_STATUS_FAILED
+            job["error"] = job["error"] or "The worker running this job stopped before it finished."
+        return job
+
+    def _purge_expired(self):
+        try:
+            self._connection().execute("DELETE FROM brain_jobs WHERE updated_at < ?", (time.time() - self.ttl,))
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to purge expired brain jobs: {e}")
+
+
+class BrainJobManager:
+    """
+    Runs brain queries as background jobs on a bounded thread pool, so a long agent run does not hold a
+    request thread. Progress (tool calls as they start and finish) and the final result go to the job store.
+    While this process holds a job, queued or running, a heartbeat thread keeps its record fresh so that a
+    long tool call or a wait behind other jobs is not mistaken for a dead worker.
+    """
+
+    HEARTBEAT_SECONDS = 60
+
+    def __init__(self, app, store: BrainJobStore, max_workers: int = 4, max_active_per_tenant: int = 2):
+        self.app = app
+        self.store = store
+        self.max_active_per_tenant = max(1, max_active_per_tenant)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="brain-job")
+        self._held_jobs = set()
+        self._held_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat = threading.Thread(target=self._heartbeat_loop, name="brain-job-heartbeat", daemon=True)
+        self._heartbeat.start()
+
+    def submit(self, user_query: str, tenant_id: str, session_id: Optional[str] = None) -> Dict[str, Any]:
+        """Queues a query and returns the job record. Raises JobAdmissionError if the tenant is at its limit."""
+        job = self.store.create(tenant_id, user_query, session_id, self.max_active_per_tenant)
+        with self._held_lock:
+            self._held_jobs.add(job["id"])
+        self._executor.submit(self._run_job, job["id"], user_query, tenant_id, session_id)
+        logger.info(f"Queued brain job {job['id']} for tenant {tenant_id} (session: {session_id}).")
+        return job
+
+    def get(self, job_id: str, tenant_id: str) -> Optional[Dict[str, Any]]:
+        return self.store.get(job_id, tenant_id)
+
+    def shutdown(self):
+        self._stop.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(self.HEARTBEAT_SECONDS):
+            with self._held_lock:
+                job_ids = list(self._held_jobs)
+            if not job_ids:
+                continue
+            try:
+                self.store.touch(job_ids)
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to heartbeat {len(job_ids)} brain job(s): {e}")
+
+    def _run_job(self, job_id: str, user_query: str, tenant_id: str, session_id: Optional[str]):
+        try:
+            self._run_job_in_context(job_id, user_query, tenant_id, session_id)
+        finally:
+            with self._held_lock:
+                self._held_jobs.discard(job_id)
+
+    def _run_job_in_context(self, job_id: str, user_query: str, tenant_id: str, session_id: Optional[str]):
+        from .brain_service import BrainService # Imported here; brain_service pulls in the agent and its tools
+
+        with self.app.app_context():
+            self.store.update(job_id, status=JOB_STATUS_RUNNING)
+            actions_taken: List[Dict[str, Any]] = []
+            actions_by_call_id: Dict[str, Dict[str, Any]] = {}
+            try:
+                for event in BrainService().stream_query(user_query, tenant_id, session_id):
+                    kind, data = event["event"], event["data"]
+                    if kind == "tool_start":
+                        action = {"tool_name": data.get("tool_name"), "tool_input": data.get("tool_input"), "status": "running"}
+                        actions_by_call_id[data.get("tool_call_id")] = action
+                        actions_taken.append(action)
+                        self.store.update(job_id, actions_taken=actions_taken)
+                    elif kind == "tool_end":
+                        action = actions_by_call_id.get(data.get("tool_call_id"))
+                        if action is not None:
+                            action.update(status="completed", tool_output=data.get("tool_output"),
+                                          duration_ms=data.get("duration_ms"))
+                            self.store.update(job_id, actions_taken=actions_taken)
+                    elif kind == "final":
+                        self.store.update(job_id, status=JOB_STATUS_SUCCEEDED,
+                                          actions_taken=data.get("actions_taken", actions_taken), result=data)
+                        logger.info(f"Brain job {job_id} succeeded.")
+                        return
+                    elif kind == "error":
+                        self.store.update(job_id, status=JOB_STATUS_FAILED, error=data.get("error"))
+                        logger.warning(f"Brain job {job_id} failed: {data.get('error')}")
+                        return
+                self.store.update(job_id, status=JOB_STATUS_FAILED, error="The agent finished without a result.")
+            except Exception as e:
+                logger.error(f"Unexpected error running brain job {job_id}: {e}", exc_info=True)
+                self.store.update(job_id, status=JOB_STATUS_FAILED, error=str(e))
+
+
+def init_brain_jobs(app) -> BrainJobManager:
+    """Creates the brain job store and worker pool and stores the manager on app.extensions."""
+    store = BrainJobStore(app.config.get('BRAIN_JOB_DB_PATH', 'instance/brain_jobs.sqlite3'),
+                          ttl=app.config.get('BRAIN_JOB_TTL_SECONDS', 86400))
+    manager = BrainJobManager(
+        app, store,
+        max_workers=app.config.get('BRAIN_JOB_WORKERS', 4),
+        max_active_per_tenant=app.config.get('BRAIN_JOB_MAX_ACTIVE_PER_TENANT', 2),
+    )
+    app.extensions[EXTENSION_KEY] = manager
+    logger.info(
+        f"Brain job queue initialized ({app.config.get('BRAIN_JOB_WORKERS', 4)} workers, "
+        f"max {manager.max_active_per_tenant} active jobs per tenant, store {store.path})."
+    )
+    return manager
+
+def get_brain_job_manager() -> Optional[BrainJobManager]:
+    """Returns the current app's brain job manager, or None if it failed to initialize."""
+    return current_app.extensions.get(EXTENSION_KEY)
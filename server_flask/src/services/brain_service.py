@@ -1,16 +1,16 @@
 from flask import current_app # Removed g, as we are using an app-level singleton
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage # For type hinting history
 
 from ..brain_agent.agent import BrainLangGraphAgent
+from .conversation_store import get_conversation_store
 # from ..brain_agent.tools import all_tools # Tools are used by the agent itself
 
 logger = logging.getLogger(__name__)
 
-# In-memory store for conversation histories by session_id
-# For production, consider a more persistent store like Redis or a database.
-_conversation_histories: Dict[str, List[Dict[str, Any]]] = {}
+# Conversation histories by session_id live in the configured ConversationStore (see conversation_store.py),
+# which also bounds the number of sessions kept.
 MAX_HISTORY_LENGTH = 10 # Max number of (Human, AI) message pairs to keep in history
 
 # --- App-level singleton for BrainLangGraphAgent ---
@@ -50,7 +50,11 @@ class BrainService:
         pass
 
     def _load_history(self, session_id: str) -> List[BaseMessage]:
-        history_dicts = _conversation_histories.get(session_id, [])
+        store = get_conversation_store()
+        if store is None:
+            logger.warning(f"No conversation store; session {session_id} runs without its history.")
+            return []
+        history_dicts = store.load(session_id)
         history_messages: List[BaseMessage] = []
         for msg_dict in history_dicts:
             if msg_dict.get('type') == 'human':
@@ -64,9 +68,6 @@ class BrainService:
         return history_messages
 
     def _save_history(self, session_id: str, current_turn_messages: List[Dict[str, Any]]):
-        if session_id not in _conversation_histories:
-            _conversation_histories[session_id] = []
-        
         # Extract Human and AI messages from the current turn to append to history
         # We want to store simplified versions, mainly the conversational parts.
         # The agent's `full_conversation_this_turn` includes system prompts and tool messages too.
@@ -81,12 +82,11 @@ class BrainService:
             elif msg_type == 'ai' and not is_tool_call_response: # Only save AI messages that are direct responses
                 simplified_turn_history.append({"type": "ai", "content": msg_content})
         
-        _conversation_histories[session_id].extend(simplified_turn_history)
-        
-        # Trim history to MAX_HISTORY_LENGTH (pairs of Human/AI messages)
-        if len(_conversation_histories[session_id]) > MAX_HISTORY_LENGTH * 2:
-            # Keep the most recent messages
-            _conversation_histories[session_id] = _conversation_histories[session_id][-(MAX_HISTORY_LENGTH * 2):]
+        store = get_conversation_store()
+        if store is None:
+            return
+        # The store keeps the most recent MAX_HISTORY_LENGTH pairs of Human/AI messages
+        store.append(session_id, simplified_turn_history, max_messages=MAX_HISTORY_LENGTH * 2)
 
     def handle_query(self, user_query: str, tenant_id: str, session_id: Optional[str] = None):
         agent = get_brain_agent_instance()
@@ -100,11 +100,11 @@ class BrainService:
             }
         
         conversation_history: List[BaseMessage] = []
-        if session_id:
-            conversation_history = self._load_history(session_id)
-            logger.debug(f"Loaded history for session {session_id}: {len(conversation_history)} messages")
-
         try:
+            if session_id:
+                conversation_history = self._load_history(session_id)
+                logger.debug(f"Loaded history for session {session_id}: {len(conversation_history)} messages")
+
             result = agent.invoke(
                 user_query,
                 tenant_id=tenant_id,
@@ -114,7 +114,7 @@ class BrainService:
             
             if session_id and result.get("full_conversation_this_turn"):
                 self._save_history(session_id, result["full_conversation_this_turn"])
-                logger.debug(f"Saved history for session {session_id}. New length: {len(_conversation_histories.get(session_id, []))}")
+                logger.debug(f"Saved history for session {session_id}.")
 
             # For debugging, add current history to response
             # result["conversation_history_debug"] = [msg.dict() for msg in self._load_history(session_id)] if session_id else []
@@ -128,6 +128,32 @@ class BrainService:
                 "conversation_history_debug": [msg.dict() for msg in conversation_history] # Show history up to the error
             }
 
+    def stream_query(self, user_query: str, tenant_id: str, session_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Streaming counterpart of handle_query: yields the agent's progress events (see BrainLangGraphAgent.stream)
+        and saves the conversation history once the final event has been produced.
+        """
+        agent = get_brain_agent_instance()
+        if not agent:
+            logger.error("Brain agent is not initialized or initialization failed. Cannot stream query.")
+            yield {"event": "error", "data": {"error": "The Brain AI is currently unavailable. Please try again later or contact support."}}
+            return
+
+        conversation_history: List[BaseMessage] = []
+        try:
+            if session_id:
+                conversation_history = self._load_history(session_id)
+                logger.debug(f"Loaded history for session {session_id}: {len(conversation_history)} messages")
+
+            for event in agent.stream(user_query, tenant_id=tenant_id, session_id=session_id,
+                                      conversation_history=conversation_history):
+                if event["event"] == "final" and session_id and event["data"].get("full_conversation_this_turn"):
+                    self._save_history(session_id, event["data"]["full_conversation_this_turn"])
+                yield event
+        except Exception as e:
+            logger.error(f"Error during streamed brain agent run for query '{user_query}': {e}", exc_info=True)
+            yield {"event": "error", "data": {"error": f"An error occurred while processing your request: {str(e)}"}}
+
 # --- Function to initialize the agent with the app (optional, for pre-loading) ---
 def init_brain_service_with_app(app):
     with app.app_context():
@@ -0,0 +1,248 @@
+from abc import ABC, abstractmethod
+from flask import current_app
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+EXTENSION_KEY = 'conversation_store'
+
+# A stored message is a simplified {"type": "human"|"ai", "content": str} dict (see BrainService._save_history).
+Message = Dict[str, Any]
+
+
+def _approximate_size(messages: List[Message]) -> int:
+    return sum(len(m.get('content') or '') + 32 for m in messages)
+
+
+class ConversationStore(ABC):
+    """
+    Interface for conversation history backends. Histories are keyed by session id and bounded twice:
+    per session by `max_messages` on append, and across sessions by LRU eviction beyond `max_sessions`
+    plus expiry of sessions idle for longer than `ttl` seconds.
+    """
+
+    @abstractmethod
+    def load(self, session_id: str) -> List[Message]:
+        """Returns the session's messages, oldest first; an empty list for unknown or expired sessions."""
+
+    @abstractmethod
+    def append(self, session_id: str, messages: List[Message], max_messages: int):
+        """Appends messages to the session, keeping only its last `max_messages`."""
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        """Forgets the session."""
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        """Session count, size and eviction counters, for the health endpoint."""
+
+
+class InMemoryConversationStore(ConversationStore):
+    """
+    Per-process store. Each session maps to an immutable (messages, size) tuple that writers replace
+    wholesale, so readers never take the lock: they read the tuple and stamp the session's last access.
+    Writers hold the lock to expire idle sessions and evict the least recently accessed ones.
+    """
+
+    def __init__(self, max_sessions: int = 1000, ttl: float = 86400):
+        self.max_sessions = max(1, max_sessions)
+        self.ttl = ttl
+        self._sessions: Dict[str, Tuple[Tuple[Message, ...], int]] = {}
+        self._last_access: Dict[str, float] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {"evictions": 0, "expirations": 0}
+
+    def load(self, session_id: str) -> List[Message]:
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return []
+        now = time.monotonic()
+        if now - self._last_access.get(session_id, now) > self.ttl:
+            return [] # Expired; removed by the next write
+        self._last_access[session_id] = now
+        return list(entry[0])
+
+    def append(self, session_id: str, messages: List[Message], max_messages: int):
+        now = time.monotonic()
+        with self._lock:
+            previous = self._sessions.get(session_id)
+            if previous is not None and now - self._last_access.get(session_id, now) > self.ttl:
+                previous = None
+            history = (previous[0] if previous else ()) + tuple(messages)
+            history = history[-max_messages:]
+            size = _approximate_size(history)
+            self._remove_locked(session_id)
+            self._sessions[session_id] = (history, size)
+            self._last_access[session_id] = now
+            self._bytes += size
+            self._evict_locked(now)
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._remove_locked(session_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "approx_bytes": self._bytes,
+                **self._counters,
+            }
+
+    def _remove_locked(self, session_id: str):
+        entry = self._sessions.pop(session_id, None)
+        self._last_access.pop(session_id, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def _evict_locked(self, now: float):
+        # A lock-free load() can stamp a session that a writer removed at the same moment
+        for sid in [sid for sid in list(self._last_access) if sid not in self._sessions]:
+            self._last_access.pop(sid, None)
+        expired = [sid for sid, accessed in list(self._last_access.items()) if now - accessed > self.ttl]
+        for sid in expired:
+            self._remove_locked(sid)
+        self._counters["expirations"] += len(expired)
+        overflow = len(self._sessions) - self.max_sessions
+        if overflow > 0:
+            oldest = sorted(list(self._last_access.items()), key=lambda item: item[1])[:overflow]
+            for sid, _ in oldest:
+                self._remove_locked(sid)
+            self._counters["evictions"] += len(oldest)
+
+
+class SQLiteConversationStore(ConversationStore):
+    """
+    Store shared by all workers on a host through a local SQLite file in WAL mode, so a follow-up
+    question that lands on another worker (or arrives after a worker was recycled) keeps its context.
+    WAL readers never block on writers. Last-access stamps are written at most every
+    `TOUCH_INTERVAL_SECONDS` per session to keep reads from turning into writes.
+    """
+
+    TOUCH_INTERVAL_SECONDS = 60
+
+    def __init__(self, path: str, max_sessions: int = 1000, ttl: float = 86400):
+        self.path = path
+        self.max_sessions = max(1, max_sessions)
+        self.ttl = ttl
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS conversation_sessions ("
+            " session_id TEXT PRIMARY KEY,"
+            " messages TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS conversation_sessions_last_access ON conversation_sessions (last_access)")
+        self._counters = {"evictions": 0, "expirations": 0}
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def load(self, session_id: str) -> List[Message]:
+        now = time.time()
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT messages, last_access FROM conversation_sessions WHERE session_id = ? AND last_access > ?",
+            (session_id, now - self.ttl)
+        ).fetchone()
+        if row is None:
+            return []
+        if now - row[1] > self.TOUCH_INTERVAL_SECONDS:
+            try:
+                conn.execute("UPDATE conversation_sessions SET last_access = ? WHERE session_id = ?", (now, session_id))
+            except sqlite3.OperationalError as e: # e.g. database is locked; the stamp is only an LRU hint
+                logger.debug(f"Skipped last-access update for conversation {session_id}: {e}")
+        return json.loads(row[0])
+
+    def append(self, session_id: str, messages: List[Message], max_messages: int):
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT messages FROM conversation_sessions WHERE session_id = ? AND last_access > ?",
+                (session_id, now - self.ttl)
+            ).fetchone()
+            history = (json.loads(row[0]) if row else []) + list(messages)
+            history = history[-max_messages:]
+            conn.execute(
+                "INSERT OR REPLACE INTO conversation_sessions (session_id, messages, size, last_access) VALUES (?, ?, ?, ?)",
+                (session_id, json.dumps(history), _approximate_size(history), now)
+            )
+            expired = conn.execute("DELETE FROM conversation_sessions WHERE last_access <= ?", (now - self.ttl,)).rowcount
+            evicted = conn.execute(
+                "DELETE FROM conversation_sessions WHERE session_id IN ("
+                " SELECT session_id FROM conversation_sessions ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_sessions,)
+            ).rowcount
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        self._counters["expirations"] += max(expired, 0)
+        self._counters["evictions"] += max(evicted, 0)
+
+    def delete(self, session_id: str):
+        self._connection().execute("DELETE FROM conversation_sessions WHERE session_id = ?", (session_id,))
+
+    def stats(self) -> Dict[str, Any]:
+        sessions, size = self._connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM conversation_sessions"
+        ).fetchone()
+        return {
+            "backend": "sqlite",
+            "sessions": sessions,
+            "max_sessions": self.max_sessions,
+            "approx_bytes": size,
+            **self._counters,
+        }
+
+
+def init_conversation_store(app) -> ConversationStore:
+    """Creates the conversation history backend selected by CONVERSATION_STORE_BACKEND and stores it on app.extensions."""
+    backend = (app.config.get('CONVERSATION_STORE_BACKEND') or 'memory').lower()
+    max_sessions = app.config.get('CONVERSATION_STORE_MAX_SESSIONS', 1000)
+    ttl = app.config.get('CONVERSATION_STORE_TTL_SECONDS', 86400)
+    if backend == 'sqlite':
+        store = SQLiteConversationStore(app.config.get('CONVERSATION_STORE_DB_PATH', 'instance/conversations.sqlite3'),
+                                        max_sessions=max_sessions, ttl=ttl)
+    elif backend == 'memory':
+        store = InMemoryConversationStore(max_sessions=max_sessions, ttl=ttl)
+    else:
+        raise ValueError(f"Unknown CONVERSATION_STORE_BACKEND '{backend}'; expected 'memory' or 'sqlite'.")
+    app.extensions[EXTENSION_KEY] = store
+    logger.info(f"Conversation store initialized ({backend}, max {max_sessions} sessions, TTL {ttl}s).")
+    return store
+
+def get_conversation_store() -> Optional[ConversationStore]:
+    """
+    Returns the current app's conversation store, creating the configured backend on first use if needed.
+    Returns None if the backend cannot be created; conversations then run without history.
+    """
+    store = current_app.extensions.get(EXTENSION_KEY)
+    if store is None:
+        try:
+            store = init_conversation_store(current_app._get_current_object())
+        except Exception as e:
+            logger.error(f"Conversation store unavailable: {e}")
+    return store
@@ -0,0 +1,213 @@
+from collections import OrderedDict
+from flask import current_app
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+EXTENSION_KEY = 'device_cache'
+
+class SQLiteInvalidationChannel:
+    """
+    Cross-worker invalidation through a change table in a local SQLite file (WAL mode).
+    Every worker appends the devices it changes; every worker polls for rows it has not seen yet.
+    """
+
+    # Change rows older than this are pruned; any worker polling less often than this would miss them.
+    RETENTION_SECONDS = 3600
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS device_changes ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " tenant_id TEXT NOT NULL,"
+            " device_id TEXT NOT NULL,"
+            " changed_at REAL NOT NULL)"
+        )
+        conn.commit()
+        self._last_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM device_changes").fetchone()[0]
+        self._publish_count = 0
+        self._own_seqs = set() # Our own changes are already applied locally; poll() skips them
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def publish(self, tenant_id: str, device_id: str):
+        conn = self._connection()
+        cursor = conn.execute(
+            "INSERT INTO device_changes (tenant_id, device_id, changed_at) VALUES (?, ?, ?)",
+            (tenant_id, device_id, time.time())
+        )
+        self._own_seqs.add(cursor.lastrowid)
+        self._publish_count += 1
+        if self._publish_count % 1000 == 0:
+            conn.execute("DELETE FROM device_changes WHERE changed_at < ?", (time.time() - self.RETENTION_SECONDS,))
+
+    def poll(self) -> List[Tuple[str, str]]:
+        """Returns (tenant_id, device_id) pairs changed by any worker since the previous poll."""
+        rows = self._connection().execute(
+            "SELECT seq, tenant_id, device_id FROM device_changes WHERE seq > ? ORDER BY seq", (self._last_seq,)
+        ).fetchall()
+        if rows:
+            self._last_seq = rows[-1][0]
+        changed = []
+        for seq, tenant_id, device_id in rows:
+            if seq in self._own_seqs:
+                self._own_seqs.discard(seq)
+            else:
+                changed.append((tenant_id, device_id))
+        return changed
+
+
+class DeviceCache:
+    """
+    Size-bounded, TTL-based read-through cache of device records keyed by (tenant_id, device_id).
+    Entries are evicted least-recently-used first once `max_entries` is reached. When an invalidation
+    channel is configured, changes made by other workers are applied at most `poll_interval` seconds late.
+
+    Read-through fills race with writes: a reader can fetch a device, lose the CPU while a writer updates and
+    invalidates it, then store the old record. Readers therefore take `fill_token()` before fetching and pass
+    it to `put()`, which drops the fill if the device was invalidated since.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 30,
+                 invalidation_channel: Optional[SQLiteInvalidationChannel] = None, poll_interval: float = 1.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.invalidation_channel = invalidation_channel
+        self.poll_interval = poll_interval
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._next_poll = 0.0
+        # Invalidation generation, and the generation at which recently invalidated keys were last invalidated.
+        # Keys pushed out of the bounded map raise `_pruned_generation`, which then rejects every older fill.
+        self._generation = 0
+        self._invalidated: "OrderedDict[Hashable, int]" = OrderedDict()
+        self._pruned_generation = 0
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0,
+                          "stale_fills": 0}
+
+    def get(self, tenant_id: str, device_id: str) -> Optional[Any]:
+        self._poll_invalidations()
+        key = (tenant_id, device_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self._counters["expirations"] += 1
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return value
+
+    def fill_token(self) -> int:
+        """Returns the token to pass to put() for a value fetched after this call."""
+        with self._lock:
+            return self._generation
+
+    def put(self, tenant_id: str, device_id: str, value: Any, token: Optional[int] = None):
+        """Stores a value, unless `token` (from fill_token) shows the device was invalidated after it was fetched."""
+        key = (tenant_id, device_id)
+        with self._lock:
+            if token is not None and (self._invalidated.get(key, 0) > token or self._pruned_generation > token):
+                self._counters["stale_fills"] += 1
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def invalidate(self, tenant_id: str, device_id: str, broadcast: bool = True):
+        """Drops a device locally and, if `broadcast`, tells the other workers to drop it as well."""
+        key = (tenant_id, device_id)
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._counters["invalidations"] += 1
+            self._generation += 1
+            self._invalidated[key] = self._generation
+            self._invalidated.move_to_end(key)
+            if len(self._invalidated) > self.max_entries:
+                _, self._pruned_generation = self._invalidated.popitem(last=False)
+        if broadcast and self.invalidation_channel is not None:
+            try:
+                self.invalidation_channel.publish(tenant_id, device_id)
+            except sqlite3.Error as e:
+                logger.error(f"Failed to publish device cache invalidation for {device_id}: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                **self._counters,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hit_ratio": round(self._counters["hits"] / lookups, 4) if lookups else None,
+            }
+
+    def _poll_invalidations(self):
+        if self.invalidation_channel is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_poll:
+                return
+            self._next_poll = now + self.poll_interval
+        try:
+            changed = self.invalidation_channel.poll()
+        except sqlite3.Error as e:
+            logger.error(f"Failed to poll device cache invalidations: {e}")
+            return
+        for tenant_id, device_id in changed:
+            self.invalidate(tenant_id, device_id, broadcast=False)
+
+
+def init_device_cache(app) -> Optional[DeviceCache]:
+    """Creates the per-process device cache (if enabled) and stores it on app.extensions."""
+    if not app.config.get('DEVICE_CACHE_ENABLED', True):
+        app.extensions[EXTENSION_KEY] = None
+        return None
+    channel = None
+    if app.config.get('DEVICE_CACHE_INVALIDATION_DB'):
+        channel = SQLiteInvalidationChannel(app.config['DEVICE_CACHE_INVALIDATION_DB'])
+    cache = DeviceCache(
+        max_entries=app.config.get('DEVICE_CACHE_MAX_ENTRIES', 10000),
+        ttl=app.config.get('DEVICE_CACHE_TTL_SECONDS', 30),
+        invalidation_channel=channel,
+        poll_interval=app.config.get('DEVICE_CACHE_INVALIDATION_POLL_SECONDS', 1.0),
+    )
+    app.extensions[EXTENSION_KEY] = cache
+    logger.info(
+        f"Device cache initialized (max {cache.max_entries} entries, TTL {cache.ttl}s, "
+        f"cross-worker invalidation {'on' if channel else 'off'})."
+    )
+    return cache
+
+def get_device_cache() -> Optional[DeviceCache]:
+    """Returns the current app's device cache, or None if caching is disabled or not initialized."""
+    return current_app.extensions.get(EXTENSION_KEY)
@@ -0,0 +1,164 @@
+from elasticsearch import Elasticsearch, BadRequestError, NotFoundError
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Bump this whenever DEVICE_INDEX_MAPPINGS changes. On startup, bootstrap_device_index() creates
+# `<alias>_v<version>`, reindexes the previous generation into it and moves the alias over.
+DEVICE_INDEX_MAPPING_VERSION = 1
+
+# How long a worker that finds another worker's reindex finished waits for it to move the alias
+ALIAS_SWAP_GRACE_SECONDS = 30
+
+DEVICE_INDEX_SETTINGS = {
+    "number_of_shards": 1,
+    "refresh_interval": "1s",
+}
+
+# Explicit mapping for the Device model. Exact-match fields are keywords so tenant/site filters
+# and aggregations run on doc-values instead of `.keyword` sub-fields of dynamically mapped text.
+DEVICE_INDEX_MAPPINGS = {
+    "dynamic": False,
+    "properties": {
+        "tenantId": {"type": "keyword"},
+        "siteId": {"type": "keyword"},
+        "name": {"type": "text", "fields": {"keyword": {"type": "keyword", "ignore_above": 256}}},
+        "type": {"type": "keyword"},
+        "ipAddress": {"type": "ip"},
+        "platform": {"type": "keyword"},
+        "status": {"type": "keyword"},
+        "createdAt": {"type": "date"},
+        "updatedAt": {"type": "date"},
+    }
+}
+
+def versioned_index_name(alias: str, version: int = DEVICE_INDEX_MAPPING_VERSION) -> str:
+    return f"{alias}_v{version}"
+
+def put_device_index_template(es: Elasticsearch, alias: str):
+    """Installs (or updates) the index template applied to every `<alias>_v*` index."""
+    es.indices.put_index_template(
+        name=f"{alias}-template",
+        index_patterns=[f"{alias}_v*"],
+        priority=100,
+        template={"settings": DEVICE_INDEX_SETTINGS, "mappings": DEVICE_INDEX_MAPPINGS},
+        meta={"mapping_version": DEVICE_INDEX_MAPPING_VERSION},
+    )
+
+def _create_versioned_index(es: Elasticsearch, index_name: str, aliases: dict = None) -> bool:
+    """Creates `index_name` from the template. Returns False if it already exists."""
+    try:
+        es.indices.create(index=index_name, aliases=aliases or {})
+        return True
+    except BadRequestError as e:
+        if getattr(e, 'error', None) == 'resource_already_exists_exception':
+            logger.info(f"Index {index_name} already exists.")
+            return False
+        raise
+
+def _block_writes(es: Elasticsearch, index: str, blocked: bool):
+    es.indices.put_settings(index=index, settings={"index.blocks.write": blocked})
+
+def _alias_points_at(es: Elasticsearch, alias: str, index_name: str) -> bool:
+    return es.indices.exists_alias(name=alias) and index_name in es.indices.get_alias(name=alias).keys()
+
+def _running_reindex_task(es: Elasticsearch, dest_index: str):
+    """Returns the id of a reindex task currently copying into `dest_index`, or None."""
+    res = es.tasks.list(actions="*reindex", detailed=True)
+    for node in res.get("nodes", {}).values():
+        for task_id, task in node.get("tasks", {}).items():
+            if f"to [{dest_index}]" in task.get("description", ""):
+                return task_id
+    return None
+
+def _reindex(es: Elasticsearch, source_index: str, dest_index: str):
+    logger.info(f"Reindexing devices from {source_index} into {dest_index}...")
+    # Reindexing a large inventory can outlive the client's default request timeout.
+    res = es.options(request_timeout=3600).reindex(
+        source={"index": source_index},
+        dest={"index": dest_index},
+        wait_for_completion=True,
+        refresh=True,
+    )
+    if res.get('failures'):
+        raise RuntimeError(f"Reindex from {source_index} into {dest_index} reported failures: {res['failures'][:5]}")
+    logger.info(f"Reindexed {res.get('total', 0)} devices from {source_index} into {dest_index}.")
+
+def _migrate(es: Elasticsearch, alias: str, target_index: str, swap_actions: list):
+    """
+    Copies everything behind `alias` into `target_index` and applies `swap_actions` to point `alias` at it.
+
+    The source is write-blocked for the copy, so devices created, updated or deleted meanwhile fail loudly instead
+    of being lost. If `target_index` already exists, another worker is migrating or one died part-way: a running
+    reindex into it is waited for, and a migration nobody finished is redone from the (still blocked) source.
+    """
+    if not _create_versioned_index(es, target_index):
+        task_id = _running_reindex_task(es, target_index)
+        if task_id:
+            logger.info(f"Waiting for reindex task {task_id} into {target_index} started by another worker...")
+            es.options(request_timeout=3600).tasks.get(task_id=task_id, wait_for_completion=True, timeout="1h")
+            deadline = time.monotonic() + ALIAS_SWAP_GRACE_SECONDS
+            while time.monotonic() < deadline:
+                if _alias_points_at(es, alias, target_index):
+                    return
+                time.sleep(1)
+        if _alias_points_at(es, alias, target_index):
+            return
+        logger.warning(f"Index {target_index} exists but alias {alias} was never moved to it; resuming the migration.")
+
+    _block_writes(es, alias, True)
+    try:
+        _reindex(es, alias, target_index)
+    except Exception:
+        _block_writes(es, alias, False)
+        raise
+    try:
+        es.indices.update_aliases(actions=swap_actions)
+    except (BadRequestError, NotFoundError):
+        # A worker resuming the same migration may have swapped first
+        if not _alias_points_at(es, alias, target_index):
+            raise
+        logger.info(f"Alias {alias} was already moved to {target_index} by another worker.")
+
+def bootstrap_device_index(es: Elasticsearch, alias: str, migrate_legacy: bool = True) -> str:
+    """
+    Makes sure `alias` points at the current versioned device index and returns that index name.
+
+    - Fresh deployment: creates `<alias>_v<N>` with `alias` attached.
+    - Alias on an older version: creates the new version, reindexes and atomically moves the alias.
+      The previous generation is left in place, write-blocked, for rollback.
+    - Legacy deployment where `alias` is a concrete, dynamically mapped index: reindexes it into
+      `<alias>_v<N>` and, in the same alias update, deletes it so the name can become an alias.
+    """
+    put_device_index_template(es, alias)
+    target_index = versioned_index_name(alias)
+
+    if es.indices.exists_alias(name=alias):
+        current_indices = list(es.indices.get_alias(name=alias).keys())
+        if target_index in current_indices:
+            logger.info(f"Device index alias {alias} already points at {target_index}.")
+            return target_index
+        actions = [{"remove": {"index": index, "alias": alias}} for index in current_indices]
+        actions.append({"add": {"index": target_index, "alias": alias}})
+        _migrate(es, alias, target_index, actions)
+        logger.info(f"Moved device index alias {alias} from {current_indices} to {target_index}.")
+        return target_index
+
+    if es.indices.exists(index=alias):
+        if not migrate_legacy:
+            logger.warning(
+                f"Device index {alias} is a legacy concrete index with dynamic mapping and automatic migration "
+                f"is disabled. Filters on keyword fields will not match until it is migrated to {target_index}."
+            )
+            return alias
+        _migrate(es, alias, target_index, [
+            {"add": {"index": target_index, "alias": alias}},
+            {"remove_index": {"index": alias}},
+        ])
+        logger.info(f"Migrated legacy device index {alias} to {target_index} behind alias {alias}.")
+        return target_index
+
+    _create_versioned_index(es, target_index, aliases={alias: {}})
+    logger.info(f"Created device index {target_index} with alias {alias}.")
+    return target_index
@@ -1,74 +1,314 @@
-from elasticsearch import Elasticsearch, NotFoundError, ConflictError
-from elasticsearch.helpers import scan
+from elasticsearch import NotFoundError, ConflictError
+from elasticsearch.helpers import scan, streaming_bulk
 from flask import current_app
 from pydantic import ValidationError
+import base64
+import itertools
+import json
+import logging
+import queue
+import threading
 import uuid
 from datetime import datetime
-from typing import Optional
+from typing import Optional, Any, Callable, Iterator, Iterable, NamedTuple, Tuple
 
 from ..models.device_model import Device, DeviceCreate, DeviceUpdate
+from .elasticsearch_client import get_es_client
+from .device_cache import get_device_cache
+
+# Fields GET /devices may be sorted by, mapped to their sortable (doc-values) field in the index.
+SORTABLE_DEVICE_FIELDS = {
+    "name": "name.keyword",
+    "type": "type",
+    "platform": "platform",
+    "status": "status",
+    "ipAddress": "ipAddress",
+    "siteId": "siteId",
+    "createdAt": "createdAt",
+    "updatedAt": "updatedAt",
+}
+DEFAULT_DEVICE_SORT = "name"
+
+# Export reader threads run outside the app context, so they log through a module logger.
+logger = logging.getLogger(__name__)
+_EXPORT_SLICE_DONE = object()
+
+# Painless scripts that perform the tenant ownership check inside the write itself.
+_TENANT_SCOPED_UPDATE_SCRIPT = (
+    "if (ctx._source.tenantId != params.tenantId) { ctx.op = 'noop'; } "
+    "else { ctx._source.putAll(params.doc); }"
+)
+_TENANT_SCOPED_DELETE_SCRIPT = (
+    "if (ctx._source.tenantId != params.tenantId) { ctx.op = 'noop'; } "
+    "else { ctx.op = 'delete'; }"
+)
+
+# Called after devices are created, updated or deleted, with [(device_id, document or None if deleted)].
+# The PyATS testbed manager registers here so diagnosis tools see device changes straight away.
+_device_change_listeners: list[Callable[[list[Tuple[str, Optional[dict]]]], None]] = []
+
+def add_device_change_listener(listener: Callable[[list[Tuple[str, Optional[dict]]]], None]):
+    if listener not in _device_change_listeners:
+        _device_change_listeners.append(listener)
+
+class InvalidETagError(ValueError):
+    """Raised when an If-Match value is not an ETag issued by this service."""
+
+class DeviceVersionConflictError(Exception):
+    """Raised when a conditional write (If-Match) finds that the device has changed since it was read."""
+
+class DeviceRecord(NamedTuple):
+    """A device together with the Elasticsearch version it was read or written at."""
+    device: Device
+    seq_no: int
+    primary_term: int
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.seq_no}-{self.primary_term}"'
+
+def parse_device_etag(etag: str) -> Tuple[int, int]:
+    """Parses an ETag produced by DeviceRecord.etag back into (seq_no, primary_term)."""
+    value = etag.strip()
+    if value.startswith('W/'):
+        value = value[2:]
+    try:
+        seq_no, primary_term = value.strip('"').split('-')
+        return int(seq_no), int(primary_term)
+    except ValueError:
+        raise InvalidETagError(f"Malformed ETag: {etag}")
+
+class InvalidPaginationError(ValueError):
+    """Raised when a sort or cursor is invalid, expired, or does not match the request."""
 
 class DeviceService:
     def __init__(self):
-        self.es = Elasticsearch(current_app.config['ELASTICSEARCH_HOST'])
+        self.es = get_es_client() # Shared, pooled client; constructing a DeviceService is cheap
+        # Alias of the versioned device index. It is created once at startup by
+        # bootstrap_device_index() (see device_index.py), not checked per request.
         self.index_name = current_app.config.get('ELASTICSEARCH_DEVICES_INDEX', 'devices_index')
-        self._ensure_index_exists()
-
-    def _ensure_index_exists(self):
-        """Ensures the Elasticsearch index exists, creating it if necessary."""
-        if not self.es.indices.exists(index=self.index_name):
-            # You might want a more specific mapping based on your Device model
-            # For dynamic mapping, ES will infer types, but explicit mapping is better for production.
-            # Example explicit mapping (simplified):
-            # mapping = {
-            #     "mappings": {
-            #         "properties": {
-            #             "tenantId": {"type": "keyword"},
-            #             "name": {"type": "text"},
-            #             "type": {"type": "keyword"},
-            #             "ipAddress": {"type": "ip"},
-            #             "platform": {"type": "keyword"},
-            #             "status": {"type": "keyword"},
-            #             "createdAt": {"type": "date"},
-            #             "updatedAt": {"type": "date"},
-            #             "siteId": {"type": "keyword"}
-            #         }
-            #     }
-            # }
-            # self.es.indices.create(index=self.index_name, body=mapping)
-            self.es.indices.create(index=self.index_name) # Simple creation with dynamic mapping
-            current_app.logger.info(f"Created Elasticsearch index: {self.index_name}")
+        # Read-through cache for single-device reads; None when disabled. Writes below invalidate it.
+        self.cache = get_device_cache()
+
+    def _invalidate_cached(self, device_id: str, tenant_id: str):
+        if self.cache is not None:
+            self.cache.invalidate(tenant_id, device_id)
+
+    @staticmethod
+    def _notify_device_changes(changes: list[Tuple[str, Optional[dict]]]):
+        # The write already succeeded; a failing listener is logged, not reported to the client.
+        for listener in _device_change_listeners:
+            try:
+                listener(changes)
+            except Exception as e:
+                logger.error(f"Device change listener {listener} failed: {e}", exc_info=True)
+
+    @staticmethod
+    def _device_filter_query(tenant_id: str, site_id: Optional[str] = None) -> dict:
+        """Builds the tenant (and optional site) filter shared by the listing queries."""
+        filters = [{"term": {"tenantId": tenant_id}}] # keyword field, filtered on doc-values
+        if site_id:
+            filters.append({"term": {"siteId": site_id}})
+        return {"bool": {"filter": filters}}
+
+    @staticmethod
+    def _hit_to_device(hit: dict) -> Optional[Device]:
+        try:
+            device_data = hit['_source']
+            # ES stores document id in _id, our Pydantic model expects it as 'id'
+            device_data['id'] = hit['_id'] 
+            return Device(**device_data)
+        except ValidationError as e:
+            current_app.logger.error(f"Validation error for device {hit['_id']}: {e}")
+        except Exception as e:
+            current_app.logger.error(f"Error processing device {hit['_id']}: {e}")
+        return None
 
     def get_all_devices(self, tenant_id: str, site_id: Optional[str] = None) -> list[Device]:
         """Retrieves all devices, optionally filtered by tenant_id and site_id."""
-        query_body = {
-            "query": {
-                "bool": {
-                    "filter": [
-                        {"term": {"tenantId.keyword": tenant_id}} # Use .keyword for exact match on text fields if dynamically mapped
-                    ]
-                }
-            }
-        }
-        if site_id:
-            query_body["query"]["bool"]["filter"].append({"term": {"siteId.keyword": site_id}})
+        query_body = {"query": self._device_filter_query(tenant_id, site_id)}
 
         devices = []
         # Using scan helper for potentially large number of documents
         for hit in scan(self.es, index=self.index_name, query=query_body):
+            device = self._hit_to_device(hit)
+            if device:
+                devices.append(device)
+        return devices
+
+    @staticmethod
+    def _parse_sort(sort: str) -> list[dict]:
+        """Turns 'name,-updatedAt' into ES sort clauses. A leading '-' sorts descending."""
+        clauses = []
+        for field in sort.split(','):
+            field = field.strip()
+            if not field:
+                continue
+            order = "desc" if field.startswith('-') else "asc"
+            field = field.lstrip('-+')
+            if field not in SORTABLE_DEVICE_FIELDS:
+                raise InvalidPaginationError(f"Cannot sort by '{field}'. Sortable fields: {', '.join(SORTABLE_DEVICE_FIELDS)}")
+            clauses.append({SORTABLE_DEVICE_FIELDS[field]: {"order": order}})
+        # With a point-in-time, _shard_doc is a cheap, unique tiebreaker that keeps search_after stable.
+        clauses.append({"_shard_doc": "asc"})
+        return clauses
+
+    @staticmethod
+    def _encode_cursor(state: dict) -> str:
+        return base64.urlsafe_b64encode(json.dumps(state, separators=(',', ':')).encode()).decode()
+
+    @staticmethod
+    def _decode_cursor(cursor: str) -> dict:
+        try:
+            state = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (ValueError, TypeError) as e:
+            raise InvalidPaginationError(f"Malformed cursor: {e}")
+        if not isinstance(state, dict) or not {"pit", "after", "sort", "tenant"} <= state.keys():
+            raise InvalidPaginationError("Malformed cursor.")
+        return state
+
+    def get_devices_page(self, tenant_id: str, site_id: Optional[str] = None, limit: int = 100,
+                         cursor: Optional[str] = None, sort: Optional[str] = None,
+                         include_total: bool = False) -> dict[str, Any]:
+        """
+        Retrieves one page of devices using a point-in-time and search_after.
+
+        The first call (no cursor) opens a point-in-time so later pages see a consistent snapshot.
+        Returns {"items": [Device], "next_cursor": str or None, "total": int or None}; next_cursor is None
+        on the last page, at which point the point-in-time is closed.
+        """
+        keep_alive = current_app.config.get('DEVICE_LIST_PIT_KEEP_ALIVE', '2m')
+        search_after = None
+        if cursor:
+            state = self._decode_cursor(cursor)
+            if state["tenant"] != tenant_id or state.get("site") != site_id:
+                raise InvalidPaginationError("Cursor does not belong to this tenant/site filter.")
+            if sort and sort != state["sort"]:
+                raise InvalidPaginationError("Sort cannot change while paging with a cursor.")
+            pit_id, search_after, sort = state["pit"], state["after"], state["sort"]
+        else:
+            sort = sort or DEFAULT_DEVICE_SORT
+            self._parse_sort(sort) # Validate before opening a point-in-time
+            pit_id = self.es.open_point_in_time(index=self.index_name, keep_alive=keep_alive)['id']
+
+        search_kwargs = {
+            "pit": {"id": pit_id, "keep_alive": keep_alive},
+            "query": self._device_filter_query(tenant_id, site_id),
+            "sort": self._parse_sort(sort),
+            "size": limit + 1, # One extra hit tells us whether another page exists
+            "track_total_hits": include_total,
+        }
+        if search_after is not None:
+            search_kwargs["search_after"] = search_after
+        try:
+            res = self.es.search(**search_kwargs)
+        except NotFoundError:
+            raise InvalidPaginationError("Cursor has expired; restart paging without a cursor.")
+
+        pit_id = res.get('pit_id', pit_id)
+        hits = res['hits']['hits']
+        page_hits = hits[:limit]
+        items = [device for device in (self._hit_to_device(hit) for hit in page_hits) if device]
+
+        next_cursor = None
+        if len(hits) > limit:
+            next_cursor = self._encode_cursor({
+                "pit": pit_id,
+                "after": page_hits[-1]['sort'],
+                "sort": sort,
+                "tenant": tenant_id,
+                "site": site_id,
+            })
+        else:
             try:
-                device_data = hit['_source']
-                # ES stores document id in _id, our Pydantic model expects it as 'id'
-                device_data['id'] = hit['_id'] 
-                devices.append(Device(**device_data))
-            except ValidationError as e:
-                current_app.logger.error(f"Validation error for device {hit['_id']}: {e}")
+                self.es.close_point_in_time(id=pit_id)
             except Exception as e:
-                current_app.logger.error(f"Error processing device {hit['_id']}: {e}")
-        return devices
+                current_app.logger.warning(f"Failed to close point-in-time after last device page: {e}")
+
+        total = res['hits']['total']['value'] if include_total else None
+        return {"items": items, "next_cursor": next_cursor, "total": total}
+
+    def export_devices(self, tenant_id: str, site_id: Optional[str] = None,
+                       fields: Optional[list[str]] = None) -> Iterator[dict]:
+        """
+        Streams every device for the tenant as plain dicts ({"id": ..., <_source fields>}), without
+        building the full list. Reads run as a sliced scroll, one thread per slice, feeding a bounded
+        queue so memory stays at a few batches no matter how large the inventory is.
+        """
+        slices = max(1, current_app.config.get('DEVICE_EXPORT_SLICES', 4))
+        batch_size = current_app.config.get('DEVICE_EXPORT_BATCH_SIZE', 1000)
+        keep_alive = current_app.config.get('DEVICE_EXPORT_SCROLL_KEEP_ALIVE', '2m')
+        query = self._device_filter_query(tenant_id, site_id)
+        return self._iter_sliced_scroll(query, fields, slices, batch_size, keep_alive)
+
+    def _iter_sliced_scroll(self, query: dict, fields: Optional[list[str]], slices: int,
+                            batch_size: int, keep_alive: str) -> Iterator[dict]:
+        es, index_name = self.es, self.index_name
+        batches: queue.Queue = queue.Queue(maxsize=slices * 2) # Backpressure: readers wait for the consumer
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=1)
+                    return
+                except queue.Full:
+                    continue
+
+        def read_slice(slice_id: int):
+            scroll_id = None
+            try:
+                search_kwargs = {
+                    "index": index_name,
+                    "query": query,
+                    "scroll": keep_alive,
+                    "size": batch_size,
+                    "sort": ["_doc"], # Cheapest scroll order
+                    "source": fields if fields else True,
+                }
+                if slices > 1:
+                    search_kwargs["slice"] = {"id": slice_id, "max": slices}
+                res = es.search(**search_kwargs)
+                scroll_id = res.get('_scroll_id')
+                while not stop.is_set() and res['hits']['hits']:
+                    put(res['hits']['hits'])
+                    res = es.scroll(scroll_id=scroll_id, scroll=keep_alive)
+                    scroll_id = res.get('_scroll_id', scroll_id)
+            except Exception as e:
+                logger.error(f"Device export slice {slice_id} failed: {e}")
+                put(e)
+            finally:
+                if scroll_id:
+                    try:
+                        es.clear_scroll(scroll_id=scroll_id)
+                    except Exception as e:
+                        logger.warning(f"Failed to clear export scroll for slice {slice_id}: {e}")
+                put(_EXPORT_SLICE_DONE)
+
+        for slice_id in range(slices):
+            threading.Thread(target=read_slice, args=(slice_id,), name=f"device-export-{slice_id}", daemon=True).start()
 
-    def get_device_by_id(self, device_id: str, tenant_id: str) -> Optional[Device]:
-        """Retrieves a single device by its ID, ensuring it belongs to the tenant."""
+        try:
+            finished = 0
+            while finished < slices:
+                item = batches.get()
+                if item is _EXPORT_SLICE_DONE:
+                    finished += 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    for hit in item:
+                        yield {"id": hit['_id'], **hit.get('_source', {})}
+        finally:
+            stop.set() # Also reached when the client disconnects and the generator is closed
+
+    def get_device_record(self, device_id: str, tenant_id: str) -> Optional[DeviceRecord]:
+        """Retrieves a single device and its version by ID, ensuring it belongs to the tenant."""
+        if self.cache is not None:
+            cached = self.cache.get(tenant_id, device_id)
+            if cached is not None:
+                return cached
+            fill_token = self.cache.fill_token() # Taken before the read so a concurrent write voids this fill
         try:
             res = self.es.get(index=self.index_name, id=device_id)
             device_data = res['_source']
@@ -78,13 +318,21 @@ class DeviceService:
                 current_app.logger.warning(f"Attempt to access device {device_id} by incorrect tenant {tenant_id}")
                 return None # Or raise an authorization error
 
-            return Device(**device_data)
+            record = DeviceRecord(Device(**device_data), res['_seq_no'], res['_primary_term'])
+            if self.cache is not None:
+                self.cache.put(tenant_id, device_id, record, token=fill_token)
+            return record
         except NotFoundError:
             return None
         except ValidationError as e:
             current_app.logger.error(f"Validation error for device {device_id}: {e}")
             return None
 
+    def get_device_by_id(self, device_id: str, tenant_id: str) -> Optional[Device]:
+        """Retrieves a single device by its ID, ensuring it belongs to the tenant."""
+        record = self.get_device_record(device_id, tenant_id)
+        return record.device if record else None
+
     def create_device(self, device_data: DeviceCreate, tenant_id: str) -> Optional[Device]:
         """Creates a new device."""
         # Ensure the tenantId in the data matches the one from auth context (if different)
@@ -109,10 +357,12 @@ class DeviceService:
 
         try:
             self.es.create(index=self.index_name, id=new_device_id, document=doc)
+            self._invalidate_cached(new_device_id, tenant_id)
             # Fetch the created document to return it with all fields (like generated ID and timestamps)
             # This is good practice, though self.es.create doesn't return the doc by default
             created_doc_data = doc.copy()
             created_doc_data['id'] = new_device_id
+            self._notify_device_changes([(new_device_id, doc)])
             return Device(**created_doc_data)
         except ConflictError:
             current_app.logger.error(f"Conflict error: Device with ID {new_device_id} already exists.")
@@ -126,30 +376,125 @@ class DeviceService:
             current_app.logger.error(f"Error creating device in Elasticsearch: {e}")
             return None
 
-    def update_device(self, device_id: str, device_update_data: DeviceUpdate, tenant_id: str) -> Optional[Device]:
-        """Updates an existing device."""
-        # First, verify the device exists and belongs to the tenant
-        existing_device = self.get_device_by_id(device_id, tenant_id)
-        if not existing_device:
-            return None # Not found or not authorized for this tenant
+    def bulk_create_devices(self, items: Iterable[Any], tenant_id: str, chunk_size: Optional[int] = None,
+                            refresh: Optional[str] = None) -> dict[str, Any]:
+        """
+        Creates many devices with the bulk API. `items` is any iterable of raw device dicts (an Exception in
+        its place marks an item that could not be decoded). Items are validated against DeviceCreate one chunk
+        at a time and written with streaming_bulk, so an invalid or rejected item only fails itself.
+
+        Returns {"created": int, "failed": int, "errors": bool, "items": [...]} where each item result has
+        the input position, an HTTP-like status, and either the new device id or an error.
+        """
+        chunk_size = chunk_size or current_app.config.get('DEVICE_BULK_CHUNK_SIZE', 500)
+        refresh = refresh or current_app.config.get('DEVICE_BULK_REFRESH', 'false')
+        results: list[dict[str, Any]] = []
+        created = 0
+
+        positions = itertools.count()
+        items_iter = iter(items)
+        while True:
+            batch = list(itertools.islice(items_iter, chunk_size))
+            if not batch:
+                break
+
+            actions = []
+            action_positions = []
+            now = datetime.utcnow()
+            for item in batch:
+                position = next(positions)
+                if isinstance(item, Exception):
+                    results.append({"index": position, "status": 400, "error": str(item)})
+                    continue
+                if not isinstance(item, dict):
+                    results.append({"index": position, "status": 400, "error": "Item must be a JSON object"})
+                    continue
+                try:
+                    device_data = DeviceCreate(**{"tenantId": tenant_id, **item})
+                except ValidationError as e:
+                    results.append({"index": position, "status": 400, "error": "Invalid device data", "details": e.errors()})
+                    continue
+
+                doc = device_data.dict()
+                doc['createdAt'] = now
+                doc['updatedAt'] = now
+                doc['tenantId'] = tenant_id # Same policy as create_device: the auth context wins
+                actions.append({"_op_type": "create", "_index": self.index_name, "_id": str(uuid.uuid4()), "_source": doc})
+                action_positions.append(position)
+                results.append(None) # Filled in from the bulk response below
 
+            if not actions:
+                continue
+
+            # streaming_bulk yields one (ok, info) per action, in action order.
+            bulk_results = streaming_bulk(
+                self.es, actions, chunk_size=chunk_size, refresh=refresh,
+                raise_on_error=False, raise_on_exception=False
+            )
+            created_docs = []
+            for position, action, (ok, info) in zip(action_positions, actions, bulk_results):
+                op_result = info.get('create', info)
+                if ok:
+                    created += 1
+                    created_docs.append((action["_id"], action["_source"]))
+                    results[position] = {"index": position, "status": op_result.get('status', 201), "id": action["_id"]}
+                else:
+                    error = op_result.get('error', op_result)
+                    current_app.logger.error(f"Bulk create failed for item {position}: {error}")
+                    results[position] = {"index": position, "status": op_result.get('status', 500), "error": error}
+            if created_docs:
+                self._notify_device_changes(created_docs)
+
+        failed = len(results) - created
+        return {"created": created, "failed": failed, "errors": failed > 0, "items": results}
+
+    def update_device_record(self, device_id: str, device_update_data: DeviceUpdate, tenant_id: str,
+                             if_match: Optional[str] = None) -> Optional[DeviceRecord]:
+        """
+        Updates an existing device in a single request and returns its new state and version.
+        The tenant check runs inside the scripted update, so a device of another tenant is left untouched.
+        With `if_match` (an ETag from a previous read), the write only succeeds if the device has not changed
+        since; otherwise DeviceVersionConflictError is raised.
+        """
         update_payload = device_update_data.dict(exclude_unset=True) # Only include fields that were set
         if not update_payload:
             # No actual changes provided
-            return existing_device 
+            return self.get_device_record(device_id, tenant_id)
 
-        update_payload['updatedAt'] = datetime.utcnow()
+        update_payload['updatedAt'] = datetime.utcnow().isoformat()
+
+        update_kwargs = {
+            "index": self.index_name,
+            "id": device_id,
+            "script": {
+                "source": _TENANT_SCOPED_UPDATE_SCRIPT,
+                "lang": "painless",
+                "params": {"tenantId": tenant_id, "doc": update_payload},
+            },
+            "source": True, # Return the updated _source instead of re-reading it
+        }
+        if if_match is not None:
+            update_kwargs["if_seq_no"], update_kwargs["if_primary_term"] = parse_device_etag(if_match)
+        else:
+            update_kwargs["retry_on_conflict"] = 3
 
         try:
-            self.es.update(index=self.index_name, id=device_id, doc=update_payload)
-            # Fetch the updated document to return the complete and current state
-            updated_res = self.es.get(index=self.index_name, id=device_id)
-            updated_doc_data = updated_res['_source']
-            updated_doc_data['id'] = updated_res['_id']
-            return Device(**updated_doc_data)
-        except NotFoundError: # Should be caught by initial get_device_by_id
-            current_app.logger.warning(f"Device {device_id} not found during update attempt, though pre-check passed.")
+            res = self.es.update(**update_kwargs)
+            if res.get('result') == 'noop':
+                current_app.logger.warning(f"Attempt to update device {device_id} by incorrect tenant {tenant_id}")
+                return None
+            self._invalidate_cached(device_id, tenant_id)
+            updated_doc_data = res['get']['_source']
+            self._notify_device_changes([(device_id, dict(updated_doc_data))])
+            updated_doc_data['id'] = res['_id']
+            return DeviceRecord(Device(**updated_doc_data), res['_seq_no'], res['_primary_term'])
+        except NotFoundError:
             return None
+        except ConflictError:
+            if if_match is None:
+                current_app.logger.error(f"Device {device_id} kept changing concurrently; update gave up after retries.")
+                return None
+            raise DeviceVersionConflictError(f"Device {device_id} was modified since version {if_match}.")
         except ValidationError as e:
             current_app.logger.error(f"Validation error updating device {device_id}: {e}")
             return None
@@ -157,18 +502,47 @@ class DeviceService:
             current_app.logger.error(f"Error updating device {device_id} in Elasticsearch: {e}")
             return None
 
-    def delete_device(self, device_id: str, tenant_id: str) -> bool:
-        """Deletes a device. Returns True if successful, False otherwise."""
-        # Verify the device belongs to the tenant before deleting
-        existing_device = self.get_device_by_id(device_id, tenant_id)
-        if not existing_device:
-            return False # Not found or not authorized
-        
+    def update_device(self, device_id: str, device_update_data: DeviceUpdate, tenant_id: str) -> Optional[Device]:
+        """Updates an existing device."""
+        record = self.update_device_record(device_id, device_update_data, tenant_id)
+        return record.device if record else None
+
+    def delete_device(self, device_id: str, tenant_id: str, if_match: Optional[str] = None) -> bool:
+        """
+        Deletes a device in a single request. Returns True if successful, False if it does not exist or
+        belongs to another tenant. Raises DeviceVersionConflictError if `if_match` no longer matches.
+        """
+        # A scripted update can delete (ctx.op = 'delete'), which lets the tenant check run inside the write.
+        # Unlike delete_by_query it is realtime, so a device created a moment ago can be deleted straight away.
+        delete_kwargs = {
+            "index": self.index_name,
+            "id": device_id,
+            "script": {
+                "source": _TENANT_SCOPED_DELETE_SCRIPT,
+                "lang": "painless",
+                "params": {"tenantId": tenant_id},
+            },
+        }
+        if if_match is not None:
+            delete_kwargs["if_seq_no"], delete_kwargs["if_primary_term"] = parse_device_etag(if_match)
+        else:
+            delete_kwargs["retry_on_conflict"] = 3
+
         try:
-            self.es.delete(index=self.index_name, id=device_id)
+            res = self.es.update(**delete_kwargs)
+            if res.get('result') != 'deleted':
+                current_app.logger.warning(f"Attempt to delete device {device_id} by incorrect tenant {tenant_id}")
+                return False
+            self._invalidate_cached(device_id, tenant_id)
+            self._notify_device_changes([(device_id, None)])
             return True
         except NotFoundError:
             return False # Already deleted or never existed
+        except ConflictError:
+            if if_match is None:
+                current_app.logger.error(f"Device {device_id} kept changing concurrently; delete gave up after retries.")
+                return False
+            raise DeviceVersionConflictError(f"Device {device_id} was modified since version {if_match}.")
         except Exception as e:
             current_app.logger.error(f"Error deleting device {device_id} from Elasticsearch: {e}")
-            return False 
\ No newline at end of file
+            return False
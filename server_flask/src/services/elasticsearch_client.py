@@ -0,0 +1,42 @@
+from elasticsearch import Elasticsearch
+from flask import current_app
+import logging
+
+logger = logging.getLogger(__name__)
+
+EXTENSION_KEY = 'elasticsearch'
+
+def create_es_client(config) -> Elasticsearch:
+    """Builds an Elasticsearch client with pooled connections, timeouts, retries and sniffing from app config."""
+    sniff_on_start = config.get('ELASTICSEARCH_SNIFF_ON_START', False)
+    sniff_on_node_failure = config.get('ELASTICSEARCH_SNIFF_ON_NODE_FAILURE', False)
+    client_kwargs = {
+        "connections_per_node": config.get('ELASTICSEARCH_CONNECTIONS_PER_NODE', 10),
+        "request_timeout": config.get('ELASTICSEARCH_REQUEST_TIMEOUT', 10),
+        "max_retries": config.get('ELASTICSEARCH_MAX_RETRIES', 3),
+        "retry_on_timeout": config.get('ELASTICSEARCH_RETRY_ON_TIMEOUT', True),
+        "sniff_on_start": sniff_on_start,
+        "sniff_on_node_failure": sniff_on_node_failure,
+    }
+    if sniff_on_start or sniff_on_node_failure:
+        # Only meaningful with sniffing enabled; the client rejects it otherwise.
+        client_kwargs["min_delay_between_sniffing"] = config.get('ELASTICSEARCH_MIN_DELAY_BETWEEN_SNIFFING', 60)
+    return Elasticsearch(config['ELASTICSEARCH_HOST'], **client_kwargs)
+
+def init_es_client(app):
+    """Creates the process-wide Elasticsearch client and stores it on app.extensions."""
+    client = create_es_client(app.config)
+    app.extensions[EXTENSION_KEY] = client
+    logger.info(
+        f"Shared Elasticsearch client initialized for {app.config['ELASTICSEARCH_HOST']} "
+        f"(connections_per_node={app.config.get('ELASTICSEARCH_CONNECTIONS_PER_NODE', 10)}, "
+        f"request_timeout={app.config.get('ELASTICSEARCH_REQUEST_TIMEOUT', 10)}s)."
+    )
+    return client
+
+def get_es_client() -> Elasticsearch:
+    """Returns the shared Elasticsearch client for the current app, creating it on first use if needed."""
+    client = current_app.extensions.get(EXTENSION_KEY)
+    if client is None:
+        client = init_es_client(current_app._get_current_object())
+    return client
@@ -0,0 +1,302 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from elasticsearch import Elasticsearch, helpers
+from flask import current_app
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from .metrics_index import build_health_documents, metrics_index_name, put_metrics_index_template
+from ..brain_agent.testbed_manager import get_testbed
+from ..brain_agent.tools import _pyats_check_device_cpu_memory, _pyats_collect_interface_counters
+
+logger = logging.getLogger(__name__)
+
+EXTENSION_KEY = 'health_sweep'
+# Device names per device-index lookup of site/tenant labels
+LABEL_LOOKUP_CHUNK = 1000
+
+
+class SweepLease:
+    """
+    Leader lease in a local SQLite file, so only one of the workers on a host runs the sweep. The holder renews
+    it around every sweep; if the holder dies, another worker takes over once the lease has been idle for `ttl`.
+    """
+
+    def __init__(self, path: str, ttl: float, name: str = "health-sweep"):
+        self.path = path
+        self.ttl = ttl
+        self.name = name
+        self.holder = f"{os.uname().nodename}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, holder TEXT NOT NULL, expires_at REAL NOT NULL)")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def acquire(self) -> bool:
+        """Takes or renews the lease. Returns True if this process holds it."""
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT holder, expires_at FROM leases WHERE name = ?", (self.name,)).fetchone()
+            held = row is None or row[0] == self.holder or row[1] < now
+            if held:
+                conn.execute("INSERT OR REPLACE INTO leases (name, holder, expires_at) VALUES (?, ?, ?)",
+                             (self.name, self.holder, now + self.ttl))
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        return held
+
+    def release(self):
+        self._connection().execute("DELETE FROM leases WHERE name = ? AND holder = ?", (self.name, self.holder))
+
+
+class HealthSweep:
+    """
+    Background fleet health collection. Every `interval` seconds (plus or minus up to `jitter`, so several
+    deployments or restarts do not settle into lock-step), samples every device in the PyATS testbed through the
+    same helpers the agent tools use: CPU/memory, then per-interface counters. At most `max_workers` devices are
+    polled at once, in a shuffled order. Samples are normalized (metrics_index.build_health_documents), tagged
+    with the device's site and tenant from the device index and bulk-written to the daily metrics indices,
+    `batch_size` documents per request. A sweep that outlasts the interval delays the next one; sweeps never overlap.
+    With a `lease`, every worker process runs the scheduler but only the lease holder sweeps.
+    """
+
+    def __init__(self, app, es: Elasticsearch, index_prefix: str, devices_index: Optional[str],
+                 interval: float = 300, jitter: float = 30, max_workers: int = 8,
+                 collect_interfaces: bool = True, batch_size: int = 500, lease: Optional[SweepLease] = None):
+        self.app = app
+        self.es = es
+        self.index_prefix = index_prefix
+        self.devices_index = devices_index
+        self.interval = interval
+        self.jitter = jitter
+        self.max_workers = max(1, max_workers)
+        self.collect_interfaces = collect_interfaces
+        self.batch_size = batch_size
+        self.lease = lease
+        self._leader = lease is None
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="health-sweep")
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_sweep: Optional[Dict[str, Any]] = None
+        self._stats = {"sweeps": 0, "indexed": 0, "index_errors": 0}
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="health-sweep-scheduler", daemon=True)
+            self._thread.start()
+
+    def shutdown(self):
+        self._stop.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if self.lease is not None and self._leader:
+            try:
+                self.lease.release()
+            except sqlite3.Error as e:
+                logger.warning(f"Could not release the health sweep lease: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, "interval_s": self.interval, "leader": self._leader, "last_sweep": self._last_sweep}
+
+    def _hold_lease(self) -> bool:
+        if self.lease is None:
+            return True
+        try:
+            leader = self.lease.acquire()
+        except sqlite3.Error as e:
+            # Sweeping without knowing who else does would only duplicate samples
+            logger.warning(f"Could not check the health sweep lease: {e}")
+            leader = False
+        if leader != self._leader:
+            logger.info(f"Health sweep: this worker {'is now' if leader else 'is no longer'} the sweeper.")
+            self._leader = leader
+        return leader
+
+    def _loop(self):
+        with self.app.app_context():
+            delay = random.uniform(0, self.jitter) # Don't start every worker's first sweep at the same moment
+            while not self._stop.wait(delay):
+                started = time.monotonic()
+                if self._hold_lease():
+                    try:
+                        self.run_once()
+                    except Exception as e:
+                        logger.error(f"Health sweep failed: {e}", exc_info=True)
+                    self._hold_lease() # Renew after a long sweep too, so the lease never lapses mid-cycle
+                delay = max(0.0, self.interval + random.uniform(-self.jitter, self.jitter) - (time.monotonic() - started))
+
+    # --- One sweep ---
+
+    def run_once(self) -> Dict[str, Any]:
+        """Samples every testbed device once and indexes the results. Returns the sweep summary."""
+        testbed = get_testbed()
+        if testbed is None:
+            logger.warning("Health sweep skipped: no PyATS testbed is loaded.")
+            return {}
+        devices: List[Tuple[str, Optional[str]]] = [(d.name, d.os) for d in list(testbed.devices.values())]
+        random.shuffle(devices)
+        labels = self._device_labels([name for name, _ in devices])
+        started_at = datetime.now(timezone.utc)
+        sweep_id = f"{started_at:%Y%m%dT%H%M%SZ}-{uuid.uuid4().hex[:8]}"
+        started = time.monotonic()
+
+        futures = [self._executor.submit(self._sample_device, sweep_id, name, device_os, labels.get(name, {}))
+                   for name, device_os in devices]
+        summary = {"sweep_id": sweep_id, "devices": len(devices), "ok": 0, "errors": 0, "documents": 0}
+        batch: List[Dict[str, Any]] = []
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+            try:
+                docs = future.result()
+            except Exception as e:
+                summary["errors"] += 1
+                logger.error(f"Health sweep: sampling a device failed: {e}", exc_info=True)
+                continue
+            summary["ok" if docs[0]["status"] == "ok" else "errors"] += 1
+            summary["documents"] += len(docs)
+            batch.extend(docs)
+            if len(batch) >= self.batch_size:
+                self._bulk_index(batch)
+                batch = []
+        if batch:
+            self._bulk_index(batch)
+
+        summary["duration_s"] = round(time.monotonic() - started, 1)
+        summary["finished_at"] = datetime.now(timezone.utc).isoformat()
+        self._stats["sweeps"] += 1
+        self._last_sweep = summary
+        logger.info(f"Health sweep {sweep_id}: {summary['ok']}/{summary['devices']} device(s) sampled, "
+                    f"{summary['errors']} error(s), {summary['documents']} document(s) in {summary['duration_s']}s.")
+        return summary
+
+    def _sample_device(self, sweep_id: str, device_name: str, device_os: Optional[str], labels: Dict[str, Any]) -> List[Dict[str, Any]]:
+        # Pool threads do not inherit the scheduler's app context; the session pool, parse cache and config caches
+        # the helpers use are app singletons and would otherwise be built from default settings
+        with self.app.app_context():
+            return self._sample_device_in_context(sweep_id, device_name, device_os, labels)
+
+    def _sample_device_in_context(self, sweep_id: str, device_name: str, device_os: Optional[str], labels: Dict[str, Any]) -> List[Dict[str, Any]]:
+        started = time.monotonic()
+        timestamp = datetime.now(timezone.utc).isoformat()
+        # Always run the commands: a fleet's worth of results would only evict the tools' cached parses
+        health = _pyats_check_device_cpu_memory(device_name, use_cache=False)
+        data = health.get("data") or {}
+        error = None
+        if health["status"] != "success":
+            error = health["output"]
+        elif not data:
+            error = f"No Genie parser for the CPU/memory commands on {device_os}."
+
+        interfaces = None
+        if self.collect_interfaces and health["status"] == "success":
+            # Skipped for unreachable devices, which would only time out a second time
+            counters = _pyats_collect_interface_counters(device_name, use_cache=False)
+            if counters["status"] == "success":
+                interfaces = counters["data"]["interfaces"]
+            else:
+                logger.debug(f"Health sweep: no interface counters from {device_name}: {counters['output'][:200]}")
+
+        base = {
+            "@timestamp": timestamp,
+            "sweep_id": sweep_id,
+            "device": device_name,
+            "device_os": device_os,
+            "site_id": labels.get("siteId"),
+            "tenant_id": labels.get("tenantId"),
+            "collect_ms": int((time.monotonic() - started) * 1000),
+        }
+        return build_health_documents(base, data.get("cpu"), data.get("memory"), interfaces, error=error)
+
+    def _device_labels(self, device_names: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Site and tenant per device name from the device index; missing labels only make samples less filterable."""
+        labels: Dict[str, Dict[str, Any]] = {}
+        if not self.devices_index:
+            return labels
+        try:
+            for i in range(0, len(device_names), LABEL_LOOKUP_CHUNK):
+                chunk = device_names[i:i + LABEL_LOOKUP_CHUNK]
+                res = self.es.search(
+                    index=self.devices_index,
+                    query={"terms": {"name.keyword": chunk}},
+                    source=["name", "siteId", "tenantId"],
+                    collapse={"field": "name.keyword"}, # one hit per name: its most recently updated document
+                    sort=[{"updatedAt": {"order": "desc", "unmapped_type": "date"}}],
+                    size=len(chunk),
+                )
+                for hit in res["hits"]["hits"]:
+                    labels[hit["_source"]["name"]] = hit["_source"]
+        except Exception as e:
+            logger.warning(f"Health sweep: could not look up device sites in {self.devices_index}: {e}")
+        return labels
+
+    def _bulk_index(self, batch: List[Dict[str, Any]]):
+        actions = (
+            {"_index": metrics_index_name(self.index_prefix, datetime.fromisoformat(doc["@timestamp"])), "_source": doc}
+            for doc in batch
+        )
+        try:
+            indexed, errors = helpers.bulk(self.es, actions, raise_on_error=False, stats_only=True)
+        except Exception as e:
+            self._stats["index_errors"] += len(batch)
+            logger.error(f"Bulk write of {len(batch)} health sample(s) failed: {e}")
+            return
+        self._stats["indexed"] += indexed
+        self._stats["index_errors"] += errors
+
+
+def init_health_sweep(app, es: Elasticsearch) -> Optional[HealthSweep]:
+    """Creates and starts the health sweep if enabled, and stores it on app.extensions."""
+    if not app.config.get('HEALTH_SWEEP_ENABLED', False):
+        logger.info("Health sweep disabled (HEALTH_SWEEP_ENABLED=false).")
+        return None
+    prefix = app.config.get('HEALTH_METRICS_INDEX_PREFIX', 'device-health')
+    try:
+        put_metrics_index_template(es, prefix)
+    except Exception as e:
+        # The template is only needed before the first daily index is created; the next start will retry
+        logger.warning(f"Could not install the {prefix} metrics index template: {e}")
+    interval = app.config.get('HEALTH_SWEEP_INTERVAL_SECONDS', 300)
+    jitter = app.config.get('HEALTH_SWEEP_JITTER_SECONDS', 30)
+    lease = None
+    if app.config.get('HEALTH_SWEEP_LEASE_DB_PATH'):
+        # Renewed at least every interval + jitter, plus a sweep's duration; two cycles leave room for both
+        lease = SweepLease(app.config['HEALTH_SWEEP_LEASE_DB_PATH'], ttl=2 * (interval + jitter))
+    sweep = HealthSweep(
+        app, es, prefix,
+        devices_index=app.config.get('ELASTICSEARCH_DEVICES_INDEX'),
+        interval=interval,
+        jitter=jitter,
+        max_workers=app.config.get('HEALTH_SWEEP_WORKERS', 8),
+        collect_interfaces=app.config.get('HEALTH_SWEEP_COLLECT_INTERFACES', True),
+        batch_size=app.config.get('HEALTH_SWEEP_BATCH_SIZE', 500),
+        lease=lease,
+    )
+    app.extensions[EXTENSION_KEY] = sweep
+    sweep.start()
+    logger.info(f"Health sweep started (every {sweep.interval}s +/- {sweep.jitter}s, {sweep.max_workers} workers, index {prefix}-*, "
+                f"{'leader lease ' + lease.path if lease else 'no leader lease'}).")
+    return sweep
+
+def get_health_sweep() -> Optional[HealthSweep]:
+    """Returns the current app's health sweep, or None if it is disabled or failed to start."""
+    return current_app.extensions.get(EXTENSION_KEY)
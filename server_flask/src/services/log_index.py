@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta, timezone
+from elasticsearch import Elasticsearch
+import ipaddress
+import logging
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Syslog documents go to one index per UTC day, `<prefix>-YYYY.MM.DD`, so retention is a matter of
+# deleting old indices and searches over a time range only touch the days they need.
+SYSLOG_INDEX_SETTINGS = {
+    "number_of_shards": 1,
+    "refresh_interval": "5s",
+}
+
+SYSLOG_INDEX_MAPPINGS = {
+    "dynamic": False,
+    "properties": {
+        "@timestamp": {"type": "date"},
+        "received_at": {"type": "date"},
+        "device_time": {"type": "date"},
+        "time_source": {"type": "keyword"},
+        "host": {"type": "keyword"},
+        "source_ip": {"type": "ip"},
+        "facility": {"type": "byte"},
+        "severity": {"type": "byte"},
+        "severity_label": {"type": "keyword"},
+        "app_name": {"type": "keyword"},
+        "procid": {"type": "keyword"},
+        "msgid": {"type": "keyword"},
+        "mnemonic": {"type": "keyword"},
+        "sequence": {"type": "long"},
+        "format": {"type": "keyword"},
+        "message": {"type": "text"},
+        "structured_data": {"type": "text", "index": False},
+        "raw": {"type": "text", "index": False},
+    }
+}
+
+def syslog_index_name(prefix: str, timestamp: datetime) -> str:
+    return f"{prefix}-{timestamp.astimezone(timezone.utc):%Y.%m.%d}"
+
+def syslog_index_pattern(prefix: str) -> str:
+    return f"{prefix}-*"
+
+def put_syslog_index_template(es: Elasticsearch, prefix: str):
+    """Installs (or updates) the index template applied to every daily syslog index."""
+    es.indices.put_index_template(
+        name=f"{prefix}-template",
+        index_patterns=[syslog_index_pattern(prefix)],
+        priority=100,
+        template={"settings": SYSLOG_INDEX_SETTINGS, "mappings": SYSLOG_INDEX_MAPPINGS},
+    )
+
+def search_syslog(es: Elasticsearch, prefix: str, query: Optional[str] = None, hosts: Optional[List[str]] = None,
+                  max_severity: Optional[int] = None, since_minutes: int = 60, size: int = 50) -> Dict[str, Any]:
+    """
+    Searches the daily syslog indices. `query` is matched against the message (and mnemonic), `hosts` against the
+    host or source IP, and `max_severity` keeps messages at or above that urgency (0 = emergency ... 7 = debug).
+    Returns {"total": int, "hits": [documents, newest first]}.
+    """
+    since = datetime.now(timezone.utc) - timedelta(minutes=since_minutes)
+    filters: List[Dict[str, Any]] = [{"range": {"@timestamp": {"gte": since.isoformat()}}}]
+    if hosts:
+        filters.append({"bool": {"should": [
+            {"terms": {"host": hosts}},
+            *[{"term": {"source_ip": h}} for h in hosts if _looks_like_ip(h)],
+        ], "minimum_should_match": 1}})
+    if max_severity is not None:
+        filters.append({"range": {"severity": {"lte": max_severity}}})
+    must: List[Dict[str, Any]] = []
+    if query:
+        must.append({"multi_match": {"query": query, "fields": ["message", "mnemonic^2"], "operator": "and"}})
+
+    res = es.search(
+        index=syslog_index_pattern(prefix),
+        query={"bool": {"filter": filters, "must": must}},
+        sort=[{"@timestamp": {"order": "desc"}}],
+        size=size,
+        track_total_hits=10000,
+        source_excludes=["raw"],
+        ignore_unavailable=True,
+        allow_no_indices=True,
+    )
+    return {
+        "total": res["hits"]["total"]["value"],
+        "hits": [hit["_source"] for hit in res["hits"]["hits"]],
+    }
+
+def _looks_like_ip(value: str) -> bool:
+    try:
+        ipaddress.ip_address(value)
+        return True
+    except ValueError:
+        return False
@@ -0,0 +1,439 @@
+"""
+Fleet-wide baselines and anomaly detection over device metrics in Elasticsearch.
+
+Each series (one per device, or per device interface) is scored by its most extreme z-score over the recent window
+against a baseline of the window before it. For the default 'zscore' method Elasticsearch reduces the baseline window
+to a mean and standard deviation per series itself, so only the recent buckets come back, as a dense
+(series x time bucket) NumPy matrix with NaN where a bucket has no sample. 'ewma' needs every bucket of both windows.
+Counters become per-second rates; everything after the fetch is whole-matrix array arithmetic, and only the EWMA
+walks the (few) time columns, each step vectorized across all series.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from elasticsearch import Elasticsearch, ApiError
+import logging
+import math
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from .metrics_index import metrics_index_pattern
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THRESHOLD = 3.0
+# Buckets returned by one partition request; stays under Elasticsearch's default search.max_buckets (65536)
+MAX_BUCKETS_PER_REQUEST = 50000
+MAX_FETCH_WORKERS = 8
+METHODS = ("zscore", "ewma")
+BASELINE_STATS = ("count", "avg", "std_deviation")
+# Per-bucket counter difference to per-second rate; resets and wraps (negative differences) leave a gap
+COUNTER_RATE_SCRIPT = "params.delta >= 0 ? params.delta / params.seconds : null"
+
+
+class MetricSpec(NamedTuple):
+    field: str
+    level: str # 'device' or 'interface'
+    counter: bool = False # Cumulative counter, analyzed as a per-second rate
+    scale: float = 1.0 # Applied to the value (or rate), e.g. 8 for octets -> bits
+    upward_only: bool = True # Only increases are anomalies (errors, CPU); otherwise drops count too
+    min_std: float = 0.0 # Floors under the baseline deviation, so near-constant series do not flag tiny changes
+    rel_std: float = 0.0 # ... as a fraction of the baseline mean
+
+
+class SeriesSource(NamedTuple):
+    """Where a family of metrics lives and how its documents are keyed."""
+    index: str
+    time_field: str
+    device_field: str
+    interface_field: str
+    site_field: Optional[str] # None if documents carry no site; sites are then resolved to devices elsewhere
+    metrics: Dict[str, MetricSpec]
+    level_filters: Dict[str, List[Dict[str, Any]]] # Extra filters per level, e.g. the health index's 'kind'
+    bucket_seconds: int # Default bucket, about the collection interval
+
+
+def health_metrics_source(prefix: str, bucket_seconds: int = 300) -> SeriesSource:
+    """The sweep's metrics indices (see health_sweep.py); the bucket should match the sweep interval."""
+    return SeriesSource(
+        index=metrics_index_pattern(prefix),
+        time_field="@timestamp",
+        device_field="device",
+        interface_field="interface",
+        site_field="site_id",
+        metrics={
+            "cpu_pct": MetricSpec("cpu_pct", "device", min_std=2.0),
+            "memory_used_pct": MetricSpec("memory_used_pct", "device", min_std=1.0),
+            "in_util_pct": MetricSpec("in_util_pct", "interface", upward_only=False, min_std=2.0),
+            "out_util_pct": MetricSpec("out_util_pct", "interface", upward_only=False, min_std=2.0),
+            "in_errors": MetricSpec("in_errors", "interface", counter=True, min_std=0.01),
+            "in_crc_errors": MetricSpec("in_crc_errors", "interface", counter=True, min_std=0.01),
+            "in_discards": MetricSpec("in_discards", "interface", counter=True, min_std=0.01),
+            "out_errors": MetricSpec("out_errors", "interface", counter=True, min_std=0.01),
+            "out_discards": MetricSpec("out_discards", "interface", counter=True, min_std=0.01),
+        },
+        level_filters={"device": [{"term": {"kind": "device"}}], "interface": [{"term": {"kind": "interface"}}]},
+        bucket_seconds=bucket_seconds,
+    )
+
+# --- !!! IMPORTANT: Adjust these to match the schema of your otel_snmp_data_index !!! ---
+# Assumed: one document per device interface per poll, with raw IF-MIB counters and the device's CPU load.
+SNMP_INDEX = "otel_snmp_data_index"
+SNMP_SOURCE = SeriesSource(
+    index=SNMP_INDEX,
+    time_field="@timestamp",
+    device_field="device_hostname",
+    interface_field="interface_name",
+    site_field=None,
+    metrics={
+        "cpu_pct": MetricSpec("cpu_utilization", "device", min_std=2.0),
+        "in_bps": MetricSpec("if_in_octets", "interface", counter=True, scale=8, upward_only=False, rel_std=0.1),
+        "out_bps": MetricSpec("if_out_octets", "interface", counter=True, scale=8, upward_only=False, rel_std=0.1),
+        "in_errors": MetricSpec("if_in_errors", "interface", counter=True, min_std=0.01),
+        "out_errors": MetricSpec("if_out_errors", "interface", counter=True, min_std=0.01),
+        "in_discards": MetricSpec("if_in_discards", "interface", counter=True, min_std=0.01),
+        "out_discards": MetricSpec("if_out_discards", "interface", counter=True, min_std=0.01),
+    },
+    level_filters={"device": [{"exists": {"field": "cpu_utilization"}}], "interface": []},
+    bucket_seconds=60,
+)
+
+
+class SeriesMatrix(NamedTuple):
+    keys: List[Tuple[Optional[str], ...]] # (device, interface or None, site or None) per row
+    start_ms: int # Start of column 0
+    bucket_ms: int
+    values: Dict[str, np.ndarray] # metric -> (series x buckets) float64, NaN where there was no sample
+    # metric -> (mean, std) per series over the baseline range, per-second rates for counters; NaN where the
+    # baseline has fewer than min_periods samples. Empty when no baseline range was requested.
+    baselines: Dict[str, Tuple[np.ndarray, np.ndarray]]
+
+
+# --- Fetching ---
+
+def fetch_series(es: Elasticsearch, source: SeriesSource, level: str, metrics: List[str], start_ms: int, end_ms: int,
+                 bucket_seconds: int, site_id: Optional[str] = None, device_names: Optional[List[str]] = None,
+                 baseline_range: Optional[Tuple[int, int]] = None, min_periods: int = 1) -> SeriesMatrix:
+    """
+    Pulls every series of one level over [start_ms, end_ms) as a dense matrix per metric: per-bucket max for
+    counters, average otherwise. With `baseline_range` (start, end in epoch ms), Elasticsearch also reduces that
+    range to a mean and standard deviation per series (see _baseline_aggs), so its buckets never leave the cluster.
+    The device terms are split into partitions sized to stay under the bucket limit and fetched in parallel;
+    responses are trimmed to keys and values.
+    """
+    bucket_ms = bucket_seconds * 1000
+    start_ms -= start_ms % bucket_ms
+    n_buckets = max(1, math.ceil((end_ms - start_ms) / bucket_ms))
+    query_start_ms = min(start_ms, baseline_range[0]) if baseline_range else start_ms
+    filters = [_time_range(source, query_start_ms, end_ms)]
+    filters += source.level_filters.get(level, [])
+    if site_id and source.site_field:
+        filters.append({"term": {source.site_field: site_id}})
+    if device_names:
+        filters.append({"terms": {source.device_field: device_names}})
+    query = {"bool": {"filter": filters}}
+
+    res = es.search(index=source.index, query=query, size=0, track_total_hits=True,
+                    aggs={"devices": {"cardinality": {"field": source.device_field}}},
+                    ignore_unavailable=True, allow_no_indices=True)
+    total_docs = res["hits"]["total"]["value"]
+    device_count = int(res.get("aggregations", {}).get("devices", {}).get("value") or 0)
+    empty = SeriesMatrix([], start_ms, bucket_ms, {m: np.empty((0, n_buckets)) for m in metrics},
+                         {m: (np.empty(0), np.empty(0)) for m in metrics} if baseline_range else {})
+    if not total_docs or not device_count:
+        return empty
+
+    # Sources are sampled about once per bucket, so documents per bucket estimate the number of series. Each
+    # series returns up to n_buckets buckets, and counters with a baseline build one histogram bucket per
+    # baseline bucket on the server. A partition that still exceeds the limit is split (fetch_partition).
+    series_estimate = max(device_count, math.ceil(total_docs / max(1, math.ceil((end_ms - query_start_ms) / bucket_ms))))
+    buckets_per_series = 2 + n_buckets
+    if baseline_range and any(source.metrics[m].counter for m in metrics):
+        buckets_per_series += math.ceil((baseline_range[1] - baseline_range[0]) / bucket_ms) + 1
+    partitions = max(1, math.ceil(series_estimate * buckets_per_series / MAX_BUCKETS_PER_REQUEST))
+
+    # Aggregations are named by position rather than metric: the names repeat in every bucket of the response
+    names = {m: f"m{i}" for i, m in enumerate(metrics)}
+    metric_aggs = {
+        names[m]: {("max" if source.metrics[m].counter else "avg"): {"field": source.metrics[m].field}} for m in metrics
+    }
+    series_aggs: Dict[str, Any] = {"recent": {
+        "filter": _time_range(source, start_ms, end_ms),
+        "aggs": {"t": {"date_histogram": {"field": source.time_field, "fixed_interval": f"{bucket_seconds}s",
+                                          "min_doc_count": 1},
+                       "aggs": metric_aggs}},
+    }}
+    if baseline_range:
+        series_aggs["baseline"] = {"filter": _time_range(source, *baseline_range),
+                                   "aggs": _baseline_aggs(source, names, bucket_seconds)}
+    device_aggs: Dict[str, Any] = {}
+    if level == "interface":
+        device_aggs["interfaces"] = {"terms": {"field": source.interface_field, "size": 10000}, "aggs": series_aggs}
+        series_path = "aggregations.devices.buckets.interfaces.buckets"
+    else:
+        device_aggs.update(series_aggs)
+        series_path = "aggregations.devices.buckets"
+    if source.site_field:
+        device_aggs["site"] = {"terms": {"field": source.site_field, "size": 1}}
+    filter_path = ["aggregations.devices.buckets.key", "aggregations.devices.buckets.site.buckets.key",
+                   f"{series_path}.key", f"{series_path}.recent.t.buckets.key"]
+    filter_path += [f"{series_path}.recent.t.buckets.{name}.value" for name in names.values()]
+    if baseline_range:
+        filter_path += [f"{series_path}.baseline.{name}.{stat}" for name in names.values() for stat in BASELINE_STATS]
+
+    def fetch_partition(partition: int, num_partitions: int) -> List[Dict[str, Any]]:
+        per_partition = math.ceil(device_count / num_partitions) * 2 + 10 # cardinality is approximate
+        try:
+            res = es.search(
+                index=source.index, query=query, size=0,
+                aggs={"devices": {
+                    "terms": {"field": source.device_field, "size": per_partition,
+                              "include": {"partition": partition, "num_partitions": num_partitions}},
+                    "aggs": device_aggs,
+                }},
+                filter_path=filter_path,
+                ignore_unavailable=True, allow_no_indices=True,
+            )
+        except ApiError as e:
+            if "too_many_buckets" not in str(e) or num_partitions >= 4 * device_count:
+                raise
+            # Terms partition p of n holds exactly the devices of partitions p and p + n of 2n
+            logger.info(f"Series partition {partition}/{num_partitions} exceeds the bucket limit; splitting it in two.")
+            return (fetch_partition(partition, 2 * num_partitions)
+                    + fetch_partition(partition + num_partitions, 2 * num_partitions))
+        return res.get("aggregations", {}).get("devices", {}).get("buckets", [])
+
+    with ThreadPoolExecutor(max_workers=min(partitions, MAX_FETCH_WORKERS)) as pool:
+        responses = list(pool.map(lambda partition: fetch_partition(partition, partitions), range(partitions)))
+
+    keys: List[Tuple[Optional[str], ...]] = []
+    rows: List[int] = []
+    cols: List[int] = []
+    cells: List[List[Optional[float]]] = [] # one row of metric values per (series, time bucket)
+    stats: Dict[str, List[Optional[float]]] = {f"{m}.{stat}": [] for m in metrics for stat in BASELINE_STATS}
+    agg_names = [names[m] for m in metrics]
+    empty_agg: Dict[str, Any] = {}
+    for device_buckets in responses:
+        for device_bucket in device_buckets:
+            site_buckets = device_bucket.get("site", {}).get("buckets", [])
+            site = site_buckets[0]["key"] if site_buckets else site_id
+            if level == "interface":
+                series = [((device_bucket["key"], b["key"], site), b) for b in device_bucket.get("interfaces", {}).get("buckets", [])]
+            else:
+                series = [((device_bucket["key"], None, site), device_bucket)]
+            for key, series_bucket in series:
+                row = len(keys)
+                keys.append(key)
+                for time_bucket in series_bucket.get("recent", {}).get("t", {}).get("buckets", []):
+                    rows.append(row)
+                    cols.append((time_bucket["key"] - start_ms) // bucket_ms)
+                    cells.append([time_bucket.get(name, empty_agg).get("value") for name in agg_names])
+                if baseline_range:
+                    baseline = series_bucket.get("baseline", {})
+                    for m in metrics:
+                        metric_stats = baseline.get(names[m], {})
+                        for stat in BASELINE_STATS:
+                            stats[f"{m}.{stat}"].append(metric_stats.get(stat))
+
+    row_index, col_index = np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)
+    in_range = (col_index >= 0) & (col_index < n_buckets)
+    # None (no value in the bucket) becomes NaN
+    cell_values = np.asarray(cells, dtype=np.float64).reshape(len(cells), len(metrics))[in_range]
+    values, baselines = {}, {}
+    for i, m in enumerate(metrics):
+        matrix = np.full((len(keys), n_buckets), np.nan)
+        matrix[row_index[in_range], col_index[in_range]] = cell_values[:, i]
+        values[m] = matrix
+        if baseline_range:
+            count, mean, std = (np.asarray(stats[f"{m}.{stat}"], dtype=np.float64) for stat in BASELINE_STATS)
+            enough = np.nan_to_num(count) >= min_periods
+            baselines[m] = (np.where(enough, mean, np.nan), np.where(enough, std, np.nan))
+    return SeriesMatrix(keys, start_ms, bucket_ms, values, baselines)
+
+def _time_range(source: SeriesSource, start_ms: int, end_ms: int) -> Dict[str, Any]:
+    return {"range": {source.time_field: {"gte": start_ms, "lt": end_ms, "format": "epoch_millis"}}}
+
+def _baseline_aggs(source: SeriesSource, names: Dict[str, str], bucket_seconds: int) -> Dict[str, Any]:
+    """
+    Mean and standard deviation of each metric over the baseline range, computed by Elasticsearch and named
+    by `names` (metric -> aggregation name). Gauges use
+    extended_stats over their samples. Counters need per-bucket rates first: the per-bucket max, its difference to
+    the previous bucket (an empty bucket leaves a gap rather than a difference across it), resets dropped and
+    divided by the bucket length, then extended_stats_bucket over those rates.
+    """
+    aggs: Dict[str, Any] = {}
+    rate_aggs: Dict[str, Any] = {}
+    for m, name in names.items():
+        spec = source.metrics[m]
+        if not spec.counter:
+            aggs[name] = {"extended_stats": {"field": spec.field}}
+            continue
+        rate_aggs[f"{name}_max"] = {"max": {"field": spec.field}}
+        rate_aggs[f"{name}_delta"] = {"derivative": {"buckets_path": f"{name}_max"}}
+        rate_aggs[f"{name}_rate"] = {"bucket_script": {
+            "buckets_path": {"delta": f"{name}_delta"},
+            "script": {"source": COUNTER_RATE_SCRIPT, "params": {"seconds": bucket_seconds}},
+        }}
+        aggs[name] = {"extended_stats_bucket": {"buckets_path": f"rates>{name}_rate"}}
+    if rate_aggs:
+        # derivative requires a histogram without skipped buckets
+        aggs["rates"] = {"date_histogram": {"field": source.time_field, "fixed_interval": f"{bucket_seconds}s",
+                                            "min_doc_count": 0},
+                         "aggs": rate_aggs}
+    return aggs
+
+def device_names_at_site(es: Elasticsearch, devices_index: str, site_id: str, limit: int = 10000) -> List[str]:
+    """Device names of a site from the device index, for sources whose documents carry no site."""
+    res = es.search(
+        index=devices_index,
+        query={"term": {"siteId": site_id}},
+        source=["name"],
+        collapse={"field": "name.keyword"},
+        size=limit,
+    )
+    return [hit["_source"]["name"] for hit in res["hits"]["hits"] if hit["_source"].get("name")]
+
+# --- Array operations ---
+
+def counter_rates(values: np.ndarray, bucket_seconds: float) -> np.ndarray:
+    """Per-second rates between adjacent buckets; the first column, gaps and counter resets/wraps are NaN."""
+    rates = np.full(values.shape, np.nan)
+    if values.shape[1] > 1:
+        delta = np.diff(values, axis=1)
+        delta[delta < 0] = np.nan
+        rates[:, 1:] = delta / bucket_seconds
+    return rates
+
+def ewma_baseline(values: np.ndarray, span: int, min_periods: int, last: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Exponentially weighted mean and standard deviation (alpha = 2 / (span + 1)) of the buckets before each
+    bucket, for the last `last` buckets (all by default). Walks the buckets in order, each step across all series.
+    """
+    alpha = 2.0 / (span + 1)
+    n_series, n_buckets = values.shape
+    last = n_buckets if last is None else min(last, n_buckets)
+    by_time = np.ascontiguousarray(values.T) # One contiguous row per bucket
+    mean_out, std_out = np.full((last, n_series), np.nan), np.full((last, n_series), np.nan)
+    mean, variance, seen = np.zeros(n_series), np.zeros(n_series), np.zeros(n_series)
+    for t in range(n_buckets):
+        out = t - (n_buckets - last)
+        if out >= 0:
+            enough = seen >= min_periods
+            np.copyto(mean_out[out], mean, where=enough)
+            np.copyto(std_out[out], np.sqrt(variance), where=enough)
+        x = by_time[t]
+        valid = ~np.isnan(x)
+        first = valid & (seen == 0)
+        update = valid & ~first
+        delta = np.where(update, x - mean, 0.0)
+        np.copyto(mean, x, where=first)
+        mean += alpha * delta
+        variance = np.where(update, (1 - alpha) * (variance + alpha * delta * delta), variance)
+        seen += valid
+    return mean_out.T, std_out.T
+
+def score_series(values: np.ndarray, mean: np.ndarray, std: np.ndarray, spec: MetricSpec) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    z-scores of `values` against their baseline (same shape). Returns, per series, the most extreme z-score
+    (most positive when only increases count) and its column, with -inf/-1 for series without one.
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        floor = np.maximum(spec.min_std, spec.rel_std * np.abs(mean))
+        z = (values - mean) / np.maximum(std, floor)
+    extremity = z if spec.upward_only else np.abs(z)
+    extremity = np.where(np.isfinite(extremity), extremity, -np.inf)
+    best = np.argmax(extremity, axis=1)
+    rows = np.arange(len(z))
+    has_score = np.isfinite(extremity[rows, best])
+    return np.where(has_score, z[rows, best], -np.inf), np.where(has_score, best, -1)
+
+# --- Detection ---
+
+def find_anomalies(es: Elasticsearch, source: SeriesSource, metrics: Optional[List[str]] = None,
+                   since_minutes: int = 60, baseline_minutes: int = 180, bucket_seconds: Optional[int] = None,
+                   method: str = "zscore", threshold: float = DEFAULT_THRESHOLD, site_id: Optional[str] = None,
+                   device_names: Optional[List[str]] = None, limit: int = 50) -> Dict[str, Any]:
+    """
+    Scores every series of `metrics` (all of the source's by default) over the last `since_minutes` against a
+    baseline of the preceding `baseline_minutes` (its mean/std for 'zscore', decay span for 'ewma').
+    Returns {"series": n, "anomalies": [...most extreme first, at most `limit`], "timings_ms": {...}} where each
+    anomaly has device, interface, site, metric, value, baseline, z and the bucket time.
+    """
+    started_total = time.perf_counter()
+    if method not in METHODS:
+        raise ValueError(f"Unknown method '{method}'; expected one of {', '.join(METHODS)}")
+    metrics = metrics or list(source.metrics)
+    unknown = [m for m in metrics if m not in source.metrics]
+    if unknown:
+        raise ValueError(f"Unknown metric(s) {', '.join(unknown)}; expected some of {', '.join(source.metrics)}")
+    bucket_seconds = bucket_seconds or source.bucket_seconds
+    bucket_ms = bucket_seconds * 1000
+    recent_buckets = max(1, math.ceil(since_minutes * 60 / bucket_seconds))
+    window = max(2, math.ceil(baseline_minutes * 60 / bucket_seconds))
+    min_periods = max(3, window // 4)
+    end_ms = int(time.time() * 1000)
+    # The last recent bucket is the current, partial one. The baseline gets one extra bucket so counters have a rate
+    # for its first bucket, and so does the fetched window, whose first column only serves the first recent rate.
+    recent_start_ms = (end_ms // bucket_ms + 1 - recent_buckets) * bucket_ms
+    baseline_start_ms = recent_start_ms - (window + 1) * bucket_ms
+    if method == "ewma":
+        fetch_start_ms, baseline_range = baseline_start_ms, None
+    else:
+        fetch_start_ms, baseline_range = recent_start_ms - bucket_ms, (baseline_start_ms, recent_start_ms)
+
+    timings = {"fetch": 0.0, "analyze": 0.0}
+    anomalies: List[Dict[str, Any]] = []
+    series_count = 0
+    for level in ("device", "interface"):
+        level_metrics = [m for m in metrics if source.metrics[m].level == level]
+        if not level_metrics:
+            continue
+        started = time.perf_counter()
+        matrix = fetch_series(es, source, level, level_metrics, fetch_start_ms, end_ms, bucket_seconds,
+                              site_id=site_id, device_names=device_names, baseline_range=baseline_range,
+                              min_periods=min_periods)
+        timings["fetch"] += time.perf_counter() - started
+        started = time.perf_counter()
+        series_count += len(matrix.keys)
+        for metric in level_metrics:
+            spec = source.metrics[metric]
+            values = matrix.values[metric]
+            if spec.counter:
+                values = counter_rates(values, bucket_seconds)
+            recent = values[:, -recent_buckets:] * spec.scale
+            if method == "ewma":
+                mean, std = ewma_baseline(values * spec.scale, window, min_periods, last=recent_buckets)
+            else:
+                baseline_mean, baseline_std = matrix.baselines[metric]
+                mean = np.broadcast_to((baseline_mean * spec.scale)[:, None], recent.shape)
+                std = np.broadcast_to((baseline_std * spec.scale)[:, None], recent.shape)
+            best_z, best_column = score_series(recent, mean, std, spec)
+            deviation = best_z if spec.upward_only else np.abs(best_z)
+            flagged = np.nonzero(np.isfinite(best_z) & (deviation >= threshold))[0]
+            for row in flagged[np.argsort(-np.abs(best_z[flagged]))][:limit]:
+                column = best_column[row]
+                bucket = values.shape[1] - recent.shape[1] + column
+                device, interface, site = matrix.keys[row]
+                anomalies.append({
+                    "device": device,
+                    "interface": interface,
+                    "site": site,
+                    "metric": metric,
+                    "value": round(float(recent[row, column]), 3),
+                    "baseline": round(float(mean[row, column]), 3),
+                    "baseline_std": round(float(std[row, column]), 3),
+                    "z": round(float(best_z[row]), 1),
+                    "at": datetime.fromtimestamp((matrix.start_ms + int(bucket) * matrix.bucket_ms) / 1000, timezone.utc).isoformat(),
+                })
+        timings["analyze"] += time.perf_counter() - started
+
+    anomalies.sort(key=lambda a: -abs(a["z"]))
+    timings["total"] = time.perf_counter() - started_total
+    logger.info(f"Anomaly scan over {series_count} series: {len(anomalies)} anomalies in {timings['total'] * 1000:.0f} ms "
+                f"(fetch {timings['fetch'] * 1000:.0f} ms, analysis {timings['analyze'] * 1000:.0f} ms).")
+    return {
+        "series": series_count,
+        "anomalies": anomalies[:limit],
+        "timings_ms": {k: round(v * 1000) for k, v in timings.items()},
+    }
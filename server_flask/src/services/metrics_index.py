@@ -0,0 +1,203 @@
+from datetime import datetime, timedelta, timezone
+from elasticsearch import Elasticsearch
+import logging
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Device health samples from the background sweep go to one index per UTC day, `<prefix>-YYYY.MM.DD`, like syslog.
+# Each sweep writes one 'device' document per device (CPU/memory, or the collection error) and one 'interface'
+# document per interface. Values are flat numeric fields so they aggregate and sort without scripting.
+METRICS_INDEX_SETTINGS = {
+    "number_of_shards": 1,
+    "refresh_interval": "5s",
+}
+
+METRICS_INDEX_MAPPINGS = {
+    "dynamic": False,
+    "properties": {
+        "@timestamp": {"type": "date"},
+        "sweep_id": {"type": "keyword"},
+        "kind": {"type": "keyword"}, # 'device' or 'interface'
+        "device": {"type": "keyword"},
+        "device_os": {"type": "keyword"},
+        "site_id": {"type": "keyword"},
+        "tenant_id": {"type": "keyword"},
+        "status": {"type": "keyword"}, # 'ok' or 'error'
+        "error": {"type": "text", "index": False},
+        "collect_ms": {"type": "integer"},
+        # kind=device
+        "cpu_pct": {"type": "float"},
+        "cpu_5s_pct": {"type": "float"},
+        "cpu_1m_pct": {"type": "float"},
+        "cpu_5m_pct": {"type": "float"},
+        "memory_used_pct": {"type": "float"},
+        "memory_used_bytes": {"type": "long"},
+        "memory_total_bytes": {"type": "long"},
+        # kind=interface
+        "interface": {"type": "keyword"},
+        "oper_status": {"type": "keyword"},
+        "bandwidth_kbps": {"type": "long"},
+        "in_bps": {"type": "long"},
+        "out_bps": {"type": "long"},
+        "in_util_pct": {"type": "float"},
+        "out_util_pct": {"type": "float"},
+        "in_errors": {"type": "long"},
+        "in_crc_errors": {"type": "long"},
+        "in_discards": {"type": "long"},
+        "out_errors": {"type": "long"},
+        "out_discards": {"type": "long"},
+    }
+}
+
+DEVICE_METRICS = ("cpu_pct", "memory_used_pct")
+INTERFACE_METRICS = ("in_util_pct", "out_util_pct", "in_bps", "out_bps")
+MAX_ERROR_CHARS = 500
+
+def metrics_index_name(prefix: str, timestamp: datetime) -> str:
+    return f"{prefix}-{timestamp.astimezone(timezone.utc):%Y.%m.%d}"
+
+def metrics_index_pattern(prefix: str) -> str:
+    return f"{prefix}-*"
+
+def put_metrics_index_template(es: Elasticsearch, prefix: str):
+    """Installs (or updates) the index template applied to every daily metrics index."""
+    es.indices.put_index_template(
+        name=f"{prefix}-template",
+        index_patterns=[metrics_index_pattern(prefix)],
+        priority=100,
+        template={"settings": METRICS_INDEX_SETTINGS, "mappings": METRICS_INDEX_MAPPINGS},
+    )
+
+# --- Normalization ---
+
+def build_health_documents(base: Dict[str, Any], cpu: Optional[Dict[str, Any]], memory: Optional[Dict[str, Any]],
+                           interfaces: Optional[List[Dict[str, Any]]], error: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Turns the genie_parsing summaries of one device into metrics documents. `base` holds the fields shared by
+    all of them (@timestamp, sweep_id, device, device_os, site_id, tenant_id, collect_ms).
+    """
+    device_doc = {**base, "kind": "device", "status": "error" if error else "ok"}
+    if error:
+        device_doc["error"] = error[:MAX_ERROR_CHARS]
+    device_doc.update(_normalize_cpu(cpu or {}))
+    device_doc.update(_normalize_memory(memory or {}))
+    docs = [_drop_none(device_doc)]
+    for intf in interfaces or []:
+        if not intf.get("interface"):
+            continue
+        docs.append(_drop_none({
+            **base,
+            "kind": "interface",
+            "status": "ok",
+            "interface": intf["interface"],
+            "oper_status": intf.get("oper_status"),
+            "bandwidth_kbps": intf.get("bandwidth_kbps"),
+            "in_bps": intf.get("in_bps"),
+            "out_bps": intf.get("out_bps"),
+            "in_util_pct": intf.get("in_util_pct"),
+            "out_util_pct": intf.get("out_util_pct"),
+            "in_errors": intf.get("in_errors"),
+            "in_crc_errors": intf.get("in_crc_errors"),
+            "in_discards": intf.get("in_discards", intf.get("in_drops")),
+            "out_errors": intf.get("out_errors"),
+            "out_discards": intf.get("out_discards", intf.get("out_drops")),
+        }))
+    return docs
+
+def _normalize_cpu(cpu: Dict[str, Any]) -> Dict[str, Any]:
+    # cpu_pct is the one figure comparable across platforms: the 1-minute average where the OS reports one
+    return {
+        "cpu_pct": next((cpu[k] for k in ("cpu_pct", "cpu_1m_pct", "cpu_5s_pct") if cpu.get(k) is not None), None),
+        "cpu_5s_pct": cpu.get("cpu_5s_pct"),
+        "cpu_1m_pct": cpu.get("cpu_1m_pct"),
+        "cpu_5m_pct": cpu.get("cpu_5m_pct"),
+    }
+
+def _normalize_memory(memory: Dict[str, Any]) -> Dict[str, Any]:
+    pools = memory.get("pools")
+    if pools:
+        # IOS/IOS-XE: the processor pool is the one that runs out; sizes are in bytes
+        name = next((n for n in pools if n.lower() == "processor"), next(iter(pools)))
+        pool = pools[name]
+        return {"memory_used_pct": pool.get("used_pct"), "memory_used_bytes": pool.get("used"), "memory_total_bytes": pool.get("total")}
+    used_kb, total_kb = memory.get("memory_used_kb"), memory.get("memory_total_kb")
+    return {
+        "memory_used_pct": memory.get("memory_used_pct"),
+        "memory_used_bytes": used_kb * 1024 if used_kb is not None else None,
+        "memory_total_bytes": total_kb * 1024 if total_kb is not None else None,
+    }
+
+def _drop_none(doc: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in doc.items() if v is not None}
+
+# --- Reads ---
+
+def latest_device_health(es: Elasticsearch, prefix: str, device_names: List[str], max_age_minutes: int = 60,
+                         include_interfaces: bool = False) -> Dict[str, Dict[str, Any]]:
+    """
+    The most recent device sample per device (within `max_age_minutes`), keyed by device name. With
+    `include_interfaces`, each sample gets an 'interfaces' list from the same sweep.
+    """
+    since = datetime.now(timezone.utc) - timedelta(minutes=max_age_minutes)
+    res = es.search(
+        index=metrics_index_pattern(prefix),
+        query={"bool": {"filter": [
+            {"term": {"kind": "device"}},
+            {"terms": {"device": device_names}},
+            {"range": {"@timestamp": {"gte": since.isoformat()}}},
+        ]}},
+        collapse={"field": "device"},
+        sort=[{"@timestamp": {"order": "desc"}}],
+        size=len(device_names),
+        ignore_unavailable=True,
+        allow_no_indices=True,
+    )
+    latest = {hit["_source"]["device"]: hit["_source"] for hit in res["hits"]["hits"]}
+    if include_interfaces and latest:
+        res = es.search(
+            index=metrics_index_pattern(prefix),
+            query={"bool": {"filter": [
+                {"term": {"kind": "interface"}},
+                {"terms": {"sweep_id": sorted({doc["sweep_id"] for doc in latest.values()})}},
+                {"terms": {"device": list(latest)}},
+            ]}},
+            sort=[{"device": "asc"}, {"interface": "asc"}],
+            size=10000,
+            ignore_unavailable=True,
+            allow_no_indices=True,
+        )
+        for doc in latest.values():
+            doc["interfaces"] = []
+        for hit in res["hits"]["hits"]:
+            intf = hit["_source"]
+            if latest[intf["device"]]["sweep_id"] == intf["sweep_id"]:
+                latest[intf["device"]]["interfaces"].append(intf)
+    return latest
+
+def top_device_health(es: Elasticsearch, prefix: str, metric: str, site_id: Optional[str] = None,
+                      since_minutes: int = 15, size: int = 10) -> List[Dict[str, Any]]:
+    """
+    Devices with the highest `metric` in the last `since_minutes`, one sample per device (its worst).
+    Interface metrics return the worst interface of each device.
+    """
+    if metric not in DEVICE_METRICS + INTERFACE_METRICS:
+        raise ValueError(f"Unknown metric '{metric}'; expected one of {', '.join(DEVICE_METRICS + INTERFACE_METRICS)}")
+    since = datetime.now(timezone.utc) - timedelta(minutes=since_minutes)
+    filters: List[Dict[str, Any]] = [
+        {"term": {"kind": "device" if metric in DEVICE_METRICS else "interface"}},
+        {"range": {"@timestamp": {"gte": since.isoformat()}}},
+        {"exists": {"field": metric}},
+    ]
+    if site_id:
+        filters.append({"term": {"site_id": site_id}})
+    res = es.search(
+        index=metrics_index_pattern(prefix),
+        query={"bool": {"filter": filters}},
+        collapse={"field": "device"},
+        sort=[{metric: {"order": "desc"}}, {"@timestamp": {"order": "desc"}}],
+        size=size,
+        ignore_unavailable=True,
+        allow_no_indices=True,
+    )
+    return [hit["_source"] for hit in res["hits"]["hits"]]
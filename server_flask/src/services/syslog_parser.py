@@ -0,0 +1,145 @@
+from datetime import datetime, timedelta, timezone
+import re
+from typing import Any, Dict, Optional
+
+SEVERITY_LABELS = ["emergency", "alert", "critical", "error", "warning", "notice", "informational", "debug"]
+
+# A device clock further than this from the receive time is wrong (never set, or local time read as UTC);
+# its messages are timed by receipt instead so they land in the right daily index and time-range searches
+MAX_CLOCK_SKEW = timedelta(minutes=15)
+
+# <PRI>1 TIMESTAMP HOSTNAME APP-NAME PROCID MSGID STRUCTURED-DATA [MSG]
+_RFC5424_RE = re.compile(
+    r"^<(?P<pri>\d{1,3})>1 (?P<timestamp>\S+) (?P<host>\S+) (?P<app>\S+) (?P<procid>\S+) (?P<msgid>\S+) "
+    r"(?P<sd>-|(?:\[(?:[^\]\\]|\\.)*\])+) ?(?P<msg>.*)$",
+    re.DOTALL,
+)
+
+# <PRI>[seq: ][origin: ]Mmm dd [yyyy ]hh:mm:ss[.fff][ TZ][:] [HOST ]MSG, covering BSD syslog and the Cisco
+# variants (sequence numbers, 'logging origin-id', '*'/'.' clock-sync markers, milliseconds, timezone, no
+# hostname), plus the NX-OS 'yyyy Mmm dd hh:mm:ss' form.
+_RFC3164_RE = re.compile(
+    r"^<(?P<pri>\d{1,3})>(?:(?P<seq>\d+): )?(?:(?P<origin>[A-Za-z][A-Za-z0-9_.-]*): )?(?P<sync>[*.])?"
+    r"(?P<timestamp>(?:\d{4} )?[A-Z][a-z]{2} +\d{1,2}(?: \d{4})? \d{2}:\d{2}:\d{2}(?:\.\d+)?)(?: [A-Z]{2,5})?:? "
+    r"(?P<rest>.*)$",
+    re.DOTALL,
+)
+
+_PRI_ONLY_RE = re.compile(r"^<(?P<pri>\d{1,3})>(?P<rest>.*)$", re.DOTALL)
+
+# BSD tag: 'sshd[123]: ...' or 'app: ...'
+_TAG_RE = re.compile(r"^(?P<app>[A-Za-z0-9_./-]{1,48})(?:\[(?P<procid>[^\]]{1,32})\])?: (?P<msg>.*)$", re.DOTALL)
+
+# Cisco-style '%FACILITY-SEVERITY-MNEMONIC:' (IOS, NX-OS, ASA)
+_MNEMONIC_RE = re.compile(r"%(?P<mnemonic>[A-Z0-9_]+-(?:[A-Z0-9_]+-)?\d-[A-Z0-9_]+)")
+
+_HOST_TOKEN_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.:-]*$")
+
+
+def _nil(value: str) -> Optional[str]:
+    return None if value == "-" else value
+
+def _parse_3164_timestamp(value: str, now: datetime) -> Optional[datetime]:
+    value = " ".join(value.split()) # 'Mar  1' -> 'Mar 1'
+    for fmt in ("%b %d %Y %H:%M:%S.%f", "%b %d %Y %H:%M:%S", "%Y %b %d %H:%M:%S.%f", "%Y %b %d %H:%M:%S",
+                "%b %d %H:%M:%S.%f", "%b %d %H:%M:%S"):
+        try:
+            parsed = datetime.strptime(value if "%Y" in fmt else f"{value} {now.year}",
+                                       fmt if "%Y" in fmt else f"{fmt} %Y")
+        except ValueError:
+            continue
+        parsed = parsed.replace(tzinfo=timezone.utc) # BSD timestamps carry no zone; a device in local time shows up as skew
+        if parsed - now > timedelta(days=1): # A December message received in January
+            parsed = parsed.replace(year=parsed.year - 1)
+        return parsed
+    return None
+
+def _parse_5424_timestamp(value: str) -> Optional[datetime]:
+    if value == "-":
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def parse_syslog_message(data: str, source_ip: Optional[str] = None, received_at: Optional[datetime] = None) -> Dict[str, Any]:
+    """
+    Parses one RFC 5424 or RFC 3164 (BSD, including Cisco variants) syslog message into the log index document.
+    Messages that match neither are kept with format 'unknown' and the raw text as the message.
+
+    '@timestamp' is the device's time when it is trustworthy, else `received_at`: Cisco marks a clock that was never
+    synchronized with a leading '*', and any clock more than MAX_CLOCK_SKEW off is wrong too. The device's own time
+    is kept in 'device_time' either way, and 'time_source' says which one '@timestamp' is.
+    """
+    received_at = received_at or datetime.now(timezone.utc)
+    data = data.rstrip("\r\n\x00")
+    doc: Dict[str, Any] = {
+        "received_at": received_at.isoformat(),
+        "source_ip": source_ip,
+        "raw": data,
+    }
+    timestamp = None
+    clock_unsynced = False
+
+    match = _RFC5424_RE.match(data)
+    if match:
+        doc.update(
+            format="rfc5424",
+            host=_nil(match["host"]),
+            app_name=_nil(match["app"]),
+            procid=_nil(match["procid"]),
+            msgid=_nil(match["msgid"]),
+            message=match["msg"].lstrip("﻿"), # Strip the UTF-8 BOM allowed by RFC 5424
+        )
+        if match["sd"] != "-":
+            doc["structured_data"] = match["sd"]
+        pri = int(match["pri"])
+        timestamp = _parse_5424_timestamp(match["timestamp"])
+    else:
+        match = _RFC3164_RE.match(data)
+        if match:
+            doc["format"] = "rfc3164"
+            pri = int(match["pri"])
+            if match["seq"]:
+                doc["sequence"] = int(match["seq"])
+            if match["origin"]:
+                doc["host"] = match["origin"]
+            timestamp = _parse_3164_timestamp(match["timestamp"], received_at)
+            clock_unsynced = match["sync"] == "*"
+            rest = match["rest"]
+            # A hostname is present when the first token is not already the message (Cisco '%...' or a tag).
+            first, _, remainder = rest.partition(" ")
+            if "host" not in doc and remainder and _HOST_TOKEN_RE.match(first) and not first.endswith(":") and not first.startswith("%"):
+                doc["host"] = first
+                rest = remainder
+            tag = _TAG_RE.match(rest)
+            if tag and not rest.startswith("%"):
+                doc["app_name"] = tag["app"]
+                doc["procid"] = tag["procid"]
+                rest = tag["msg"]
+            doc["message"] = rest
+        else:
+            doc["format"] = "unknown"
+            pri_match = _PRI_ONLY_RE.match(data)
+            pri = int(pri_match["pri"]) if pri_match else 13 # user.notice, the RFC 3164 default
+            doc["message"] = pri_match["rest"] if pri_match else data
+
+    pri = min(pri, 191)
+    doc["facility"] = pri >> 3
+    doc["severity"] = pri & 7
+    doc["severity_label"] = SEVERITY_LABELS[pri & 7]
+    doc["host"] = doc.get("host") or source_ip
+    mnemonic = _MNEMONIC_RE.search(doc.get("message") or "")
+    if mnemonic:
+        doc["mnemonic"] = mnemonic["mnemonic"]
+    if timestamp is not None:
+        doc["device_time"] = timestamp.isoformat()
+    if timestamp is None or clock_unsynced or abs(timestamp - received_at) > MAX_CLOCK_SKEW:
+        doc["@timestamp"] = received_at.isoformat()
+        doc["time_source"] = "received"
+    else:
+        doc["@timestamp"] = timestamp.isoformat()
+        doc["time_source"] = "device"
+    return doc
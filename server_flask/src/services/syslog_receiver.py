@@ -0,0 +1,201 @@
+"""
+Standalone syslog receiver: listens for syslog over UDP and TCP, parses each message and bulk-writes
+batches into the daily syslog indices (see log_index.py). Run it next to the API with:
+
+    python -m src.services.syslog_receiver
+
+from the server_flask directory. Settings come from config.py (SYSLOG_*, ELASTICSEARCH_*).
+"""
+import asyncio
+from datetime import datetime
+from elasticsearch import Elasticsearch, helpers
+import logging
+import signal
+import time
+from typing import Any, Dict, List, Optional
+
+from .elasticsearch_client import create_es_client
+from .log_index import put_syslog_index_template, syslog_index_name
+from .syslog_parser import parse_syslog_message
+
+logger = logging.getLogger(__name__)
+
+MAX_TCP_FRAME_BYTES = 64 * 1024
+
+
+class _SyslogUDPProtocol(asyncio.DatagramProtocol):
+    def __init__(self, receiver: "SyslogReceiver"):
+        self.receiver = receiver
+
+    def datagram_received(self, data: bytes, addr):
+        self.receiver.submit(data, addr[0])
+
+
+class SyslogReceiver:
+    """
+    asyncio syslog server. UDP datagrams carry one message each; TCP streams use octet counting
+    ('<len> <msg>', RFC 6587) or newline framing, detected per frame. Parsed documents go through a bounded
+    queue to a single writer that flushes every `batch_size` documents or `flush_interval` seconds with one
+    bulk request. When Elasticsearch falls behind and the queue is full, new messages are dropped and counted
+    rather than buffered without limit.
+    """
+
+    def __init__(self, es: Elasticsearch, index_prefix: str = "syslog", host: str = "0.0.0.0",
+                 udp_port: Optional[int] = 5514, tcp_port: Optional[int] = 5514,
+                 batch_size: int = 500, flush_interval: float = 1.0, queue_size: int = 20000):
+        self.es = es
+        self.index_prefix = index_prefix
+        self.host = host
+        self.udp_port = udp_port
+        self.tcp_port = tcp_port
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._stats = {"received": 0, "dropped": 0, "indexed": 0, "index_errors": 0}
+
+    # --- Intake ---
+
+    def submit(self, data: bytes, source_ip: str):
+        self._stats["received"] += 1
+        try:
+            doc = parse_syslog_message(data.decode("utf-8", errors="replace"), source_ip=source_ip)
+        except Exception as e: # Never let one malformed message take the listener down
+            logger.debug(f"Failed to parse syslog message from {source_ip}: {e}")
+            return
+        try:
+            self._queue.put_nowait(doc)
+        except asyncio.QueueFull:
+            self._stats["dropped"] += 1
+            if self._stats["dropped"] % 1000 == 1:
+                logger.warning(f"Syslog queue full; dropped {self._stats['dropped']} message(s) so far.")
+
+    async def _handle_tcp(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        source_ip = (writer.get_extra_info("peername") or ("unknown",))[0]
+        try:
+            while True:
+                first = await reader.read(1)
+                if not first:
+                    break
+                if first.isdigit():
+                    length_digits = first + await reader.readuntil(b" ")
+                    length = int(length_digits[:-1])
+                    if length > MAX_TCP_FRAME_BYTES:
+                        logger.warning(f"Closing syslog TCP connection from {source_ip}: frame of {length} bytes.")
+                        break
+                    self.submit(await reader.readexactly(length), source_ip)
+                else:
+                    line = first + await reader.readuntil(b"\n")
+                    if line.strip():
+                        self.submit(line, source_ip)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError, ConnectionError) as e:
+            logger.debug(f"Syslog TCP connection from {source_ip} ended: {e}")
+        finally:
+            writer.close()
+
+    # --- Output ---
+
+    async def _writer_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch: List[Dict[str, Any]] = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # The ES client is synchronous; the bulk request runs on the default executor so intake keeps going.
+            await loop.run_in_executor(None, self._bulk_index, batch)
+
+    def _bulk_index(self, batch: List[Dict[str, Any]]):
+        actions = (
+            {"_index": syslog_index_name(self.index_prefix, datetime.fromisoformat(doc["@timestamp"])), "_source": doc}
+            for doc in batch
+        )
+        started = time.monotonic()
+        try:
+            indexed, errors = helpers.bulk(self.es, actions, raise_on_error=False, stats_only=True)
+        except Exception as e:
+            self._stats["index_errors"] += len(batch)
+            logger.error(f"Bulk write of {len(batch)} syslog message(s) failed: {e}")
+            return
+        self._stats["indexed"] += indexed
+        self._stats["index_errors"] += errors
+        logger.debug(f"Indexed {indexed} syslog message(s) ({errors} error(s)) in {time.monotonic() - started:.3f}s.")
+
+    # --- Lifecycle ---
+
+    async def serve(self, stop: Optional[asyncio.Event] = None):
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        loop = asyncio.get_running_loop()
+        stop = stop or asyncio.Event()
+        transports = []
+        if self.udp_port:
+            transport, _ = await loop.create_datagram_endpoint(lambda: _SyslogUDPProtocol(self), local_addr=(self.host, self.udp_port))
+            transports.append(transport)
+            logger.info(f"Syslog receiver listening on udp://{self.host}:{self.udp_port}")
+        server = None
+        if self.tcp_port:
+            server = await asyncio.start_server(self._handle_tcp, self.host, self.tcp_port, limit=MAX_TCP_FRAME_BYTES)
+            logger.info(f"Syslog receiver listening on tcp://{self.host}:{self.tcp_port}")
+        writer_task = asyncio.create_task(self._writer_loop())
+        try:
+            await stop.wait()
+        finally:
+            for transport in transports:
+                transport.close()
+            if server is not None:
+                server.close()
+                await server.wait_closed()
+            writer_task.cancel()
+            # Flush whatever is still queued before exiting
+            remaining = []
+            while not self._queue.empty():
+                remaining.append(self._queue.get_nowait())
+            if remaining:
+                await loop.run_in_executor(None, self._bulk_index, remaining)
+            logger.info(f"Syslog receiver stopped: {self.stats()}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, "queued": self._queue.qsize() if self._queue else 0}
+
+
+def create_syslog_receiver(config, es: Optional[Elasticsearch] = None) -> SyslogReceiver:
+    es = es or create_es_client(config)
+    prefix = config.get('SYSLOG_INDEX_PREFIX', 'syslog')
+    put_syslog_index_template(es, prefix)
+    return SyslogReceiver(
+        es,
+        index_prefix=prefix,
+        host=config.get('SYSLOG_BIND_HOST', '0.0.0.0'),
+        udp_port=config.get('SYSLOG_UDP_PORT', 5514),
+        tcp_port=config.get('SYSLOG_TCP_PORT', 5514),
+        batch_size=config.get('SYSLOG_BATCH_SIZE', 500),
+        flush_interval=config.get('SYSLOG_FLUSH_INTERVAL_SECONDS', 1.0),
+        queue_size=config.get('SYSLOG_QUEUE_SIZE', 20000),
+    )
+
+def main():
+    from flask import Config
+    import os
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    config = Config(os.getcwd())
+    config.from_object('config.DevelopmentConfig')
+    receiver = create_syslog_receiver(config)
+
+    async def run():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await receiver.serve(stop)
+
+    asyncio.run(run())
+
+if __name__ == '__main__':
+    main()
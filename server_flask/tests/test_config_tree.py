@@ -0,0 +1,42 @@
+from src.brain_agent.config_tree import ConfigTree
+
+SAMPLE_CONFIG = """\
+hostname edge-1
+!
+vlan 100
+ name users
+!
+interface Ethernet0/1
+ description uplink
+!
+interface GigabitEthernet0/1
+ description core
+ ip address 10.1.100.1 255.255.255.0
+!
+interface Vlan100
+ ip address 10.2.0.1 255.255.255.0
+!
+"""
+
+
+def commands(nodes):
+    return [node.command for node in nodes]
+
+
+def test_find_matches_inside_tokens_even_when_another_token_starts_with_keyword():
+    tree = ConfigTree(SAMPLE_CONFIG)
+    assert commands(tree.find("100")) == [
+        "vlan 100",
+        "ip address 10.1.100.1 255.255.255.0",
+        "interface Vlan100",
+    ]
+
+
+def test_find_matches_interface_name_suffix():
+    tree = ConfigTree(SAMPLE_CONFIG)
+    assert commands(tree.find("ethernet0/1")) == ["interface Ethernet0/1", "interface GigabitEthernet0/1"]
+
+
+def test_find_returns_nothing_for_absent_keyword():
+    tree = ConfigTree(SAMPLE_CONFIG)
+    assert tree.find("ospf") == []
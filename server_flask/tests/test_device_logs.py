@@ -0,0 +1,27 @@
+from src.brain_agent.device_logs import LogCursor, compile_log_filter, filter_log_output
+
+CURSOR = LogCursor("2026 Oct 17 03:00:01 %ETH-4-DOWN: Ethernet1/1 down", "2026 Oct 17 03:00:01",
+                   ("2026", "Oct", "17", "03:00:01"))
+
+
+def test_returns_lines_after_the_last_occurrence_of_the_cursor():
+    raw_logs = (
+        "2026 Oct 17 03:00:01 %ETH-4-DOWN: Ethernet1/1 down\r\n"
+        "2026 Oct 17 03:00:01 %ETH-4-UP: Ethernet1/1 up\r\n"
+        "2026 Oct 17 03:00:01 %ETH-4-DOWN: Ethernet1/1 down\r\n"
+        "2026 Oct 17 03:00:05 %ETH-4-UP: Ethernet1/1 up\r\n"
+    )
+    lines, last_line = filter_log_output(raw_logs, None, 100, CURSOR)
+    assert lines == ["2026 Oct 17 03:00:05 %ETH-4-UP: Ethernet1/1 up"]
+    assert last_line == lines[-1]
+
+
+def test_cursor_as_last_line_means_no_new_lines():
+    raw_logs = "2026 Oct 17 02:59:00 %SYS-5-CONFIG: configured\n" + CURSOR.last_line + "\n"
+    assert filter_log_output(raw_logs, None, 100, CURSOR) == ([], CURSOR.last_line)
+
+
+def test_cursor_must_match_a_whole_line():
+    raw_logs = CURSOR.last_line + " (repeated 2 times)\n2026 Oct 17 03:00:09 %ETH-4-UP: Ethernet1/1 up\n"
+    lines, _ = filter_log_output(raw_logs, compile_log_filter("ethernet1/1"), 100, CURSOR)
+    assert lines == [CURSOR.last_line + " (repeated 2 times)", "2026 Oct 17 03:00:09 %ETH-4-UP: Ethernet1/1 up"]
@@ -0,0 +1,26 @@
+from datetime import datetime, timezone
+
+from src.services.syslog_parser import parse_syslog_message
+
+RECEIVED_AT = datetime(2026, 10, 17, 3, 0, 5, tzinfo=timezone.utc)
+
+
+def test_synchronized_device_time_is_the_timestamp():
+    doc = parse_syslog_message("<189>12: Oct 17 03:00:01.123: %SYS-5-CONFIG_I: Configured", received_at=RECEIVED_AT)
+    assert doc["time_source"] == "device"
+    assert doc["@timestamp"] == doc["device_time"] == "2026-10-17T03:00:01.123000+00:00"
+
+
+def test_unsynchronized_clock_uses_the_receive_time():
+    doc = parse_syslog_message("<189>12: *Oct 17 03:00:01: %SYS-5-CONFIG_I: Configured", received_at=RECEIVED_AT)
+    assert doc["time_source"] == "received"
+    assert doc["@timestamp"] == RECEIVED_AT.isoformat()
+    assert doc["device_time"] == "2026-10-17T03:00:01+00:00"
+
+
+def test_skewed_clock_uses_the_receive_time():
+    doc = parse_syslog_message("<189>12: .Mar  1 00:00:12: %LINK-3-UPDOWN: Interface Gi0/1, changed state to up",
+                               received_at=RECEIVED_AT)
+    assert doc["time_source"] == "received"
+    assert doc["@timestamp"] == RECEIVED_AT.isoformat()
+    assert doc["mnemonic"] == "LINK-3-UPDOWN"